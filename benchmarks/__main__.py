@@ -0,0 +1,92 @@
+"""
+coding=utf-8
+@File   : __main__
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+
+性能基准测试，在仓库根目录执行:
+    python -m benchmarks                       # 执行全部测试，结果写入benchmarks/results，并与baseline.json比较
+    python -m benchmarks --only ws rest        # 只执行部分测试
+    python -m benchmarks --save-baseline       # 把本次结果保存为基准
+    python -m benchmarks --baseline other.json # 与指定的基准比较，文件不存在时直接报错
+有指标比基准差超过threshold时退出码为1
+基准与机器相关，仓库中不提交baseline.json，需要先在同一台机器上用--save-baseline生成(通常在改动前的提交上执行)，
+之后的执行才会比较；默认基准不存在时会提示生成方法，只输出本次结果
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from benchmarks import bench_clickhouse, bench_rest, bench_shm, bench_storage, bench_ws  # noqa: F401 注册测试
+from benchmarks.runner import (
+    BENCHMARKS,
+    DEFAULT_BASELINE_PATH,
+    DEFAULT_THRESHOLD,
+    RESULTS_DIR,
+    BenchmarkConfig,
+    compare,
+    format_report,
+    load_result,
+    run_benchmarks,
+    save_result,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="NoQuantMd性能基准测试")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="只执行的测试组")
+    parser.add_argument("--scale", type=float, default=BenchmarkConfig.scale, help="数据量倍数")
+    parser.add_argument("--repeat", type=int, default=BenchmarkConfig.repeat, help="每项重复次数")
+    parser.add_argument("--work-dir", default="", help="存储测试的临时目录")
+    parser.add_argument("--output", default="", help="结果文件，默认为results/{时间}.json")
+    parser.add_argument("--baseline", default="", help=f"基准文件，默认为{DEFAULT_BASELINE_PATH}，指定时必须存在")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="判定为回退的相对变化")
+    parser.add_argument("--clickhouse-host", default="", help="为空时使用不发送数据的客户端")
+    parser.add_argument("--clickhouse-port", type=int, default=BenchmarkConfig.clickhouse_port)
+    parser.add_argument("--clickhouse-user", default=BenchmarkConfig.clickhouse_user)
+    parser.add_argument("--clickhouse-password", default=BenchmarkConfig.clickhouse_password)
+    args = parser.parse_args()
+    baseline_path = args.baseline or DEFAULT_BASELINE_PATH
+    if args.baseline and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"基准文件{args.baseline}不存在, 先用--save-baseline生成")
+
+    config = BenchmarkConfig(
+        scale=args.scale,
+        repeat=args.repeat,
+        work_dir=args.work_dir,
+        clickhouse_host=args.clickhouse_host,
+        clickhouse_port=args.clickhouse_port,
+        clickhouse_user=args.clickhouse_user,
+        clickhouse_password=args.clickhouse_password,
+    )
+    result = run_benchmarks(config, args.only)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    save_result(result, output)
+    print(f"结果已保存到{output}")
+
+    comparisons = []
+    if args.save_baseline:
+        save_result(result, baseline_path)
+        print(f"基准已保存到{baseline_path}")
+    elif os.path.exists(baseline_path):
+        baseline = load_result(baseline_path)
+        comparisons = compare(result, baseline, args.threshold)
+        print(f"基准: {baseline_path} ({baseline.environment.get('commit', '')} "
+              f"{baseline.environment.get('time', '')})")
+    else:
+        print(f"警告: 基准文件{baseline_path}不存在, 没有与基准比较。"
+              f"先在改动前的提交上执行 python -m benchmarks --save-baseline 生成基准", file=sys.stderr)
+
+    print(format_report(result, comparisons))
+    regressed = [comparison.name for comparison in comparisons if comparison.regressed]
+    if regressed:
+        print(f"性能回退: {regressed}")
+        return 1
+    return 1 if result.errors and not result.metrics else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
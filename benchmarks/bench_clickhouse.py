@@ -0,0 +1,94 @@
+"""
+coding=utf-8
+@File   : bench_clickhouse
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import pyarrow as pa
+
+import core.utils.clickhouse as clickhouse
+from benchmarks.generators import agg_trades_dataframe
+from benchmarks.runner import BenchmarkConfig, Metric, benchmark, best_time
+from core.utils.clickhouse import ClickhouseClient, ClickhouseClientPool
+
+INSERT_ROWS = 1000000
+INSERT_BATCH_SIZE = 100000
+INSERT_WORKERS = 4
+
+AGG_TRADES_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    AggTradeId Int64, Price Float64, Quantity Float64, FirstTradeId Int64, LastTradeId Int64,
+    TradeTimestamp Int64, IsBuyerMaker Bool, IsBestPriceMatch Bool, Turnover Float64, LocalTime Int64,
+    Symbol String, Exchange String, TradingDay Date
+) ENGINE = MergeTree ORDER BY (Symbol, TradeTimestamp)
+"""
+
+
+class NullClient:
+    """
+    不连接ClickHouse的客户端，插入时只把数据编码为Arrow IPC流，用于测量客户端一侧的开销
+    """
+
+    def insert_arrow(self, table_name: str, table: pa.Table, settings: dict = None):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().size
+
+    def command(self, sql):
+        return None
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+def _init_null_insert_worker(connection_params: dict, ipc_path: str):
+    """
+    替换并行插入子进程的initializer，使用NullClient
+    """
+    clickhouse._worker_client = NullClient()
+    clickhouse._worker_table = pa.ipc.open_file(pa.memory_map(ipc_path, "r")).read_all()
+
+
+@benchmark("clickhouse")
+def bench_clickhouse(config: BenchmarkConfig) -> list[Metric]:
+    """
+    insert_dataframe和insert_dataframe_parallel每秒插入的行数
+    未配置clickhouse_host时使用NullClient，只测量转换、分批和多进程分发的开销
+    """
+    df = agg_trades_dataframe("BTCUSDT", "2024-01-01", config.size(INSERT_ROWS))
+    table = config.clickhouse_table
+    stub = not config.clickhouse_host
+    prefix = "clickhouse.stub" if stub else "clickhouse"
+
+    client = ClickhouseClient(config.clickhouse_host or "localhost", config.clickhouse_user,
+                              config.clickhouse_password, port=config.clickhouse_port)
+    init_insert_worker = clickhouse._init_insert_worker
+    if stub:
+        client.pool = ClickhouseClientPool(NullClient)
+        clickhouse._init_insert_worker = _init_null_insert_worker
+    else:
+        client.command(AGG_TRADES_TABLE_SQL.format(table=table))
+
+    def truncate():
+        client.command(f"TRUNCATE TABLE IF EXISTS {table}")
+
+    metrics = []
+    try:
+        duration = best_time(lambda: client.insert_dataframe(table, df, batch_size=INSERT_BATCH_SIZE),
+                             config.repeat, truncate)
+        metrics.append(Metric(f"{prefix}.insert_dataframe", len(df) / duration, "rows/s"))
+
+        duration = best_time(lambda: client.insert_dataframe_parallel(table, df, batch_size=INSERT_BATCH_SIZE,
+                                                                      max_workers=INSERT_WORKERS),
+                             config.repeat, truncate)
+        metrics.append(Metric(f"{prefix}.insert_dataframe_parallel", len(df) / duration, "rows/s"))
+    finally:
+        clickhouse._init_insert_worker = init_insert_worker
+        if not stub:
+            client.command(f"DROP TABLE IF EXISTS {table}")
+        client.close()
+    return metrics
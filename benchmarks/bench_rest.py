@@ -0,0 +1,80 @@
+"""
+coding=utf-8
+@File   : bench_rest
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+from benchmarks.generators import ORIGIN_TIMESTAMP, agg_trade_page, encode, kline_page
+from benchmarks.runner import BenchmarkConfig, Metric, benchmark, best_time
+from core.binance.spot.rest import BinanceSpotDataRestAPi
+from external.common.constant import API_LIMIT_ONE_TIME
+from external.common.object import Interval
+
+KLINE_PAGES = 50
+PARSE_ITERATIONS = 20
+MINUTE_MILLISECONDS = 60 * 1000
+
+
+class _Response:
+    """
+    只包含客户端用到的字段，替代网络请求的响应
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.status_code = 200
+        self.headers = {}
+
+
+def _create_api(request) -> BinanceSpotDataRestAPi:
+    api = BinanceSpotDataRestAPi()
+    api.request = request
+    return api
+
+
+@benchmark("rest")
+def bench_rest(config: BenchmarkConfig) -> list[Metric]:
+    """
+    单页解析耗时和多页K线拼接的吞吐，响应为预先生成的数据，只测量客户端的处理
+    """
+    metrics = []
+    iterations = config.size(PARSE_ITERATIONS)
+
+    kline_content = encode(kline_page(ORIGIN_TIMESTAMP, API_LIMIT_ONE_TIME))
+    api = _create_api(lambda method, path, params=None, **kwargs: _Response(kline_content))
+
+    def parse_klines():
+        for _ in range(iterations):
+            api._query_klines("BTCUSDT", Interval.MINUTE, ORIGIN_TIMESTAMP, ORIGIN_TIMESTAMP)
+
+    duration = best_time(parse_klines, config.repeat)
+    metrics.append(Metric("rest._query_klines.page", duration / iterations * 1000, "ms",
+                          higher_is_better=False))
+
+    agg_trade_content = encode(agg_trade_page(0, API_LIMIT_ONE_TIME))
+    api = _create_api(lambda method, path, params=None, **kwargs: _Response(agg_trade_content))
+
+    def parse_agg_trades():
+        for _ in range(iterations):
+            api._query_agg_trades("BTCUSDT", ORIGIN_TIMESTAMP, ORIGIN_TIMESTAMP)
+
+    duration = best_time(parse_agg_trades, config.repeat)
+    metrics.append(Metric("rest._query_agg_trades.page", duration / iterations * 1000, "ms",
+                          higher_is_better=False))
+
+    # 多页K线: 按startTime返回对应的页，最后一页之后返回空
+    page_count = config.size(KLINE_PAGES)
+    page_ms = API_LIMIT_ONE_TIME * MINUTE_MILLISECONDS
+    pages = {
+        ORIGIN_TIMESTAMP + index * page_ms: encode(kline_page(ORIGIN_TIMESTAMP + index * page_ms,
+                                                              API_LIMIT_ONE_TIME, seed=index))
+        for index in range(page_count)
+    }
+    api = _create_api(lambda method, path, params=None, **kwargs: _Response(pages.get(params["startTime"], b"[]")))
+    end_timestamp = ORIGIN_TIMESTAMP + page_count * page_ms - 1
+    rows = page_count * API_LIMIT_ONE_TIME
+
+    duration = best_time(lambda: api.query_kline("BTCUSDT", Interval.MINUTE, ORIGIN_TIMESTAMP, end_timestamp),
+                         config.repeat)
+    metrics.append(Metric("rest.query_kline.rows", rows / duration, "rows/s"))
+    return metrics
@@ -0,0 +1,117 @@
+"""
+coding=utf-8
+@File   : bench_shm
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import os
+import time
+from multiprocessing import get_context, resource_tracker
+
+import numpy as np
+
+from benchmarks.generators import make_symbols
+from benchmarks.runner import BenchmarkConfig, Metric, benchmark, best_time, latency_metrics
+from core.utils.shm import DEPTH_LEVELS, MD_RECORD_DTYPE, MdShmReader, MdShmWriter
+from core.utils.shm_ring import TICK_RING_DTYPE, ShmRingBuffer
+
+SHM_SYMBOLS = 100
+SHM_OPERATIONS = 100000
+RING_CAPACITY = 1 << 16
+RING_RECORDS = 20000
+RING_WRITE_INTERVAL_US = 50  # 跨进程测试中写入方的写入间隔
+
+
+@benchmark("shm")
+def bench_shm(config: BenchmarkConfig) -> list[Metric]:
+    """
+    行情共享内存的单次读写耗时，以及环形缓冲区跨进程的传递延迟
+    """
+    metrics = []
+    name = f"benchmark_md_{os.getpid()}"
+    symbols = make_symbols(SHM_SYMBOLS)
+    writer = MdShmWriter.create(name, symbols)
+    reader = MdShmReader.attach(name)
+    operations = config.size(SHM_OPERATIONS)
+    try:
+        prices = np.linspace(100, 101, DEPTH_LEVELS)
+        volumes = np.ones(DEPTH_LEVELS)
+
+        def write_ticker():
+            for index in range(operations):
+                writer.write_ticker(index % SHM_SYMBOLS, 100.0, 1000.0, 101.0, 99.0, index)
+
+        def write_depth():
+            for index in range(operations):
+                writer.write_depth(index % SHM_SYMBOLS, prices, volumes, prices, volumes, index)
+
+        out = np.empty((), dtype=MD_RECORD_DTYPE)
+
+        def read():
+            for index in range(operations):
+                reader.read(index % SHM_SYMBOLS, out)
+
+        for label, func in (("write_ticker", write_ticker), ("write_depth", write_depth), ("read", read)):
+            duration = best_time(func, config.repeat)
+            metrics.append(Metric(f"shm.md_store.{label}", duration / operations * 1e9, "ns",
+                                  higher_is_better=False))
+    finally:
+        reader.close()
+        _unlink(writer)
+
+    metrics.extend(latency_metrics("shm.ring.cross_process", _measure_ring_latency(config.size(RING_RECORDS))))
+    return metrics
+
+
+def _measure_ring_latency(count: int) -> np.ndarray:
+    """
+    子进程写入带时间戳的记录，当前进程轮询读取，延迟为读到记录的时间减去写入时间
+    perf_counter_ns在同一台机器的进程间可比较
+    """
+    name = f"benchmark_ring_{os.getpid()}"
+    ring = ShmRingBuffer.create(name, TICK_RING_DTYPE, RING_CAPACITY)
+    samples = np.empty(count, dtype=np.int64)
+    received = 0
+    try:
+        process = get_context("spawn").Process(target=_write_ring, args=(name, count), daemon=True)
+        process.start()
+        cursor = 0
+        while received < count:
+            records, cursor, _ = ring.read_copy(cursor)
+            if not len(records):
+                if not process.is_alive():
+                    break
+                continue
+            now = time.perf_counter_ns()
+            size = min(len(records), count - received)
+            samples[received:received + size] = now - records["exchange_time"][:size]
+            received += size
+        process.join(timeout=10)
+    finally:
+        _unlink(ring)
+    return samples[:received]
+
+
+def _write_ring(name: str, count: int):
+    ring = ShmRingBuffer.attach(name, TICK_RING_DTYPE)
+    interval = RING_WRITE_INTERVAL_US * 1000
+    try:
+        # 等待读取方进入轮询
+        time.sleep(0.5)
+        next_time = time.perf_counter_ns()
+        for _ in range(count):
+            while time.perf_counter_ns() < next_time:
+                pass
+            ring.append((b"BTCUSDT", time.perf_counter_ns(), 0.0, 100.0, 1.0, 100.0, 100.0, 100.0, 100.0))
+            next_time += interval
+    finally:
+        ring.close()
+
+
+def _unlink(store):
+    """
+    同一台机器上的进程共用resource_tracker，读取方attach时的unregister会把创建方的登记一起去掉，
+    删除前重新登记，避免resource_tracker报错
+    """
+    resource_tracker.register(store.shm._name, "shared_memory")
+    store.unlink()
@@ -0,0 +1,51 @@
+"""
+coding=utf-8
+@File   : bench_storage
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import os
+import shutil
+import tempfile
+
+from benchmarks.generators import agg_trades_dataframe
+from benchmarks.runner import BenchmarkConfig, Metric, benchmark, best_time
+from core.utils.storage import DATASET_AGG_TRADERS, STORAGE_CLASSES, create_storage
+
+STORAGE_SYMBOL = "BTCUSDT"
+STORAGE_DAY = "2024-01-01"
+AGG_TRADES_PER_DAY = 1000000
+
+
+@benchmark("storage")
+def bench_storage(config: BenchmarkConfig) -> list[Metric]:
+    """
+    每种存储格式写入和读取一个交易日聚合交易的耗时，以及文件大小
+    """
+    df = agg_trades_dataframe(STORAGE_SYMBOL, STORAGE_DAY, config.size(AGG_TRADES_PER_DAY))
+    root = tempfile.mkdtemp(prefix="benchmark_storage_", dir=config.work_dir or None)
+    metrics = []
+    try:
+        for fmt in STORAGE_CLASSES:
+            storage = create_storage(os.path.join(root, fmt), fmt)
+
+            duration = best_time(lambda: storage.write(df, STORAGE_SYMBOL, DATASET_AGG_TRADERS, STORAGE_DAY),
+                                 config.repeat)
+            metrics.append(Metric(f"storage.{fmt}.write_day", duration * 1000, "ms", higher_is_better=False))
+
+            duration = best_time(lambda: storage.read_day(STORAGE_SYMBOL, DATASET_AGG_TRADERS, STORAGE_DAY),
+                                 config.repeat)
+            metrics.append(Metric(f"storage.{fmt}.read_day", duration * 1000, "ms", higher_is_better=False))
+
+            path = storage.get_partition_path(STORAGE_SYMBOL, DATASET_AGG_TRADERS, STORAGE_DAY)
+            metrics.append(Metric(f"storage.{fmt}.size", _get_size(path) / (1 << 20), "MB", higher_is_better=False))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return metrics
+
+
+def _get_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
@@ -0,0 +1,94 @@
+"""
+coding=utf-8
+@File   : bench_ws
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import os
+import time
+
+from benchmarks.generators import depth_snapshot, make_symbols, ws_messages
+from benchmarks.runner import BenchmarkConfig, Metric, benchmark, best_time
+from core.binance.spot.order_book import DEPTH_UPDATE_CHANNEL, OrderBookManager
+from core.binance.spot.ws import CHANNELS, CHANNEL_TICKER, BinanceSpotDataWebsocketApi
+from core.binance.spot.ws_pipeline import BACKPRESSURE_BLOCK, WebsocketDecodePipeline
+from external.common.object import Exchange, SubscribeRequest
+
+WS_SYMBOLS = 100
+WS_MESSAGES = 100000
+PIPELINE_DECODERS = 2
+PIPELINE_QUEUE_SIZE = 64 * 1024 * 1024
+
+
+@benchmark("ws")
+def bench_on_message(config: BenchmarkConfig) -> list[Metric]:
+    """
+    on_message每个channel每秒处理的消息数，不经过网络，包含解析、分发和更新行情
+    """
+    symbols = make_symbols(WS_SYMBOLS)
+    api = BinanceSpotDataWebsocketApi()
+    order_books = OrderBookManager(lambda symbol: depth_snapshot())
+    api.set_order_books(order_books)
+    for symbol in symbols:
+        api.subscribe(SubscribeRequest(symbol=symbol, exchange=Exchange.BINANCE))
+
+    def sync_order_books():
+        # 直接应用快照，增量消息的序号从1开始
+        for symbol in symbols:
+            book = order_books.get_book(symbol)
+            book.reset()
+            book.apply_snapshot(depth_snapshot())
+
+    metrics = []
+    try:
+        for channel in CHANNELS + [DEPTH_UPDATE_CHANNEL]:
+            messages = ws_messages(channel, symbols, config.size(WS_MESSAGES))
+
+            def run():
+                on_message = api.on_message
+                for message in messages:
+                    on_message(message)
+
+            setup = sync_order_books if channel == DEPTH_UPDATE_CHANNEL else None
+            duration = best_time(run, config.repeat, setup)
+            metrics.append(Metric(f"ws.on_message.{channel}", len(messages) / duration, "msgs/s"))
+    finally:
+        order_books.close()
+    return metrics
+
+
+@benchmark("ws_pipeline")
+def bench_pipeline(config: BenchmarkConfig) -> list[Metric]:
+    """
+    解码流水线模式下接收线程每秒分发的ticker消息数，以及全部消息解码完成的吞吐量
+    """
+    symbols = make_symbols(WS_SYMBOLS)
+    pipeline = WebsocketDecodePipeline(PIPELINE_DECODERS, PIPELINE_QUEUE_SIZE, BACKPRESSURE_BLOCK,
+                                       md_store_prefix=f"benchmark_pipeline_{os.getpid()}")
+    pipeline.start(symbols)
+    api = BinanceSpotDataWebsocketApi()
+    api.set_pipeline(pipeline)
+    messages = ws_messages(CHANNEL_TICKER, symbols, config.size(WS_MESSAGES))
+
+    def wait_drained():
+        while any(frame_queue.frames for frame_queue in pipeline.queues):
+            time.sleep(0.001)
+
+    def run():
+        on_message = api.on_message
+        for message in messages:
+            on_message(message)
+
+    def run_and_drain():
+        run()
+        wait_drained()
+
+    try:
+        dispatch = best_time(run, config.repeat, wait_drained)
+        total = best_time(run_and_drain, config.repeat, wait_drained)
+    finally:
+        pipeline.stop()
+    return [
+        Metric("ws.pipeline.dispatch", len(messages) / dispatch, "msgs/s"),
+        Metric("ws.pipeline.decoded", len(messages) / total, "msgs/s"),
+    ]
@@ -0,0 +1,167 @@
+"""
+coding=utf-8
+@File   : generators
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from core.utils.interval import interval_to_milliseconds
+
+# 合成数据的起始时间，2024-01-01 00:00:00 UTC
+ORIGIN_TIMESTAMP = 1704067200000
+DAY_MILLISECONDS = 86400000
+
+
+def make_symbols(count: int) -> list[str]:
+    """
+    生成count个不重复的小写symbol，如sym0usdt
+    """
+    return [f"sym{index}usdt" for index in range(count)]
+
+
+def _random_walk(rng: np.random.Generator, count: int, start: float = 100.0) -> np.ndarray:
+    return start * np.exp(np.cumsum(rng.normal(0, 0.0005, count)))
+
+
+def kline_page(start_time: int, count: int, interval: str = "1m", seed: int = 0) -> list[list]:
+    """
+    /api/v3/klines格式的一页K线，数值为字符串，与Binance一致
+    """
+    rng = np.random.default_rng(seed)
+    interval_ms = interval_to_milliseconds(interval)
+    close = _random_walk(rng, count)
+    spread = close * rng.uniform(0, 0.002, count)
+    volume = rng.uniform(1, 100, count)
+    trades = rng.integers(10, 1000, count)
+    return [
+        [
+            start_time + index * interval_ms, f"{close[index] - spread[index] / 2:.8f}",
+            f"{close[index] + spread[index]:.8f}", f"{close[index] - spread[index]:.8f}", f"{close[index]:.8f}",
+            f"{volume[index]:.8f}", start_time + (index + 1) * interval_ms - 1, f"{volume[index] * close[index]:.8f}",
+            int(trades[index]), f"{volume[index] / 2:.8f}", f"{volume[index] * close[index] / 2:.8f}", "0",
+        ]
+        for index in range(count)
+    ]
+
+
+def agg_trade_page(first_id: int, count: int, start_time: int = ORIGIN_TIMESTAMP, seed: int = 0) -> list[dict]:
+    """
+    /api/v3/aggTrades格式的一页聚合交易
+    """
+    rng = np.random.default_rng(seed)
+    price = _random_walk(rng, count)
+    qty = rng.uniform(0.001, 2, count)
+    times = start_time + np.cumsum(rng.integers(0, 50, count))
+    maker = rng.random(count) < 0.5
+    return [
+        {
+            "a": first_id + index, "p": f"{price[index]:.8f}", "q": f"{qty[index]:.8f}",
+            "f": (first_id + index) * 2, "l": (first_id + index) * 2 + 1, "T": int(times[index]),
+            "m": bool(maker[index]), "M": True,
+        }
+        for index in range(count)
+    ]
+
+
+def encode(data) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def ws_messages(channel: str, symbols: list[str], count: int, seed: int = 0) -> list[str]:
+    """
+    combined stream格式的websocket消息，按symbol轮流生成
+    :param channel: ticker、depth10、kline_1m或depth@100ms
+    """
+    rng = np.random.default_rng(seed)
+    prices = _random_walk(rng, count)
+    update_ids = {symbol: 0 for symbol in symbols}
+    messages = []
+    for index in range(count):
+        symbol = symbols[index % len(symbols)]
+        price = prices[index]
+        event_time = ORIGIN_TIMESTAMP + index
+        if channel == "ticker":
+            data = {
+                "e": "24hrTicker", "E": event_time, "s": symbol.upper(), "p": "0.1", "P": "0.1",
+                "w": f"{price:.8f}", "o": f"{price * 0.99:.8f}", "h": f"{price * 1.01:.8f}",
+                "l": f"{price * 0.98:.8f}", "c": f"{price:.8f}", "v": "12345.678", "q": "1234567.89",
+                "O": event_time - DAY_MILLISECONDS, "C": event_time, "F": 0, "L": 1000, "n": 1000,
+            }
+        elif channel.startswith("depth@"):
+            first_id = update_ids[symbol] + 1
+            update_ids[symbol] = first_id + int(rng.integers(0, 5))
+            data = {
+                "e": "depthUpdate", "E": event_time, "s": symbol.upper(), "U": first_id, "u": update_ids[symbol],
+                "b": _levels(rng, price, -1, 3), "a": _levels(rng, price, 1, 3),
+            }
+        elif channel.startswith("depth"):
+            levels = int(channel[5:] or 10)
+            data = {"lastUpdateId": index, "bids": _levels(rng, price, -1, levels),
+                    "asks": _levels(rng, price, 1, levels)}
+        elif channel.startswith("kline_"):
+            open_time = event_time - event_time % 60000
+            data = {"e": "kline", "E": event_time, "s": symbol.upper(), "k": {
+                "t": open_time, "T": open_time + 59999, "s": symbol.upper(), "i": channel[6:], "f": 0, "L": 100,
+                "o": f"{price:.8f}", "c": f"{price:.8f}", "h": f"{price * 1.001:.8f}", "l": f"{price * 0.999:.8f}",
+                "v": "100.0", "n": 100, "x": index % 2 == 0, "q": f"{price * 100:.8f}", "V": "50.0",
+                "Q": f"{price * 50:.8f}", "B": "0",
+            }}
+        else:
+            raise ValueError(f"不支持的channel: {channel}")
+        messages.append(json.dumps({"stream": f"{symbol}@{channel}", "data": data}, separators=(",", ":")))
+    return messages
+
+
+def depth_snapshot(price: float = 100.0, levels: int = 100, last_update_id: int = 0, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    return {"lastUpdateId": last_update_id, "bids": _levels(rng, price, -1, levels),
+            "asks": _levels(rng, price, 1, levels)}
+
+
+def _levels(rng: np.random.Generator, price: float, side: int, count: int) -> list[list[str]]:
+    tick = price * 0.0001
+    return [[f"{price + side * tick * (n + 1):.8f}", f"{rng.uniform(0, 10):.8f}"] for n in range(count)]
+
+
+def klines_dataframe(symbol: str, day: str, interval: str = "1m", seed: int = 0) -> pd.DataFrame:
+    """
+    一个交易日的K线，列与K线存储一致
+    """
+    start = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+    count = DAY_MILLISECONDS // interval_to_milliseconds(interval)
+    rng = np.random.default_rng(seed)
+    close = _random_walk(rng, count)
+    volume = rng.uniform(1, 100, count)
+    return pd.DataFrame({
+        "ExchangeTime": start + np.arange(count, dtype=np.int64) * interval_to_milliseconds(interval),
+        "Open": close * 0.9995, "High": close * 1.001, "Low": close * 0.999, "Close": close,
+        "Volume": volume, "Turnover": volume * close,
+        "NumberOfTrades": rng.integers(10, 1000, count),
+        "TakerBuyBaseAssetVolume": volume / 2, "TakerBuyQuoteAssetVolume": volume * close / 2,
+        "LocalTime": start + np.arange(count, dtype=np.int64) * interval_to_milliseconds(interval) + 100,
+        "Symbol": symbol.upper(), "Exchange": "BINANCE", "Interval": interval, "OpenInterest": 0.0,
+        "TradingDay": day,
+    })
+
+
+def agg_trades_dataframe(symbol: str, day: str, count: int, seed: int = 0) -> pd.DataFrame:
+    """
+    一个交易日的聚合交易，列与聚合交易存储一致
+    """
+    start = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+    rng = np.random.default_rng(seed)
+    price = _random_walk(rng, count)
+    qty = rng.uniform(0.001, 2, count)
+    ids = np.arange(count, dtype=np.int64)
+    times = start + np.sort(rng.integers(0, DAY_MILLISECONDS, count))
+    return pd.DataFrame({
+        "AggTradeId": ids, "Price": price, "Quantity": qty, "FirstTradeId": ids * 2, "LastTradeId": ids * 2 + 1,
+        "TradeTimestamp": times, "IsBuyerMaker": rng.random(count) < 0.5, "IsBestPriceMatch": True,
+        "Turnover": price * qty, "LocalTime": times + 100, "Symbol": symbol.upper(), "Exchange": "BINANCE",
+        "TradingDay": day,
+    })
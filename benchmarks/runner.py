@@ -0,0 +1,195 @@
+"""
+coding=utf-8
+@File   : runner
+@Author : LiHan
+@Time   : 10/21/26:5:30 PM
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.1  # 比基准差超过10%视为性能回退
+
+
+@dataclass
+class BenchmarkConfig:
+    scale: float = 1.0  # 数据量倍数，调小可以快速冒烟
+    repeat: int = 5  # 每项重复次数，取最好的一次
+    work_dir: str = ""  # 存储类测试的临时目录
+    clickhouse_host: str = ""  # 为空时ClickHouse测试使用不发送数据的客户端
+    clickhouse_port: int = 8123
+    clickhouse_user: str = "default"
+    clickhouse_password: str = ""
+    clickhouse_table: str = "benchmark_agg_trades"
+
+    def size(self, base: int) -> int:
+        return max(int(base * self.scale), 1)
+
+
+@dataclass
+class Metric:
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = True
+
+
+@dataclass
+class Comparison:
+    name: str
+    value: float
+    baseline: float
+    change: float  # 相对基准的变化，正数表示变好
+    regressed: bool
+
+
+@dataclass
+class BenchmarkResult:
+    metrics: dict[str, Metric] = field(default_factory=dict)
+    errors: dict[str, str] = field(default_factory=dict)
+    environment: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "environment": self.environment,
+            "metrics": {name: asdict(metric) for name, metric in self.metrics.items()},
+            "errors": self.errors,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BenchmarkResult":
+        return cls(
+            metrics={name: Metric(**metric) for name, metric in data.get("metrics", {}).items()},
+            errors=data.get("errors", {}),
+            environment=data.get("environment", {}),
+        )
+
+
+# 测试组名称 -> 测试函数，测试函数返回该组的全部指标
+BENCHMARKS: dict[str, Callable[[BenchmarkConfig], list[Metric]]] = {}
+
+
+def benchmark(name: str):
+    """
+    注册一组测试
+    """
+    def decorator(func: Callable[[BenchmarkConfig], list[Metric]]):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def best_time(func: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> float:
+    """
+    重复执行取最短耗时，秒，最短耗时受系统噪声影响最小
+    :param setup: 每次执行前调用，不计入耗时
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def latency_metrics(name: str, samples_ns: np.ndarray) -> list[Metric]:
+    """
+    延迟样本(纳秒)的p50和p99，单位微秒
+    """
+    p50, p99 = np.percentile(samples_ns, [50, 99]) / 1000
+    return [
+        Metric(f"{name}.p50", float(p50), "us", higher_is_better=False),
+        Metric(f"{name}.p99", float(p99), "us", higher_is_better=False),
+    ]
+
+
+def run_benchmarks(config: BenchmarkConfig, names: Optional[list[str]] = None) -> BenchmarkResult:
+    """
+    执行测试，单组失败(如缺少ClickHouse)不影响其他组
+    """
+    result = BenchmarkResult(environment=get_environment())
+    for name, func in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        start = time.perf_counter()
+        try:
+            for metric in func(config):
+                result.metrics[metric.name] = metric
+        except Exception as e:
+            result.errors[name] = f"{type(e).__name__}: {e}"
+            print(f"[{name}] 失败: {result.errors[name]}")
+            continue
+        print(f"[{name}] 完成, 耗时{time.perf_counter() - start:.1f}秒")
+    return result
+
+
+def compare(result: BenchmarkResult, baseline: BenchmarkResult,
+            threshold: float = DEFAULT_THRESHOLD) -> list[Comparison]:
+    """
+    与基准比较，只比较双方都有的指标
+    """
+    comparisons = []
+    for name, metric in result.metrics.items():
+        base = baseline.metrics.get(name)
+        if base is None or not base.value:
+            continue
+        change = metric.value / base.value - 1
+        if not metric.higher_is_better:
+            change = -change
+        comparisons.append(Comparison(name, metric.value, base.value, change, change < -threshold))
+    return comparisons
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=BENCHMARK_DIR, timeout=10).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_result(result: BenchmarkResult, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result.to_dict(), f, indent=2, ensure_ascii=False)
+
+
+def load_result(path: str) -> BenchmarkResult:
+    with open(path) as f:
+        return BenchmarkResult.from_dict(json.load(f))
+
+
+def format_report(result: BenchmarkResult, comparisons: list[Comparison]) -> str:
+    by_name = {comparison.name: comparison for comparison in comparisons}
+    lines = [f"{'指标':<48}{'结果':>16}  {'单位':<8}{'基准':>16}{'变化':>10}"]
+    for name, metric in result.metrics.items():
+        comparison = by_name.get(name)
+        if comparison is None:
+            lines.append(f"{name:<50}{metric.value:>16.2f}  {metric.unit:<10}")
+        else:
+            flag = "  <-- 回退" if comparison.regressed else ""
+            lines.append(f"{name:<50}{metric.value:>16.2f}  {metric.unit:<10}{comparison.baseline:>16.2f}"
+                         f"{comparison.change:>+10.1%}{flag}")
+    for name, error in result.errors.items():
+        lines.append(f"{name:<50}失败: {error}")
+    return "\n".join(lines)
@@ -0,0 +1,202 @@
+"""
+coding=utf-8
+@File   : decode
+@Author : LiHan
+@Time   : 10/18/26:9:40 AM
+"""
+import json
+import time
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from core.utils.metrics import UNIT_NANOSECONDS, counter, histogram
+
+try:
+    import orjson
+
+    def loads(content: Union[bytes, str]):
+        return orjson.loads(content)
+except ImportError:  # orjson为可选依赖，未安装时退回标准库
+    def loads(content: Union[bytes, str]):
+        return json.loads(content)
+
+# K线数组的字段: (下标, 列名, 类型)，API文档：https://developers.binance.com/docs/binance-spot-api-docs/rest-api/market-data-endpoints#klinecandlestick-data
+KLINE_FIELDS = [
+    (0, "ExchangeTime", np.int64),
+    (1, "Open", np.float64),
+    (2, "High", np.float64),
+    (3, "Low", np.float64),
+    (4, "Close", np.float64),
+    (5, "Volume", np.float64),
+    (6, "CloseTime", np.int64),
+    (7, "Turnover", np.float64),
+    (8, "NumberOfTrades", np.int64),
+    (9, "TakerBuyBaseAssetVolume", np.float64),
+    (10, "TakerBuyQuoteAssetVolume", np.float64),
+]
+
+# 聚合交易的字段: (json key, 列名, 类型)
+AGG_TRADE_FIELDS = [
+    ("a", "AggTradeId", np.int64),
+    ("p", "Price", np.float64),
+    ("q", "Quantity", np.float64),
+    ("f", "FirstTradeId", np.int64),
+    ("l", "LastTradeId", np.int64),
+    ("T", "TradeTimestamp", np.int64),
+    ("m", "IsBuyerMaker", np.bool_),
+    ("M", "IsBestPriceMatch", np.bool_),
+]
+
+# 历史交易的字段: (json key, 列名, 类型)
+HISTORICAL_TRADE_FIELDS = [
+    ("id", "Id", np.int64),
+    ("price", "Price", np.float64),
+    ("qty", "Quantity", np.float64),
+    ("quoteQty", "QuoteQuantity", np.float64),
+    ("time", "Time", np.int64),
+    ("isBuyerMaker", "IsBuyerMaker", np.bool_),
+    ("isBestMatch", "IsBestMatch", np.bool_),
+]
+
+Columns = dict[str, np.ndarray]
+
+REST_PAGES = counter("md_rest_pages_total", "rest接口解析的数据页数", ["dataset"])
+REST_ROWS = counter("md_rest_rows_total", "rest接口解析的数据行数", ["dataset"])
+REST_DECODE_SECONDS = histogram("md_rest_decode_seconds", "rest接口单页数据的解析耗时", ["dataset"],
+                                unit=UNIT_NANOSECONDS)
+
+
+class _PageMetrics:
+    """
+    单个数据集的分页统计，回补时按pages/rows的增长速度计算吞吐
+    """
+    __slots__ = ("pages", "rows", "decode")
+
+    def __init__(self, dataset: str):
+        self.pages = REST_PAGES.labels(dataset)
+        self.rows = REST_ROWS.labels(dataset)
+        self.decode = REST_DECODE_SECONDS.labels(dataset)
+
+    def record(self, rows: int, start: int):
+        self.pages.inc()
+        self.rows.inc(rows)
+        self.decode.record(time.perf_counter_ns() - start)
+
+
+_KLINE_METRICS = _PageMetrics("klines")
+_AGG_TRADE_METRICS = _PageMetrics("agg_trades")
+_HISTORICAL_TRADE_METRICS = _PageMetrics("historical_trades")
+
+
+def decode_klines(data: list, local_time: int) -> Columns:
+    """
+    将K线接口返回的二维数组解析为带类型的列
+    :param data: json解析后的K线数组
+    :param local_time: 本地接收时间，毫秒
+    :return: 列名 -> numpy数组，没有数据时返回空字典
+    """
+    if not data:
+        return {}
+    start = time.perf_counter_ns()
+    # 每行长度相同，可以直接转换为二维object数组，再按列转换类型
+    rows = np.array(data, dtype=object)
+    columns = {name: rows[:, index].astype(dtype) for index, name, dtype in KLINE_FIELDS}
+    columns["LocalTime"] = np.full(len(data), local_time, dtype=np.int64)
+    _KLINE_METRICS.record(len(data), start)
+    return columns
+
+
+def decode_agg_trades(data: list[dict], local_time: int) -> Columns:
+    """
+    将聚合交易接口返回的对象数组解析为带类型的列
+    """
+    if not data:
+        return {}
+    start = time.perf_counter_ns()
+    columns = _decode_records(data, AGG_TRADE_FIELDS)
+    columns["Turnover"] = columns["Price"] * columns["Quantity"]
+    columns["LocalTime"] = np.full(len(data), local_time, dtype=np.int64)
+    _AGG_TRADE_METRICS.record(len(data), start)
+    return columns
+
+
+def decode_historical_trades(data: list[dict], local_time: int) -> Columns:
+    """
+    将历史交易接口返回的对象数组解析为带类型的列
+    """
+    if not data:
+        return {}
+    start = time.perf_counter_ns()
+    columns = _decode_records(data, HISTORICAL_TRADE_FIELDS)
+    columns["LocalTime"] = np.full(len(data), local_time, dtype=np.int64)
+    _HISTORICAL_TRADE_METRICS.record(len(data), start)
+    return columns
+
+
+def _decode_records(data: list[dict], fields: list) -> Columns:
+    # 数值字段是字符串，numpy在构造数组时直接解析，避免先生成object列再逐列astype
+    return {name: np.array([row[key] for row in data], dtype=dtype) for key, name, dtype in fields}
+
+
+class ColumnBuffer:
+    """
+    按列预分配的numpy缓冲区，用于拼接多页查询结果
+    容量不足时按倍数扩容，避免每页都pd.concat整个结果
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.size = 0
+        self.columns: Columns = {}
+
+    def __len__(self):
+        return self.size
+
+    def append(self, columns: Columns, mask: Optional[np.ndarray] = None):
+        """
+        追加一页数据
+        :param columns: 列名 -> numpy数组
+        :param mask: 需要保留的行，None表示全部保留
+        """
+        if not columns:
+            return
+        if mask is not None:
+            columns = {name: values[mask] for name, values in columns.items()}
+        count = len(next(iter(columns.values())))
+        if count == 0:
+            return
+
+        if not self.columns:
+            self.capacity = max(self.capacity, count)
+            self.columns = {name: np.empty(self.capacity, dtype=values.dtype) for name, values in columns.items()}
+        elif self.size + count > self.capacity:
+            self._grow(self.size + count)
+
+        for name, values in columns.items():
+            self.columns[name][self.size:self.size + count] = values
+        self.size += count
+
+    def last(self, name: str):
+        """
+        最后一行的值，缓冲区为空时返回None
+        """
+        if not self.size:
+            return None
+        return self.columns[name][self.size - 1]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        if not self.size:
+            return pd.DataFrame()
+        return pd.DataFrame({name: values[:self.size] for name, values in self.columns.items()}, copy=False)
+
+    def _grow(self, required: int):
+        capacity = self.capacity
+        while capacity < required:
+            capacity *= 2
+        for name, values in self.columns.items():
+            new_values = np.empty(capacity, dtype=values.dtype)
+            new_values[:self.size] = values[:self.size]
+            self.columns[name] = new_values
+        self.capacity = capacity
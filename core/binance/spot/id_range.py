@@ -0,0 +1,128 @@
+"""
+coding=utf-8
+@File   : id_range
+@Author : LiHan
+@Time   : 10/24/26:10:30 AM
+"""
+from typing import Generator, Optional
+
+import numpy as np
+
+from core.binance.spot.decode import ColumnBuffer, Columns
+from external.common.constant import API_LIMIT_ONE_TIME
+from external.utils.log import logger
+
+QUERY_AGG_TRADES = "agg_trades"  # 聚合交易单页查询，参数同_query_agg_trades_columns
+QUERY_HISTORICAL_TRADES = "historical_trades"  # 历史交易单页查询，参数同_query_historical_trades_columns
+
+# 定位步骤: 生成器每次yield一组互不依赖的单页查询[(查询类型, 参数)]，调用方执行后把结果列表send回来，
+# 生成器结束时返回定位结果。同步和异步客户端共用定位逻辑，只是执行查询的方式不同
+Query = tuple[str, dict]
+IdRangeSteps = Generator[list[Query], list[Columns], Optional[tuple[int, int]]]
+
+
+def split_id_range(first_id: int, last_id: int) -> list[tuple[int, int]]:
+    """
+    把ID范围切成每页1000条的分片
+    :return: [(from_id, limit)]
+    """
+    return [
+        (page_start, min(API_LIMIT_ONE_TIME, last_id - page_start + 1))
+        for page_start in range(first_id, last_id + 1, API_LIMIT_ONE_TIME)
+    ]
+
+
+def find_missing_ids(pages: list[Columns], key: str, first_id: int, last_id: int) -> list[tuple[int, int]]:
+    """
+    查找分页结果中缺失的ID范围
+    :return: 缺失的ID范围列表[(开始, 结束)]，均为闭区间
+    """
+    ids = [page[key] for page in pages if page]
+    if not ids:
+        return [(first_id, last_id)]
+    ids = np.unique(np.concatenate(ids))
+    ids = ids[(ids >= first_id) & (ids <= last_id)]
+    if not len(ids):
+        return [(first_id, last_id)]
+
+    missing = []
+    if ids[0] > first_id:
+        missing.append((first_id, int(ids[0]) - 1))
+    breaks = np.nonzero(np.diff(ids) > 1)[0]
+    for index in breaks:
+        missing.append((int(ids[index]) + 1, int(ids[index + 1]) - 1))
+    if ids[-1] < last_id:
+        missing.append((int(ids[-1]) + 1, last_id))
+    return missing
+
+
+def merge_id_pages(pages: list[Columns], key: str, first_id: int, last_id: int) -> Columns:
+    """
+    按ID拼接并发请求的分页结果，去掉重复和范围外的数据，并校验ID连续
+    :raise ValueError: ID不连续
+    """
+    pages = [page for page in pages if page]
+    pages.sort(key=lambda page: page[key][0])
+    buffer = ColumnBuffer(last_id - first_id + 1)
+    for page in pages:
+        last = buffer.last(key)
+        mask = page[key] <= last_id
+        if last is not None:
+            mask &= page[key] > last
+        buffer.append(page, mask)
+
+    ids = buffer.columns[key][:len(buffer)] if len(buffer) else np.empty(0, dtype=np.int64)
+    if len(ids) != last_id - first_id + 1 or ids[0] != first_id or ids[-1] != last_id:
+        raise ValueError(
+            f"{key}不连续: 期望{first_id}-{last_id}共{last_id - first_id + 1}条, 实际{len(ids)}条"
+        )
+    return {name: values[:len(buffer)] for name, values in buffer.columns.items()}
+
+
+def find_trade_id_range(symbol: str, start_timestamp: int, end_timestamp: int) -> IdRangeSteps:
+    """
+    查找时间范围内第一条和最后一条交易的ID
+    先由聚合交易的FirstTradeId/LastTradeId定位，没有聚合交易时按时间二分查找
+    :return: (first_id, last_id)，时间范围内没有交易时返回None
+    """
+    # 同一笔聚合交易内的成交时间相同，聚合交易的首尾成交ID就是准确的边界
+    first, after = yield [
+        (QUERY_AGG_TRADES, {"start_timestamp": start_timestamp, "limit": 1}),
+        (QUERY_AGG_TRADES, {"start_timestamp": end_timestamp + 1, "limit": 1}),
+    ]
+    if first:
+        if first["TradeTimestamp"][0] > end_timestamp:
+            return None
+        first_id = int(first["FirstTradeId"][0])
+
+        if after:
+            last_id = int(after["FirstTradeId"][0]) - 1
+        else:
+            latest, = yield [(QUERY_AGG_TRADES, {"limit": 1})]
+            if not latest:
+                return None
+            last_id = int(latest["LastTradeId"][0])
+        return (first_id, last_id) if last_id >= first_id else None
+
+    logger.warning(f"{symbol}无法通过聚合交易定位交易ID, 按时间二分查找")
+    latest, = yield [(QUERY_HISTORICAL_TRADES, {"limit": 1})]
+    if not latest:
+        return None
+    latest_id = int(latest["Id"][0])
+    first_id = yield from _search_trade_id(start_timestamp, 0, latest_id + 1)
+    last_id = (yield from _search_trade_id(end_timestamp + 1, first_id, latest_id + 1)) - 1
+    return (first_id, last_id) if last_id >= first_id else None
+
+
+def _search_trade_id(timestamp: int, low: int, high: int) -> Generator[list[Query], list[Columns], int]:
+    """
+    二分查找[low, high)中第一条成交时间不早于timestamp的交易ID，不存在时返回high
+    """
+    while low < high:
+        middle = (low + high) // 2
+        trade, = yield [(QUERY_HISTORICAL_TRADES, {"from_id": middle, "limit": 1})]
+        if not trade or trade["Time"][0] >= timestamp:
+            high = middle
+        else:
+            low = middle + 1
+    return low
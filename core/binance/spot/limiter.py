@@ -0,0 +1,176 @@
+"""
+coding=utf-8
+@File   : limiter
+@Author : LiHan
+@Time   : 10/17/26:11:05 AM
+"""
+import threading
+import time
+from typing import Optional
+
+from core.utils.constant import REST_WEIGHT_LIMIT_1M, REST_WEIGHT_SAFETY_RATIO
+from core.utils.metrics import counter, gauge, histogram
+
+HEADER_USED_WEIGHT_1M = "X-MBX-USED-WEIGHT-1M"
+HEADER_RETRY_AFTER = "Retry-After"
+
+# 各接口的请求权重，API文档：https://developers.binance.com/docs/binance-spot-api-docs/rest-api/market-data-endpoints
+ENDPOINT_WEIGHTS = {
+    "/api/v3/time": 1,
+    "/api/v3/klines": 2,
+    "/api/v3/aggTrades": 4,
+    "/api/v3/historicalTrades": 25,
+    "/api/v3/ticker/tradingDay": 4,
+}
+DEFAULT_WEIGHT = 1
+
+# depth接口权重随limit变化: (limit上限, 权重)
+DEPTH_WEIGHTS = [(100, 5), (500, 25), (1000, 50), (5000, 250)]
+# ticker/tradingDay按symbol数量计权，上限200
+TRADING_DAY_TICKER_MAX_WEIGHT = 200
+
+# 429/418 未返回Retry-After时的退避参数，秒
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# 同步和异步rest api共用的请求统计
+REST_REQUEST_SECONDS = histogram("md_rest_request_seconds", "rest请求耗时，不含限流等待", ["path"])
+REST_RESPONSES = counter("md_rest_responses_total", "rest响应数", ["path", "status"])
+REST_USED_WEIGHT = gauge("md_rest_used_weight_1m", "服务器返回的最近1分钟已用权重").labels()
+REST_BACKOFF_SECONDS = counter("md_rest_backoff_seconds_total", "被限流后累计的退避时间").labels()
+
+
+def get_request_weight(path: str, params: Optional[dict] = None) -> int:
+    """
+    计算请求的权重
+    :param path: 请求路径，如/api/v3/klines
+    :param params: 请求参数
+    :return: 权重
+    """
+    params = params or {}
+    if path == "/api/v3/depth":
+        limit = int(params.get("limit", 100))
+        for max_limit, weight in DEPTH_WEIGHTS:
+            if limit <= max_limit:
+                return weight
+        return DEPTH_WEIGHTS[-1][1]
+    if path == "/api/v3/ticker/tradingDay" and "symbols" in params:
+        symbols = params["symbols"]
+        count = len(symbols) if isinstance(symbols, (list, tuple)) else symbols.count(",") + 1
+        return min(ENDPOINT_WEIGHTS[path] * count, TRADING_DAY_TICKER_MAX_WEIGHT)
+    return ENDPOINT_WEIGHTS.get(path, DEFAULT_WEIGHT)
+
+
+def record_request(path: str, status_code: int, start: float):
+    """
+    记录一次rest请求
+    :param path: 请求路径
+    :param status_code: HTTP状态码
+    :param start: 发出请求时的time.perf_counter()
+    """
+    REST_REQUEST_SECONDS.labels(path).record(int((time.perf_counter() - start) * 1000000))
+    REST_RESPONSES.labels(path, status_code).inc()
+
+
+class RequestWeightLimiter:
+    """
+    基于令牌桶的请求权重限流器，线程安全
+    令牌按 limit / interval 的速率匀速补充，同时根据响应头中服务器统计的已用权重校准，
+    在收到429/418时暂停所有请求直到Retry-After结束
+    """
+
+    def __init__(self, weight_limit: int = REST_WEIGHT_LIMIT_1M, interval_seconds: float = 60,
+                 safety_ratio: float = REST_WEIGHT_SAFETY_RATIO):
+        self.capacity = weight_limit * safety_ratio
+        self.refill_rate = self.capacity / interval_seconds
+
+        self.tokens = self.capacity
+        self.last_refill_time = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff_count = 0
+
+        self._lock = threading.Lock()
+
+    def reserve(self, weight: int) -> float:
+        """
+        预占权重，不阻塞
+        :param weight: 请求权重
+        :return: 调用方在发出请求前需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # 允许令牌为负数，后续请求按欠额排队，保证先到先得
+            self.tokens -= weight
+            wait = -self.tokens / self.refill_rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self, weight: int):
+        """
+        阻塞直到可以发出请求
+        :param weight: 请求权重
+        """
+        wait = self.reserve(weight)
+        if wait > 0:
+            time.sleep(wait)
+
+    def update_used_weight(self, used_weight: int):
+        """
+        根据服务器返回的已用权重校准本地令牌
+        :param used_weight: X-MBX-USED-WEIGHT-1M的值
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used_weight)
+
+    def block(self, seconds: float):
+        """
+        暂停所有请求
+        :param seconds: 暂停时长，秒
+        """
+        with self._lock:
+            self._block(seconds)
+
+    def on_response(self, status_code: int, headers) -> float:
+        """
+        处理响应头，更新令牌并在被限流时设置退避
+        :param status_code: HTTP状态码
+        :param headers: 响应头
+        :return: 需要退避的秒数，0表示请求未被限流
+        """
+        used_weight = headers.get(HEADER_USED_WEIGHT_1M)
+        if used_weight is not None:
+            REST_USED_WEIGHT.set(int(used_weight))
+            self.update_used_weight(int(used_weight))
+
+        retry_after = headers.get(HEADER_RETRY_AFTER)
+        with self._lock:
+            if status_code not in (429, 418):
+                self.backoff_count = 0
+                return 0.0
+            # 多个线程同时被限流时，退避次数和退避时长在锁内一起计算，每个响应各占一次指数
+            if retry_after is not None:
+                seconds = float(retry_after)
+            else:
+                seconds = min(BACKOFF_BASE_SECONDS * 2 ** self.backoff_count, BACKOFF_MAX_SECONDS)
+            self.backoff_count += 1
+            self._block(seconds)
+        REST_BACKOFF_SECONDS.inc(seconds)
+        return seconds
+
+    @property
+    def used_ratio(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return 1 - max(self.tokens, 0) / self.capacity
+
+    def _block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    def _refill(self, now: float):
+        elapsed = now - self.last_refill_time
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.last_refill_time = now
+
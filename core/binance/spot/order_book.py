@@ -0,0 +1,244 @@
+"""
+coding=utf-8
+@File   : order_book
+@Author : LiHan
+@Time   : 10/19/26:2:10 PM
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import neg
+from typing import Callable, Optional
+
+import numpy as np
+from sortedcontainers import SortedDict
+
+from external.utils.log import logger
+
+DEPTH_UPDATE_CHANNEL = "depth@100ms"
+ORDER_BOOK_SNAPSHOT_WORKERS = 4  # 同时下载盘口快照的线程数
+MAX_BUFFERED_EVENTS = 10000  # 等待快照期间最多缓存的增量数量，超过后丢弃并重新同步
+
+
+class OrderBook:
+    """
+    由增量深度推送维护的本地盘口，线程安全
+    同步流程参考API文档：https://developers.binance.com/docs/binance-spot-api-docs/web-socket-streams#how-to-manage-a-local-order-book-correctly
+    1. 订阅depth@100ms后先缓存增量，再请求REST快照
+    2. 丢弃u <= lastUpdateId的增量，第一条应用的增量需满足 U <= lastUpdateId + 1 <= u
+    3. 之后每条增量的U必须等于上一条的u + 1(快照后的第一条允许与快照重叠)，否则说明丢包，需要重新同步
+    价格档位保存在SortedDict中，买盘按价格从高到低，卖盘按价格从低到高
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = SortedDict(neg)
+        self.asks = SortedDict()
+        self.last_update_id = 0
+        self.synced = False
+        self.event_time = 0
+
+        self.buffer: list[dict] = []
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        清空盘口并回到未同步状态
+        """
+        with self.lock:
+            self._reset()
+
+    def on_update(self, event: dict) -> bool:
+        """
+        处理一条增量推送
+        :param event: depthUpdate数据，包含U、u、b、a
+        :return: False表示序号不连续，需要重新同步
+        """
+        with self.lock:
+            if not self.synced:
+                if len(self.buffer) >= MAX_BUFFERED_EVENTS:
+                    self.buffer.clear()
+                    return False
+                self.buffer.append(event)
+                return True
+
+            if event['u'] <= self.last_update_id:
+                return True
+            if event['U'] > self.last_update_id + 1:
+                logger.warning("{} 盘口增量不连续, 期望U={}, 收到U={}",
+                               self.symbol, self.last_update_id + 1, event['U'])
+                self._reset()
+                return False
+            self._apply(event)
+            return True
+
+    def apply_snapshot(self, snapshot: dict) -> bool:
+        """
+        应用REST快照，并重放缓存的增量
+        :param snapshot: /api/v3/depth返回的数据
+        :return: 是否同步成功，快照早于缓存的增量或缓存的增量与快照衔接不上时返回False
+        """
+        with self.lock:
+            last_update_id = snapshot['lastUpdateId']
+            events = [event for event in self.buffer if event['u'] > last_update_id]
+            if events and events[0]['U'] > last_update_id + 1:
+                # 快照比缓存的增量还旧，需要重新请求快照
+                return False
+
+            self.bids.clear()
+            self.asks.clear()
+            _update_levels(self.bids, snapshot['bids'])
+            _update_levels(self.asks, snapshot['asks'])
+            self.last_update_id = last_update_id
+
+            for event in events:
+                if event['U'] > self.last_update_id + 1:
+                    self._reset()
+                    return False
+                self._apply(event)
+
+            self.buffer.clear()
+            self.synced = True
+            return True
+
+    @property
+    def best_bid(self) -> Optional[tuple[float, float]]:
+        with self.lock:
+            return self.bids.peekitem(0) if self.bids else None
+
+    @property
+    def best_ask(self) -> Optional[tuple[float, float]]:
+        with self.lock:
+            return self.asks.peekitem(0) if self.asks else None
+
+    def top(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        前n档盘口
+        :return: (买盘, 卖盘)，形状为(档位数, 2)的[价格, 数量]数组，按从优到劣排列
+        """
+        with self.lock:
+            return _top_levels(self.bids, n), _top_levels(self.asks, n)
+
+    def cumulative_depth(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        前n档的累计深度
+        :return: (买盘, 卖盘)，形状为(档位数, 2)的[价格, 到该价格为止的累计数量]数组
+        """
+        bids, asks = self.top(n)
+        bids[:, 1] = np.cumsum(bids[:, 1])
+        asks[:, 1] = np.cumsum(asks[:, 1])
+        return bids, asks
+
+    def depth_within(self, ratio: float) -> tuple[float, float]:
+        """
+        中间价上下ratio范围内的挂单量，如ratio=0.01表示±1%
+        :return: (买盘数量, 卖盘数量)
+        """
+        with self.lock:
+            if not self.bids or not self.asks:
+                return 0.0, 0.0
+            mid = (self.bids.peekitem(0)[0] + self.asks.peekitem(0)[0]) / 2
+            # 买盘的key是价格的相反数，SortedKeyList.irange会对minimum/maximum同样应用neg，
+            # 即取key在[-mid, -mid * (1 - ratio)]内的档位，也就是价格在[mid * (1 - ratio), mid]内的买盘
+            bid_volume = sum(self.bids[price] for price in self.bids.irange(minimum=mid, maximum=mid * (1 - ratio)))
+            ask_volume = sum(self.asks[price] for price in self.asks.irange(maximum=mid * (1 + ratio)))
+            return bid_volume, ask_volume
+
+    def _apply(self, event: dict):
+        _update_levels(self.bids, event['b'])
+        _update_levels(self.asks, event['a'])
+        self.last_update_id = event['u']
+        self.event_time = event.get('E', self.event_time)
+
+    def _reset(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.buffer.clear()
+        self.last_update_id = 0
+        self.synced = False
+
+
+class OrderBookManager:
+    """
+    管理多个symbol的本地盘口
+    websocket线程调用on_update推送增量，需要同步时在线程池中请求快照，不阻塞websocket线程
+    """
+
+    def __init__(self, query_snapshot: Callable[[str], dict], max_workers: int = ORDER_BOOK_SNAPSHOT_WORKERS):
+        """
+        :param query_snapshot: 查询盘口快照的函数，参数为交易所的symbol，如BinanceSpotDataRestAPi.query_depth
+        :param max_workers: 同时请求快照的线程数
+        """
+        self.query_snapshot = query_snapshot
+        self.books: dict[str, OrderBook] = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="order_book_snapshot")
+
+        self._syncing: set[str] = set()
+        self._lock = threading.Lock()
+
+    def add_symbol(self, symbol: str) -> OrderBook:
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol)
+        return book
+
+    def get_book(self, symbol: str) -> Optional[OrderBook]:
+        return self.books.get(symbol)
+
+    def on_update(self, symbol: str, event: dict):
+        """
+        处理增量推送，未同步时自动请求快照
+        """
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        book.on_update(event)
+        if not book.synced:
+            self._request_snapshot(book)
+
+    def reset(self):
+        """
+        websocket重连后调用，所有盘口需要重新同步
+        """
+        for book in self.books.values():
+            book.reset()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _request_snapshot(self, book: OrderBook):
+        with self._lock:
+            if book.symbol in self._syncing:
+                return
+            self._syncing.add(book.symbol)
+        self.executor.submit(self._sync, book)
+
+    def _sync(self, book: OrderBook):
+        try:
+            snapshot = self.query_snapshot(book.symbol.upper())
+            if book.apply_snapshot(snapshot):
+                logger.info("{} 盘口同步完成, lastUpdateId={}", book.symbol, book.last_update_id)
+            else:
+                logger.warning("{} 盘口快照与增量衔接失败, 等待下一条增量后重新同步", book.symbol)
+        except Exception:
+            logger.exception(f"{book.symbol} 请求盘口快照失败")
+        finally:
+            with self._lock:
+                self._syncing.discard(book.symbol)
+
+
+def _update_levels(levels: SortedDict, updates: list):
+    for price, volume in updates:
+        price = float(price)
+        volume = float(volume)
+        if volume == 0:
+            levels.pop(price, None)
+        else:
+            levels[price] = volume
+
+
+def _top_levels(levels: SortedDict, n: int) -> np.ndarray:
+    count = min(n, len(levels))
+    res = np.empty((count, 2))
+    for index in range(count):
+        res[index] = levels.peekitem(index)
+    return res
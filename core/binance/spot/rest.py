@@ -5,17 +5,40 @@ coding=utf-8
 @Time   : 3/16/25:12:50 PM
 """
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Callable, Optional
 
 import pandas as pd
 
-from core.utils.constant import Security
+from core.binance.spot.decode import (
+    ColumnBuffer,
+    Columns,
+    decode_agg_trades,
+    decode_historical_trades,
+    decode_klines,
+    loads,
+)
+from core.binance.spot.id_range import (
+    QUERY_AGG_TRADES,
+    QUERY_HISTORICAL_TRADES,
+    find_missing_ids,
+    find_trade_id_range,
+    merge_id_pages,
+    split_id_range,
+)
+from core.binance.spot.limiter import RequestWeightLimiter, get_request_weight, record_request
+from core.utils.constant import Security, REST_RATE_LIMIT_MAX_RETRY
 from external.common.constant import API_LIMIT_ONE_TIME
 from external.common.env import REST_API_DATA_BASE_URL
 from external.common.object import Exchange, Interval
 from external.rest.rest import RestClient, RestRequest
 from external.utils.log import logger
 
+AGG_TRADES_SHARD_WORKERS = 8  # 按AggTradeId分片并发下载的线程数
+HISTORICAL_TRADES_WORKERS = 8  # 按交易ID分片并发下载的线程数
+DEPTH_SNAPSHOT_LIMIT = 1000  # 盘口快照默认档位数，权重50
+
 
 class BinanceSpotDataRestAPi(RestClient):
 
@@ -23,17 +46,45 @@ class BinanceSpotDataRestAPi(RestClient):
         super(BinanceSpotDataRestAPi, self).__init__()
         self.gateway_name = "binance_spot_data_rest_api"
         self.time_offset = 0  # 服务器时间偏移, 毫秒
+        self.limiter = RequestWeightLimiter()  # 多线程共享同一个限流器
 
     def connect(
-            self, proxy_host: str, proxy_port: int):
+            self, proxy_host: str, proxy_port: int, url_base: Optional[str] = None):
+        """
+        :param url_base: 默认为REST_API_DATA_BASE_URL，可以指向本地的BinanceSimulator
+        """
         self.init(
-            url_base=REST_API_DATA_BASE_URL,
+            url_base=url_base or REST_API_DATA_BASE_URL,
             proxy_host=proxy_host,
             proxy_port=proxy_port,
         )
         self.start()
         self.query_time()
 
+    def request(self, method: str, path: str, params: dict = None, data: dict = None, headers: dict = None):
+        """
+        发送同步请求，按接口权重限流，遇到429/418时按Retry-After退避后重试
+        """
+        weight = get_request_weight(path, params)
+        for _ in range(REST_RATE_LIMIT_MAX_RETRY):
+            self.limiter.acquire(weight)
+            start = time.perf_counter()
+            response = super(BinanceSpotDataRestAPi, self).request(
+                method, path, params=params, data=data, headers=headers
+            )
+            record_request(path, response.status_code, start)
+            backoff = self.limiter.on_response(response.status_code, response.headers)
+            if not backoff:
+                return response
+
+            if response.status_code == 418:
+                logger.error(f"{self.gateway_name} IP已被封禁, 请求{path}暂停{backoff:.1f}秒")
+            else:
+                logger.warning(f"{self.gateway_name} 请求{path}触发限流, 退避{backoff:.1f}秒")
+
+        response.raise_for_status()
+        return response
+
     def query_time(self):
         """
         查询服务器时间
@@ -58,31 +109,32 @@ class BinanceSpotDataRestAPi(RestClient):
         :param end_timestamp: 结束时间
         """
         current_start = start_timestamp
-        all_data = []
+        buffer = ColumnBuffer()
         while current_start < end_timestamp:
-            df = self._query_klines(symbol, interval, current_start, end_timestamp)
-            if df.empty:
+            columns = self._query_kline_columns(symbol, interval, current_start, end_timestamp)
+            if not columns:
                 break
-            df["Symbol"] = symbol
-            df["Exchange"] = Exchange.BINANCE.value
-            df["Interval"] = interval.value
-            df["OpenInterest"] = 0
-            all_data.append(df)
+
+            # 分页之间只可能在边界处重复，只需要和已有的最后一条比较
+            last_open_ts = buffer.last("ExchangeTime")
+            buffer.append(columns, None if last_open_ts is None else columns["ExchangeTime"] > last_open_ts)
 
             # 获取最后一条数据的 CloseTimestamp
-            last_close_ts = df.iloc[-1]["CloseTime"]
+            last_close_ts = int(columns["CloseTime"][-1])
             if last_close_ts >= end_timestamp:
                 break
             # 避免重复数据，下一次从 last_close_ts + 1 毫秒开始
             current_start = last_close_ts + 1
 
-        if all_data:
-            res = pd.concat(all_data, ignore_index=True)
-            res.drop_duplicates(subset=["ExchangeTime"], keep="first", inplace=True)
-            res.drop(columns=["CloseTime"], inplace=True)
+        res = buffer.to_dataframe()
+        if res.empty:
             return res
-        else:
-            return pd.DataFrame()
+        res.drop(columns=["CloseTime"], inplace=True)
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        res["Interval"] = interval.value
+        res["OpenInterest"] = 0
+        return res
 
     def query_trading_day_ticker(self, symbol: str, ticker_type: str = "FULL") -> pd.DataFrame:
         """
@@ -100,6 +152,21 @@ class BinanceSpotDataRestAPi(RestClient):
         else:
             return pd.DataFrame()
 
+    def query_depth(self, symbol: str, limit: int = DEPTH_SNAPSHOT_LIMIT) -> dict:
+        """
+        查询盘口快照，API文档：https://developers.binance.com/docs/binance-spot-api-docs/rest-api/market-data-endpoints#order-book
+        :param symbol: 交易Symbol，如BTCUSDT
+        :param limit: 档位数量，最大5000，权重随档位数量增加
+        :return: {"lastUpdateId": int, "bids": [[价格, 数量], ...], "asks": [[价格, 数量], ...]}
+        """
+        response = self.request(
+            "GET",
+            "/api/v3/depth",
+            params={'symbol': symbol, 'limit': limit}
+        )
+        response.raise_for_status()
+        return loads(response.content)
+
     def query_agg_trades(self, symbol: str, start_timestamp: int, end_timestamp: int) -> pd.DataFrame:
         """
         查询aggregated trades
@@ -109,83 +176,143 @@ class BinanceSpotDataRestAPi(RestClient):
         :return: DataFrame
         """
         current_start = start_timestamp
-        all_data = []
+        buffer = ColumnBuffer()
         while current_start < end_timestamp:
-            df = self._query_agg_trades(symbol, current_start, end_timestamp)
-            if df.empty:
+            columns = self._query_agg_trades_columns(symbol, current_start, end_timestamp)
+            if not columns:
                 break
 
-            df["Symbol"] = symbol
-            df["Exchange"] = Exchange.BINANCE.value
-            all_data.append(df)
+            last_id = buffer.last("AggTradeId")
+            buffer.append(columns, None if last_id is None else columns["AggTradeId"] > last_id)
 
             # 获取最后一条数据的时间戳
-            last_timestamp = df.iloc[-1]["Timestamp"]
+            last_timestamp = int(columns["TradeTimestamp"][-1])
             if last_timestamp >= end_timestamp:
                 break
             # 避免重复数据，下一次从 last_timestamp + 1 毫秒开始
             current_start = last_timestamp + 1
 
-        if all_data:
-            res = pd.concat(all_data, ignore_index=True)
-            res.drop_duplicates(subset=["AggTradeId"], keep="first", inplace=True)
+        res = buffer.to_dataframe()
+        if res.empty:
             return res
-        else:
-            return pd.DataFrame()
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        return res
 
-    def query_historical_trades(self, symbol: str, start_timestamp: int, end_timestamp: int) -> pd.DataFrame:
+    def query_agg_trades_sharded(self, symbol: str, start_timestamp: int, end_timestamp: int,
+                                 max_workers: int = AGG_TRADES_SHARD_WORKERS) -> pd.DataFrame:
         """
-        查询历史交易数据
+        按AggTradeId范围并发查询aggregated trades
+        先定位时间范围首尾的AggTradeId，再把ID范围切成每页1000条的分片用fromId并发请求，
+        分片之间没有依赖，最后按ID拼接并校验ID连续
         :param symbol: 交易Symbol，如BTCUSDT
         :param start_timestamp: 开始时间
         :param end_timestamp: 结束时间
+        :param max_workers: 并发线程数
         :return: DataFrame
         """
-        current_id = None
-        all_data = []
-
-        # 初始获取最新交易
-        df = self._query_historical_trades(symbol)
-        if df.empty:
+        id_range = self._find_agg_trade_id_range(symbol, start_timestamp, end_timestamp)
+        if id_range is None:
             return pd.DataFrame()
 
-        # 筛选时间范围内的交易
-        df = df[df["Time"].between(start_timestamp, end_timestamp)]
-        if not df.empty:
-            df["Symbol"] = symbol
-            df["Exchange"] = Exchange.BINANCE.value
-            all_data.append(df)
-            current_id = df["Id"].min() - 1
-
-        # 继续获取更早的交易
-        while current_id and current_id > 0:
-            df = self._query_historical_trades(symbol, from_id=current_id)
-            if df.empty:
-                break
-
-            # 筛选时间范围内的交易
-            df = df[df["Time"].between(start_timestamp, end_timestamp)]
-            if df.empty:
-                break
-
-            df["Symbol"] = symbol
-            df["Exchange"] = Exchange.BINANCE.value
-            all_data.append(df)
-
-            # 检查是否已经获取到足够早的交易
-            min_time = df["Time"].min()
-            if min_time < start_timestamp:
-                break
-
-            current_id = df["Id"].min() - 1
+        columns = self._query_id_range_parallel(
+            lambda from_id, limit: self._query_agg_trades_columns(symbol, limit=limit, from_id=from_id),
+            *id_range, key="AggTradeId", max_workers=max_workers
+        )
+        res = pd.DataFrame(columns)
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        return res
 
-        if all_data:
-            res = pd.concat(all_data, ignore_index=True)
-            res.drop_duplicates(subset=["Id"], keep="first", inplace=True)
-            return res
+    def _find_agg_trade_id_range(self, symbol: str, start_timestamp: int, end_timestamp: int):
+        """
+        查找时间范围内第一条和最后一条聚合交易的AggTradeId
+        :return: (first_id, last_id)，时间范围内没有交易时返回None
+        """
+        first = self._query_agg_trades_columns(symbol, start_timestamp=start_timestamp, limit=1)
+        if not first or first["TradeTimestamp"][0] > end_timestamp:
+            return None
+        first_id = int(first["AggTradeId"][0])
+
+        # 结束时间之后的第一条交易的前一条即为最后一条，交易日未结束时取最新一条
+        after = self._query_agg_trades_columns(symbol, start_timestamp=end_timestamp + 1, limit=1)
+        if after:
+            last_id = int(after["AggTradeId"][0]) - 1
         else:
+            latest = self._query_agg_trades_columns(symbol, limit=1)
+            if not latest:
+                return None
+            last_id = int(latest["AggTradeId"][0])
+        if last_id < first_id:
+            return None
+        return first_id, last_id
+
+    def _query_id_range_parallel(self, query_page: Callable[[int, int], Columns], first_id: int, last_id: int,
+                                 key: str, max_workers: int) -> Columns:
+        """
+        把ID范围切成每页1000条的分片，用fromId并发请求后按ID拼接，并校验ID连续
+        :param query_page: 分页查询函数，参数为(from_id, limit)
+        :param first_id: 第一条ID
+        :param last_id: 最后一条ID(闭区间)
+        :param key: ID列名
+        :param max_workers: 并发线程数
+        :return: 拼接后的列
+        """
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="id_range_shard") as executor:
+            pages = list(executor.map(lambda page: query_page(*page), split_id_range(first_id, last_id)))
+
+            # 缺失的ID范围重新请求一次
+            missing = find_missing_ids(pages, key, first_id, last_id)
+            if missing:
+                logger.warning(f"{self.gateway_name} {key}缺失{len(missing)}段, 重新请求")
+                pages.extend(executor.map(
+                    lambda id_range: _query_id_range(query_page, key, *id_range),
+                    missing
+                ))
+        return merge_id_pages(pages, key, first_id, last_id)
+
+    def query_historical_trades(self, symbol: str, start_timestamp: int, end_timestamp: int,
+                                max_workers: int = HISTORICAL_TRADES_WORKERS) -> pd.DataFrame:
+        """
+        查询历史交易数据
+        先由聚合交易的FirstTradeId/LastTradeId定位时间范围首尾的交易ID(失败时按时间二分查找)，
+        再把ID范围切片并发请求
+        :param symbol: 交易Symbol，如BTCUSDT
+        :param start_timestamp: 开始时间
+        :param end_timestamp: 结束时间
+        :param max_workers: 并发线程数
+        :return: DataFrame
+        """
+        id_range = self._find_trade_id_range(symbol, start_timestamp, end_timestamp)
+        if id_range is None:
             return pd.DataFrame()
 
+        columns = self._query_id_range_parallel(
+            lambda from_id, limit: self._query_historical_trades_columns(symbol, from_id, limit),
+            *id_range, key="Id", max_workers=max_workers
+        )
+        res = pd.DataFrame(columns)
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        return res
+
+    def _find_trade_id_range(self, symbol: str, start_timestamp: int, end_timestamp: int):
+        """
+        查找时间范围内第一条和最后一条交易的ID，定位逻辑见id_range.find_trade_id_range
+        :return: (first_id, last_id)，时间范围内没有交易时返回None
+        """
+        queries = {
+            QUERY_AGG_TRADES: self._query_agg_trades_columns,
+            QUERY_HISTORICAL_TRADES: self._query_historical_trades_columns,
+        }
+        steps = find_trade_id_range(symbol, start_timestamp, end_timestamp)
+        results = None
+        try:
+            while True:
+                results = [queries[name](symbol, **params) for name, params in steps.send(results)]
+        except StopIteration as e:
+            return e.value
+
     def _query_klines(self, symbol: str, interval: Interval, start_timestamp: int, end_timestamp: int,
                       limit=API_LIMIT_ONE_TIME) -> pd.DataFrame:
         """
@@ -197,6 +324,13 @@ class BinanceSpotDataRestAPi(RestClient):
         :param limit: 单次请求的K线数量
         :return: K线数据, DataFrame格式
         """
+        return pd.DataFrame(self._query_kline_columns(symbol, interval, start_timestamp, end_timestamp, limit))
+
+    def _query_kline_columns(self, symbol: str, interval: Interval, start_timestamp: int, end_timestamp: int,
+                             limit=API_LIMIT_ONE_TIME) -> Columns:
+        """
+        获取一页K线数据，直接解析为带类型的numpy列
+        """
         path = "/api/v3/klines"
 
         params = {
@@ -213,22 +347,7 @@ class BinanceSpotDataRestAPi(RestClient):
             params=params
         )
 
-        data = response.json()
-        columns = ['OpenTime', 'Open', 'High', 'Low', 'Close', 'Volume', 'CloseTime',
-                   'QuoteAssetVolume', 'NumberOfTrades', 'TakerBuyBaseAssetVolume',
-                   'TakerBuyQuoteAssetVolume', 'Ignore']
-
-        df = pd.DataFrame(data, columns=columns)
-
-        # 转换时间戳为可读格式
-        df["LocalTime"] = int(datetime.now().timestamp() * 1000)
-        df.rename({
-            "OpenTime": "ExchangeTime",
-            "QuoteAssetVolume": "Turnover"
-        }, axis=1, inplace=True)
-        df.drop(columns=["Ignore"], inplace=True)
-
-        return df
+        return decode_klines(loads(response.content), int(datetime.now().timestamp() * 1000))
 
     def _query_agg_trades(self, symbol: str, start_timestamp: int, end_timestamp: int,
                           limit=API_LIMIT_ONE_TIME) -> pd.DataFrame:
@@ -240,14 +359,26 @@ class BinanceSpotDataRestAPi(RestClient):
         :param limit: 单次请求的数据数量，默认1000
         :return: 聚合交易数据，DataFrame格式
         """
+        return pd.DataFrame(self._query_agg_trades_columns(symbol, start_timestamp, end_timestamp, limit))
+
+    def _query_agg_trades_columns(self, symbol: str, start_timestamp: int = None, end_timestamp: int = None,
+                                  limit=API_LIMIT_ONE_TIME, from_id: int = None) -> Columns:
+        """
+        获取一页聚合交易数据，直接解析为带类型的numpy列
+        :param from_id: 从哪个AggTradeId开始获取，指定时按ID分页
+        """
         path = "/api/v3/aggTrades"
 
         params = {
             'symbol': symbol,
-            'startTime': start_timestamp,
-            'endTime': end_timestamp,
             'limit': limit
         }
+        if from_id is not None:
+            params['fromId'] = from_id
+        if start_timestamp is not None:
+            params['startTime'] = start_timestamp
+        if end_timestamp is not None:
+            params['endTime'] = end_timestamp
 
         response = self.request(
             "GET",
@@ -255,53 +386,30 @@ class BinanceSpotDataRestAPi(RestClient):
             params=params
         )
 
-        data = response.json()
-        if not data:
-            return pd.DataFrame()
+        return decode_agg_trades(loads(response.content), int(datetime.now().timestamp() * 1000))
 
-        # 将API返回的数据转换为DataFrame
-        df = pd.DataFrame(data)
-
-        # 重命名列名以提高可读性
-        df.rename(columns={
-            "a": "AggTradeId",
-            "p": "Price",
-            "q": "Volume",
-            "f": "FirstTradeId",
-            "l": "LastTradeId",
-            "T": "TradeTimestamp",
-            "m": "IsBuyerMaker",
-            "M": "IsBestPriceMatch"
-        }, inplace=True)
-
-        # 转换数据类型
-        df["Price"] = df["Price"].astype(float)
-        df["Quantity"] = df["Quantity"].astype(float)
-        df["Turnover"] = df["Price"] * df["Quantity"]
-        df["LocalTime"] = int(datetime.now().timestamp() * 1000)
-
-        return df
-
-    # FIXME: 未完成
     def _query_historical_trades(self, symbol: str, from_id: int = None, limit=API_LIMIT_ONE_TIME) -> pd.DataFrame:
         """
         获取历史交易数据
         :param symbol: 交易Symbol，如BTCUSDT
-        :param from_id: 从哪个交易ID开始获取
+        :param from_id: 从哪个交易ID开始获取，为None时返回最新的交易
         :param limit: 单次请求的数据数量，默认1000
         :return: 历史交易数据，DataFrame格式
         """
+        return pd.DataFrame(self._query_historical_trades_columns(symbol, from_id, limit))
+
+    def _query_historical_trades_columns(self, symbol: str, from_id: int = None, limit=API_LIMIT_ONE_TIME) -> Columns:
+        """
+        获取一页历史交易数据，直接解析为带类型的numpy列
+        """
         path = "/api/v3/historicalTrades"
 
         params = {
             'symbol': symbol,
             'limit': limit
         }
-
         if from_id is not None:
             params['fromId'] = from_id
-        else:
-            params['fromId'] = 0
 
         response = self.request(
             "GET",
@@ -309,31 +417,7 @@ class BinanceSpotDataRestAPi(RestClient):
             params=params
         )
 
-        data = response.json()
-        if not data:
-            return pd.DataFrame()
-
-        # 将API返回的数据转换为DataFrame
-        df = pd.DataFrame(data)
-
-        # 重命名列名以提高可读性
-        df.rename(columns={
-            "id": "Id",
-            "price": "Price",
-            "qty": "Quantity",
-            "quoteQty": "QuoteQuantity",
-            "time": "Time",
-            "isBuyerMaker": "IsBuyerMaker",
-            "isBestMatch": "IsBestMatch"
-        }, inplace=True)
-
-        # 转换数据类型
-        df["Price"] = df["Price"].astype(float)
-        df["Quantity"] = df["Quantity"].astype(float)
-        df["QuoteQuantity"] = df["QuoteQuantity"].astype(float)
-        df["LocalTime"] = int(datetime.now().timestamp() * 1000)
-
-        return df
+        return decode_historical_trades(loads(response.content), int(datetime.now().timestamp() * 1000))
 
     def _query_trading_day_ticker(self, symbol: str, ticker_type: str = "FULL") -> pd.DataFrame:
         """
@@ -390,3 +474,18 @@ class BinanceSpotDataRestAPi(RestClient):
         self.time_offset = local_time - server_time
 
         logger.info(f"Server time updated, local offset: {self.time_offset}ms")
+
+
+def _query_id_range(query_page: Callable[[int, int], Columns], key: str, from_id: int, to_id: int) -> Columns:
+    """
+    顺序分页查询一个ID范围
+    """
+    buffer = ColumnBuffer(to_id - from_id + 1)
+    current_id = from_id
+    while current_id <= to_id:
+        columns = query_page(current_id, min(API_LIMIT_ONE_TIME, to_id - current_id + 1))
+        if not columns:
+            break
+        buffer.append(columns, columns[key] <= to_id)
+        current_id = int(columns[key][-1]) + 1
+    return {name: values[:len(buffer)] for name, values in buffer.columns.items()}
@@ -0,0 +1,334 @@
+"""
+coding=utf-8
+@File   : rest_async
+@Author : LiHan
+@Time   : 10/18/26:11:20 AM
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Coroutine, Iterable, Optional
+
+import aiohttp
+import pandas as pd
+
+from core.binance.spot.decode import (
+    ColumnBuffer,
+    Columns,
+    decode_agg_trades,
+    decode_historical_trades,
+    decode_klines,
+    loads,
+)
+from core.binance.spot.id_range import (
+    QUERY_AGG_TRADES,
+    QUERY_HISTORICAL_TRADES,
+    find_missing_ids,
+    find_trade_id_range,
+    merge_id_pages,
+    split_id_range,
+)
+from core.binance.spot.limiter import RequestWeightLimiter, get_request_weight, record_request
+from core.utils.constant import REST_RATE_LIMIT_MAX_RETRY
+from core.utils.interval import interval_to_milliseconds
+from external.common.constant import API_LIMIT_ONE_TIME
+from external.common.env import REST_API_DATA_BASE_URL
+from external.common.object import Exchange, Interval
+from external.utils.log import logger
+
+DEFAULT_MAX_IN_FLIGHT = 32  # 同时在途的请求数
+DEFAULT_AGG_TRADES_WINDOW_MILLISECONDS = 60 * 60 * 1000  # 聚合交易按时间窗口并发下载
+
+
+class BinanceSpotDataAsyncRestApi:
+    """
+    基于asyncio的行情rest api，用于大批量历史数据查询
+    接口与BinanceSpotDataRestAPi保持一致(query_kline / query_agg_trades / query_historical_trades)，
+    相互独立的时间窗口在同一个keep-alive连接池上并发请求，任意请求失败或取消外层任务时会取消所有在途请求
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, limiter: Optional[RequestWeightLimiter] = None):
+        self.gateway_name = "binance_spot_data_async_rest_api"
+        self.url_base = REST_API_DATA_BASE_URL
+        self.proxy: Optional[str] = None
+        self.time_offset = 0  # 服务器时间偏移, 毫秒
+
+        self.max_in_flight = max_in_flight
+        # 可以和同步版本共享限流器，使两者的请求权重合并计算
+        self.limiter = limiter or RequestWeightLimiter()
+
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def connect(self, proxy_host: str = "", proxy_port: int = 0, url_base: Optional[str] = None):
+        if url_base:
+            self.url_base = url_base
+        if proxy_host and proxy_port:
+            self.proxy = f"http://{proxy_host}:{proxy_port}"
+
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        await self.query_time()
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        if self.session is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def request(self, method: str, path: str, params: dict = None):
+        """
+        发送请求并解析json，按接口权重限流，遇到429/418时按Retry-After退避后重试
+        """
+        weight = get_request_weight(path, params)
+        async with self.semaphore:
+            for _ in range(REST_RATE_LIMIT_MAX_RETRY):
+                wait = self.limiter.reserve(weight)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                url = self.url_base + path
+                start = time.perf_counter()
+                async with self.session.request(method, url, params=params, proxy=self.proxy) as response:
+                    content = await response.read()
+                    record_request(path, response.status, start)
+                    backoff = self.limiter.on_response(response.status, response.headers)
+                    if not backoff:
+                        response.raise_for_status()
+                        return loads(content)
+
+                    if response.status == 418:
+                        logger.error(f"{self.gateway_name} IP已被封禁, 请求{path}暂停{backoff:.1f}秒")
+                    else:
+                        logger.warning(f"{self.gateway_name} 请求{path}触发限流, 退避{backoff:.1f}秒")
+            response.raise_for_status()
+
+    async def query_time(self):
+        """
+        查询服务器时间
+        """
+        data = await self.request("GET", "/api/v3/time")
+        local_time = int(time.time() * 1000)
+        self.time_offset = local_time - int(data["serverTime"])
+        logger.info(f"Server time updated, local offset: {self.time_offset}ms")
+
+    async def query_kline(self, symbol: str, interval: Interval, start_timestamp: int,
+                          end_timestamp: int) -> pd.DataFrame:
+        """
+        查询K线数据，按每页的时间跨度切分窗口后全部并发请求
+        :param symbol: 交易Symbol，如BTCUSDT
+        :param interval: K线周期
+        :param start_timestamp: 开始时间
+        :param end_timestamp: 结束时间
+        """
+        window_ms = interval_to_milliseconds(interval) * API_LIMIT_ONE_TIME
+        windows = [
+            (start, min(start + window_ms - 1, end_timestamp))
+            for start in range(start_timestamp, end_timestamp + 1, window_ms)
+        ]
+        pages = await _run_all(
+            self._query_kline_columns(symbol, interval, start, end) for start, end in windows
+        )
+
+        res = _merge_pages(pages, "ExchangeTime")
+        if res.empty:
+            return res
+        res.drop(columns=["CloseTime"], inplace=True)
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        res["Interval"] = interval.value
+        res["OpenInterest"] = 0
+        return res
+
+    async def query_agg_trades(self, symbol: str, start_timestamp: int, end_timestamp: int,
+                               window_ms: int = DEFAULT_AGG_TRADES_WINDOW_MILLISECONDS) -> pd.DataFrame:
+        """
+        查询aggregated trades，按时间窗口并发请求，每个窗口内顺序分页
+        :param symbol: 交易Symbol，如BTCUSDT
+        :param start_timestamp: 开始时间
+        :param end_timestamp: 结束时间
+        :param window_ms: 并发窗口大小，毫秒
+        :return: DataFrame
+        """
+        windows = [
+            (start, min(start + window_ms - 1, end_timestamp))
+            for start in range(start_timestamp, end_timestamp + 1, window_ms)
+        ]
+        pages = await _run_all(
+            self._query_agg_trades_window(symbol, start, end) for start, end in windows
+        )
+
+        res = _merge_pages(pages, "AggTradeId")
+        if res.empty:
+            return res
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        return res
+
+    async def query_historical_trades(self, symbol: str, start_timestamp: int, end_timestamp: int) -> pd.DataFrame:
+        """
+        查询历史交易数据
+        先由聚合交易的FirstTradeId/LastTradeId定位时间范围首尾的交易ID(失败时按时间二分查找)，
+        再把ID范围按每页1000条切片后全部并发请求
+        :param symbol: 交易Symbol，如BTCUSDT
+        :param start_timestamp: 开始时间
+        :param end_timestamp: 结束时间
+        :return: DataFrame
+        """
+        id_range = await self._find_trade_id_range(symbol, start_timestamp, end_timestamp)
+        if id_range is None:
+            return pd.DataFrame()
+
+        first_id, last_id = id_range
+        pages = await self._query_id_pages(symbol, first_id, last_id)
+        # 缺失的ID范围重新请求一次，仍不连续时merge_id_pages抛出异常
+        missing = find_missing_ids(pages, "Id", first_id, last_id)
+        if missing:
+            logger.warning(f"{self.gateway_name} Id缺失{len(missing)}段, 重新请求")
+            for start, end in missing:
+                pages.extend(await self._query_id_pages(symbol, start, end))
+
+        res = pd.DataFrame(merge_id_pages(pages, "Id", first_id, last_id))
+        res["Symbol"] = symbol
+        res["Exchange"] = Exchange.BINANCE.value
+        return res
+
+    async def _query_id_pages(self, symbol: str, first_id: int, last_id: int) -> list[Columns]:
+        return await _run_all(
+            self._query_historical_trades_columns(symbol, from_id, limit)
+            for from_id, limit in split_id_range(first_id, last_id)
+        )
+
+    async def _find_trade_id_range(self, symbol: str, start_timestamp: int, end_timestamp: int):
+        """
+        查找时间范围内第一条和最后一条交易的ID，定位逻辑见id_range.find_trade_id_range，
+        每一步中互不依赖的查询并发执行
+        :return: (first_id, last_id)，时间范围内没有交易时返回None
+        """
+        queries = {
+            QUERY_AGG_TRADES: self._query_agg_trades_columns,
+            QUERY_HISTORICAL_TRADES: self._query_historical_trades_columns,
+        }
+        steps = find_trade_id_range(symbol, start_timestamp, end_timestamp)
+        results = None
+        try:
+            while True:
+                results = await _run_all(queries[name](symbol, **params) for name, params in steps.send(results))
+        except StopIteration as e:
+            return e.value
+
+    async def _query_agg_trades_window(self, symbol: str, start_timestamp: int, end_timestamp: int) -> Columns:
+        current_start = start_timestamp
+        from_id = None  # 整页都在同一毫秒时按AggTradeId继续分页
+        buffer = ColumnBuffer()
+        while current_start <= end_timestamp:
+            if from_id is None:
+                columns = await self._query_agg_trades_columns(symbol, current_start, end_timestamp)
+            else:
+                columns = await self._query_agg_trades_columns(symbol, from_id=from_id)
+            if not columns:
+                break
+
+            timestamps = columns["TradeTimestamp"]
+            last_id = buffer.last("AggTradeId")
+            mask = timestamps <= end_timestamp
+            if last_id is not None:
+                mask &= columns["AggTradeId"] > last_id
+            buffer.append(columns, mask)
+            if len(timestamps) < API_LIMIT_ONE_TIME:
+                break
+            # 同一毫秒可能有多笔成交被分在两页，从最后一毫秒重新开始，重复部分按AggTradeId去掉；
+            # 整页都在同一毫秒时按时间无法前进，改为从最后一条的下一个AggTradeId继续
+            last_timestamp = int(timestamps[-1])
+            if last_timestamp == current_start:
+                from_id = int(columns["AggTradeId"][-1]) + 1
+            else:
+                from_id = None
+                current_start = last_timestamp
+
+        if not len(buffer):
+            return {}
+        return {name: values[:len(buffer)] for name, values in buffer.columns.items()}
+
+    async def _query_kline_columns(self, symbol: str, interval: Interval, start_timestamp: int,
+                                   end_timestamp: int, limit=API_LIMIT_ONE_TIME) -> Columns:
+        params = {
+            'symbol': symbol,
+            'interval': interval.value,
+            'startTime': start_timestamp,
+            'endTime': end_timestamp,
+            'limit': limit
+        }
+        data = await self.request("GET", "/api/v3/klines", params=params)
+        return decode_klines(data, int(datetime.now().timestamp() * 1000))
+
+    async def _query_agg_trades_columns(self, symbol: str, start_timestamp: int = None, end_timestamp: int = None,
+                                        limit=API_LIMIT_ONE_TIME, from_id: int = None) -> Columns:
+        params = {
+            'symbol': symbol,
+            'limit': limit
+        }
+        if from_id is not None:
+            params['fromId'] = from_id
+        if start_timestamp is not None:
+            params['startTime'] = start_timestamp
+        if end_timestamp is not None:
+            params['endTime'] = end_timestamp
+        data = await self.request("GET", "/api/v3/aggTrades", params=params)
+        return decode_agg_trades(data, int(datetime.now().timestamp() * 1000))
+
+    async def _query_historical_trades_columns(self, symbol: str, from_id: int = None,
+                                               limit=API_LIMIT_ONE_TIME) -> Columns:
+        params = {
+            'symbol': symbol,
+            'limit': limit
+        }
+        if from_id is not None:
+            params['fromId'] = from_id
+        data = await self.request("GET", "/api/v3/historicalTrades", params=params)
+        return decode_historical_trades(data, int(datetime.now().timestamp() * 1000))
+
+
+async def _run_all(coroutines: Iterable[Coroutine]) -> list:
+    """
+    并发执行并按顺序返回结果，任意一个请求失败时取消其余在途请求后抛出该异常
+    """
+    tasks = []
+    try:
+        async with asyncio.TaskGroup() as group:
+            for coroutine in coroutines:
+                tasks.append(group.create_task(coroutine))
+    except BaseExceptionGroup as e:
+        # 只有一个失败时直接抛出原异常，和单个请求的行为一致
+        if len(e.exceptions) == 1:
+            raise e.exceptions[0] from None
+        raise
+    return [task.result() for task in tasks]
+
+
+def _merge_pages(pages: list[Columns], key: str) -> pd.DataFrame:
+    """
+    按key排序合并并发请求的分页结果，去掉窗口边界的重复数据
+    """
+    pages = [page for page in pages if page]
+    if not pages:
+        return pd.DataFrame()
+    pages.sort(key=lambda page: page[key][0])
+
+    buffer = ColumnBuffer(sum(len(page[key]) for page in pages))
+    for page in pages:
+        last = buffer.last(key)
+        buffer.append(page, None if last is None else page[key] > last)
+    return buffer.to_dataframe()
+
@@ -0,0 +1,370 @@
+"""
+coding=utf-8
+@File   : simulator
+@Author : LiHan
+@Time   : 10/21/26:3:20 PM
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import WSMsgType, web
+
+from core.binance.spot.decode import loads
+from core.binance.spot.limiter import HEADER_RETRY_AFTER, HEADER_USED_WEIGHT_1M, get_request_weight
+from core.utils.constant import REST_WEIGHT_LIMIT_1M
+from core.utils.interval import interval_to_milliseconds
+from core.utils.journal import list_journals, read_journal
+from external.common.constant import API_LIMIT_ONE_TIME
+from external.utils.log import logger
+
+# 模拟成交从该时间开始，每trade_interval_ms一笔，交易ID = (成交时间 - TRADE_ORIGIN) // trade_interval_ms
+TRADE_ORIGIN = 1500000000000
+DEPTH_SNAPSHOT_MAX_LIMIT = 5000
+
+
+@dataclass
+class SimulatorConfig:
+    host: str = "127.0.0.1"
+    port: int = 18080
+    latency_ms: float = 0  # REST响应的固定延迟
+    jitter_ms: float = 0  # REST响应的随机延迟上限
+    weight_limit: int = REST_WEIGHT_LIMIT_1M  # 每分钟权重上限，超过后返回429
+    error_rate: float = 0  # 随机返回429的概率
+    trade_interval_ms: int = 100  # 模拟成交的时间间隔
+    ws_rate: float = 1000  # 每个websocket连接每秒推送的消息数
+    ws_journal_dir: str = ""  # 设置后websocket回放该目录下录制的消息，而不是生成消息
+    seed: int = 0
+
+
+class BinanceSimulator:
+    """
+    本地的Binance现货行情模拟服务，用于离线压测rest和websocket客户端
+    rest接口返回按时间确定的合成数据(同一参数多次请求结果相同)，带X-MBX-USED-WEIGHT-1M响应头，
+    按分钟统计权重，超过上限或按error_rate随机返回429；
+    websocket兼容combined stream的SUBSCRIBE协议，按ws_rate推送已订阅stream的消息。
+    客户端通过BinanceSpotDataRestAPi.connect(url_base=...)和BinanceSpotDataWebsocketApi.connect(host=...)连接
+    """
+
+    def __init__(self, config: Optional[SimulatorConfig] = None):
+        self.config = config or SimulatorConfig()
+        self.random = random.Random(self.config.seed)
+
+        self.weight_minute = 0
+        self.used_weight = 0
+        self.update_ids: dict[str, int] = {}
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/api/v3/time", self.on_time),
+            web.get("/api/v3/klines", self.on_klines),
+            web.get("/api/v3/aggTrades", self.on_agg_trades),
+            web.get("/api/v3/historicalTrades", self.on_historical_trades),
+            web.get("/api/v3/ticker/tradingDay", self.on_trading_day_ticker),
+            web.get("/api/v3/depth", self.on_depth),
+            web.get("/stream", self.on_websocket),
+            web.get("/ws", self.on_websocket),
+        ])
+        self.app.middlewares.append(self.rate_limit_middleware)
+        self.runner: Optional[web.AppRunner] = None
+
+    @property
+    def rest_url(self) -> str:
+        return f"http://{self.config.host}:{self.config.port}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.config.host}:{self.config.port}/stream"
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.config.host, self.config.port).start()
+        logger.info(f"binance simulator started, rest: {self.rest_url}, websocket: {self.ws_url}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @web.middleware
+    async def rate_limit_middleware(self, request: web.Request, handler):
+        if request.path.startswith("/api/"):
+            config = self.config
+            if config.latency_ms or config.jitter_ms:
+                await asyncio.sleep((config.latency_ms + self.random.random() * config.jitter_ms) / 1000)
+
+            now = time.time()
+            minute = int(now // 60)
+            if minute != self.weight_minute:
+                self.weight_minute = minute
+                self.used_weight = 0
+            self.used_weight += get_request_weight(request.path, dict(request.query))
+
+            headers = {HEADER_USED_WEIGHT_1M: str(self.used_weight)}
+            if self.used_weight > config.weight_limit or self.random.random() < config.error_rate:
+                headers[HEADER_RETRY_AFTER] = str(max(int(60 - now % 60), 1))
+                return web.json_response({"code": -1003, "msg": "Too many requests."}, status=429,
+                                         headers=headers)
+
+            response = await handler(request)
+            response.headers.update(headers)
+            return response
+        return await handler(request)
+
+    async def on_time(self, request: web.Request):
+        return web.json_response({"serverTime": _now_ms()})
+
+    async def on_klines(self, request: web.Request):
+        query = request.query
+        symbol = query["symbol"]
+        interval_ms = interval_to_milliseconds(query["interval"])
+        limit = min(int(query.get("limit", 500)), API_LIMIT_ONE_TIME)
+        now = _now_ms()
+        end = min(int(query.get("endTime", now)), now)
+        start = int(query.get("startTime", end - interval_ms * limit))
+        start += -start % interval_ms
+
+        klines = []
+        for open_time in range(start, end + 1, interval_ms):
+            if len(klines) >= limit:
+                break
+            klines.append(self.make_kline(symbol, open_time, interval_ms))
+        return web.json_response(klines)
+
+    async def on_agg_trades(self, request: web.Request):
+        query = request.query
+        limit = min(int(query.get("limit", 500)), API_LIMIT_ONE_TIME)
+        last_id = self.trade_id(_now_ms())
+        if "fromId" in query:
+            first_id = int(query["fromId"])
+        elif "startTime" in query:
+            first_id = self.trade_id(int(query["startTime"]) + self.config.trade_interval_ms - 1)
+        else:
+            first_id = last_id - limit + 1
+        if "endTime" in query:
+            last_id = min(last_id, self.trade_id(int(query["endTime"])))
+
+        trades = []
+        for trade_id in range(max(first_id, 0), min(first_id + limit, last_id + 1)):
+            price, qty, is_buyer_maker = self.make_trade(query["symbol"], trade_id)
+            trades.append({
+                "a": trade_id, "p": price, "q": qty, "f": trade_id, "l": trade_id,
+                "T": self.trade_time(trade_id), "m": is_buyer_maker, "M": True,
+            })
+        return web.json_response(trades)
+
+    async def on_historical_trades(self, request: web.Request):
+        query = request.query
+        limit = min(int(query.get("limit", 500)), API_LIMIT_ONE_TIME)
+        last_id = self.trade_id(_now_ms())
+        first_id = int(query["fromId"]) if "fromId" in query else last_id - limit + 1
+
+        trades = []
+        for trade_id in range(max(first_id, 0), min(first_id + limit, last_id + 1)):
+            price, qty, is_buyer_maker = self.make_trade(query["symbol"], trade_id)
+            trades.append({
+                "id": trade_id, "price": price, "qty": qty, "quoteQty": f"{float(price) * float(qty):.8f}",
+                "time": self.trade_time(trade_id), "isBuyerMaker": is_buyer_maker, "isBestMatch": True,
+            })
+        return web.json_response(trades)
+
+    async def on_trading_day_ticker(self, request: web.Request):
+        symbol = request.query["symbol"]
+        now = _now_ms()
+        open_time = now - now % 86400000
+        kline = self.make_kline(symbol, open_time, 86400000)
+        return web.json_response({
+            "symbol": symbol,
+            "priceChange": f"{float(kline[4]) - float(kline[1]):.8f}",
+            "priceChangePercent": f"{(float(kline[4]) / float(kline[1]) - 1) * 100:.3f}",
+            "weightedAvgPrice": kline[4],
+            "openPrice": kline[1], "highPrice": kline[2], "lowPrice": kline[3], "lastPrice": kline[4],
+            "volume": kline[5], "quoteVolume": kline[7],
+            "openTime": open_time, "closeTime": open_time + 86400000 - 1,
+            "firstId": self.trade_id(open_time), "lastId": self.trade_id(now), "count": kline[8],
+        })
+
+    async def on_depth(self, request: web.Request):
+        symbol = request.query["symbol"]
+        limit = min(int(request.query.get("limit", 100)), DEPTH_SNAPSHOT_MAX_LIMIT)
+        bids, asks = self.make_depth(symbol.lower(), limit)
+        return web.json_response({"lastUpdateId": self.update_ids.get(symbol.lower(), 1), "bids": bids, "asks": asks})
+
+    async def on_websocket(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        streams: list[str] = []
+        pusher = asyncio.create_task(self.push_messages(ws, streams))
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                req = loads(msg.data)
+                params = req.get("params", [])
+                if req.get("method") == "SUBSCRIBE":
+                    streams.extend(stream for stream in params if stream not in streams)
+                elif req.get("method") == "UNSUBSCRIBE":
+                    streams[:] = [stream for stream in streams if stream not in params]
+                await ws.send_json({"result": None, "id": req.get("id")})
+        finally:
+            pusher.cancel()
+        return ws
+
+    async def push_messages(self, ws: web.WebSocketResponse, streams: list[str]):
+        """
+        按ws_rate推送消息，每10毫秒补齐按速率应发送的数量
+        """
+        journal = self.iter_journal() if self.config.ws_journal_dir else None
+        start = time.perf_counter()
+        sent = 0
+        index = 0
+        while not ws.closed:
+            await asyncio.sleep(0.01)
+            if not streams and journal is None:
+                continue
+            target = int((time.perf_counter() - start) * self.config.ws_rate)
+            while sent < target:
+                if journal is not None:
+                    message = next(journal)
+                else:
+                    message = self.make_stream_message(streams[index % len(streams)])
+                    index += 1
+                await ws.send_str(message)
+                sent += 1
+
+    def iter_journal(self):
+        paths = list_journals(self.config.ws_journal_dir)
+        if not paths:
+            raise ValueError(f"{self.config.ws_journal_dir}下没有录制的消息")
+        while True:
+            for path in paths:
+                for _, message in read_journal(path):
+                    yield message.decode()
+
+    def make_stream_message(self, stream: str) -> str:
+        symbol, channel = stream.split("@", 1)
+        now = _now_ms()
+        if channel == "ticker":
+            kline = self.make_kline(symbol.upper(), now - now % 86400000, 86400000)
+            data = {
+                "e": "24hrTicker", "E": now, "s": symbol.upper(), "o": kline[1], "h": kline[2], "l": kline[3],
+                "c": kline[4], "v": kline[5], "q": kline[7],
+            }
+        elif channel.startswith("depth@"):
+            first_id = self.update_ids.get(symbol, 1) + 1
+            last_id = self.update_ids[symbol] = first_id + self.random.randint(0, 5)
+            bids, asks = self.make_depth(symbol, 5)
+            data = {"e": "depthUpdate", "E": now, "s": symbol.upper(), "U": first_id, "u": last_id,
+                    "b": bids, "a": asks}
+        elif channel.startswith("depth"):
+            bids, asks = self.make_depth(symbol, int(channel[5:] or 10))
+            data = {"lastUpdateId": self.update_ids.get(symbol, 1), "bids": bids, "asks": asks}
+        elif channel.startswith("kline_"):
+            interval_ms = interval_to_milliseconds(channel[6:])
+            open_time = now - now % interval_ms
+            # 模拟每个周期结束前的最后一条推送为完整K线
+            closed = self.random.random() < 0.1
+            if closed:
+                open_time -= interval_ms
+            kline = self.make_kline(symbol.upper(), open_time, interval_ms)
+            # 字段与Binance的kline推送一致，成交ID与rest接口的模拟成交对应
+            data = {"e": "kline", "E": now, "s": symbol.upper(), "k": {
+                "t": open_time, "T": kline[6], "s": symbol.upper(), "i": channel[6:],
+                "f": self.trade_id(open_time - 1) + 1, "L": self.trade_id(min(kline[6], now)),
+                "o": kline[1], "c": kline[4], "h": kline[2], "l": kline[3], "v": kline[5], "n": kline[8],
+                "x": closed, "q": kline[7], "V": kline[9], "Q": kline[10], "B": kline[11],
+            }}
+        else:
+            data = {"e": channel, "E": now, "s": symbol.upper()}
+        return f'{{"stream":"{stream}","data":{_dumps(data)}}}'
+
+    def price(self, symbol: str, timestamp: int) -> str:
+        """
+        按时间确定的价格: 基准价 + 日内周期波动 + 小幅噪声
+        """
+        base = 10 + zlib.crc32(symbol.encode()) % 100000 / 10
+        noise = zlib.crc32(f"{symbol}{timestamp}".encode()) / 0xFFFFFFFF - 0.5
+        value = base * (1 + 0.02 * math.sin(timestamp / 3600000) + 0.001 * noise)
+        return f"{value:.2f}"
+
+    def make_kline(self, symbol: str, open_time: int, interval_ms: int) -> list:
+        close_time = open_time + interval_ms - 1
+        # 未结束的K线只取到当前时间的价格
+        last_time = min(close_time, _now_ms())
+        prices = [float(self.price(symbol, min(open_time + interval_ms * step // 4, last_time))) for step in range(4)]
+        close = float(self.price(symbol, last_time))
+        volume = interval_ms / self.config.trade_interval_ms * 0.01
+        turnover = volume * close
+        trades = interval_ms // self.config.trade_interval_ms
+        return [
+            open_time, f"{prices[0]:.2f}", f"{max(prices + [close]):.2f}", f"{min(prices + [close]):.2f}",
+            f"{close:.2f}", f"{volume:.8f}", close_time, f"{turnover:.8f}", trades,
+            f"{volume / 2:.8f}", f"{turnover / 2:.8f}", "0",
+        ]
+
+    def make_trade(self, symbol: str, trade_id: int) -> tuple[str, str, bool]:
+        checksum = zlib.crc32(f"{symbol}{trade_id}".encode())
+        qty = 0.001 + checksum % 1000 / 10000
+        return self.price(symbol, self.trade_time(trade_id)), f"{qty:.8f}", bool(checksum & 1)
+
+    def make_depth(self, symbol: str, levels: int) -> tuple[list, list]:
+        mid = float(self.price(symbol.upper(), _now_ms()))
+        tick = max(round(mid * 0.0001, 2), 0.01)
+        bids = [[f"{mid - tick * (n + 1):.2f}", f"{self.random.random() * 5:.8f}"] for n in range(levels)]
+        asks = [[f"{mid + tick * (n + 1):.2f}", f"{self.random.random() * 5:.8f}"] for n in range(levels)]
+        return bids, asks
+
+    def trade_id(self, timestamp: int) -> int:
+        """
+        timestamp(含)之前最后一笔成交的ID
+        """
+        return (timestamp - TRADE_ORIGIN) // self.config.trade_interval_ms
+
+    def trade_time(self, trade_id: int) -> int:
+        return TRADE_ORIGIN + trade_id * self.config.trade_interval_ms
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+try:
+    import orjson
+
+    def _dumps(data: dict) -> str:
+        return orjson.dumps(data).decode()
+except ImportError:  # orjson为可选依赖，未安装时退回标准库
+    def _dumps(data: dict) -> str:
+        return json.dumps(data, separators=(",", ":"))
+
+
+async def run_simulator(config: SimulatorConfig):
+    simulator = BinanceSimulator(config)
+    await simulator.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Binance现货行情模拟服务")
+    parser.add_argument("--host", default=SimulatorConfig.host)
+    parser.add_argument("--port", type=int, default=SimulatorConfig.port)
+    parser.add_argument("--latency-ms", type=float, default=SimulatorConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=SimulatorConfig.jitter_ms)
+    parser.add_argument("--weight-limit", type=int, default=SimulatorConfig.weight_limit)
+    parser.add_argument("--error-rate", type=float, default=SimulatorConfig.error_rate)
+    parser.add_argument("--trade-interval-ms", type=int, default=SimulatorConfig.trade_interval_ms)
+    parser.add_argument("--ws-rate", type=float, default=SimulatorConfig.ws_rate)
+    parser.add_argument("--ws-journal-dir", default=SimulatorConfig.ws_journal_dir)
+    args = parser.parse_args()
+
+    asyncio.run(run_simulator(SimulatorConfig(**vars(args))))
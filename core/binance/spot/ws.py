@@ -4,18 +4,77 @@ coding=utf-8
 @Author : LiHan
 @Time   : 3/12/25:2:35 PM
 """
-import json
+import queue
+import threading
+import time
 from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Optional, Union
 
-from core.utils.constant import WEBSOCKET_RECEIVE_TIMEOUT_SECOND
+import numpy as np
+
+from core.binance.spot.decode import loads
+from core.binance.spot.order_book import DEPTH_UPDATE_CHANNEL, OrderBookManager
+from core.utils.constant import (
+    WEBSOCKET_MAX_MESSAGES_PER_SECOND,
+    WEBSOCKET_MAX_STREAMS_PER_CONNECTION,
+    WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE,
+    WEBSOCKET_RECEIVE_TIMEOUT_SECOND,
+)
+from core.utils.bar_aggregator import BarAggregator
+from core.utils.journal import JournalRecorder
+from core.utils.metrics import UNIT_NANOSECONDS, Histogram, counter, histogram
+from core.utils.shm import DEPTH_LEVELS, MdShmWriter
+from core.utils.shm_ring import ShmRingBuffer
+from core.utils.storage import KLINES_SCHEMA, TICKS_SCHEMA, get_trading_day
 from external.common.env import WEBSOCKET_DATA_HOST
 from external.common.object import Exchange, Interval, TickData, SubscribeRequest, KLineData
 from external.utils.log import logger
 from external.websocket.websocket_client import WebsocketClient
 
-CHANNELS = ["ticker", "depth10", "kline_1m"]
+if TYPE_CHECKING:
+    from core.binance.spot.ws_pipeline import WebsocketDecodePipeline
+    from core.utils.clickhouse_sink import ClickhouseSink
+
+CHANNEL_TICKER = "ticker"
+CHANNEL_DEPTH = "depth10"
+CHANNEL_KLINE = "kline_1m"
+CHANNELS = [CHANNEL_TICKER, CHANNEL_DEPTH, CHANNEL_KLINE]
 KLINE_INTERVAL = Interval.MINUTE  # 和上面的CHANNELS对应
 
+DEFAULT_TICKS_TABLE = "binance_spot_ticks"
+DEFAULT_KLINES_TABLE = "binance_spot_klines_1m"
+
+# 盘口数组的行: 买价、买量、卖价、卖量
+BID_PRICE, BID_VOLUME, ASK_PRICE, ASK_VOLUME = range(4)
+# TickData上对应盘口数组每一行的字段名，bid_price_1 ... ask_volume_10
+TICK_DEPTH_FIELDS = [
+    [f"{side}_{n}" for n in range(1, DEPTH_LEVELS + 1)]
+    for side in ("bid_price", "bid_volume", "ask_price", "ask_volume")
+]
+
+# 每METRICS_SAMPLE_INTERVAL条消息采样一次处理耗时和延迟，其余消息只计数
+METRICS_SAMPLE_INTERVAL = 16
+WS_MESSAGES = counter("md_ws_messages_total", "websocket收到的消息数").labels()
+WS_DECODE_SECONDS = histogram("md_ws_decode_seconds", "websocket消息解析和处理耗时(采样)", ["channel"],
+                              unit=UNIT_NANOSECONDS)
+WS_LATENCY_SECONDS = histogram("md_ws_latency_seconds", "交易所事件时间到本地接收的延迟(采样)", ["symbol", "channel"])
+
+
+class SymbolState:
+    """
+    单个symbol的解析状态，订阅时创建，收到消息时直接通过stream名称找到，不再拆分字符串
+    """
+    __slots__ = ("symbol", "symbol_bytes", "symbol_upper", "tick", "depth", "slot")
+
+    def __init__(self, symbol: str, tick: TickData):
+        self.symbol = symbol
+        self.symbol_bytes = symbol.encode()
+        self.symbol_upper = symbol.upper()
+        self.tick = tick
+        # 预分配的盘口数组，每条depth消息原地覆盖，同时挂在tick.extra["depth"]上
+        self.depth = np.zeros((4, DEPTH_LEVELS))
+        self.slot = -1  # 行情共享内存中的槽位，-1表示未写入共享内存
+
 
 class BinanceSpotDataWebsocketApi(WebsocketClient):
 
@@ -26,10 +85,50 @@ class BinanceSpotDataWebsocketApi(WebsocketClient):
 
         self.ticks: dict[str, TickData] = {}
         self.req_id: int = 0
-        self.pending_subscriptions: list[SubscribeRequest] = []
 
-    def connect(self, proxy_host: str, proxy_port: int):
-        host = WEBSOCKET_DATA_HOST
+        # 已订阅的stream，连接建立(包括断线重连)后全部重新订阅
+        self.streams: list[str] = []
+        # 请求id -> 等待确认的stream
+        self.pending_acks: dict[int, list[str]] = {}
+        # 待发送的订阅，由发送线程合并后按Binance的消息频率限制发送
+        self.subscription_queue: queue.Queue[list[str]] = queue.Queue()
+        self.sender_thread: Optional[threading.Thread] = None
+
+        # stream名称 -> (解析函数, symbol状态, 耗时直方图, 延迟直方图)，订阅时预先生成
+        self.handlers: dict[str, tuple[Callable[[SymbolState, dict], None], SymbolState, Histogram,
+                                       Optional[Histogram]]] = {}
+        self.states: dict[str, SymbolState] = {}
+
+        # 可选的本地盘口，设置后额外订阅depth@100ms增量推送维护完整盘口
+        self.order_books: Optional[OrderBookManager] = None
+
+        # 可选的K线合成器，设置后每根完整的1分钟K线会用于合成更大周期的K线
+        self.bar_aggregator: Optional[BarAggregator] = None
+
+        # 可选的原始消息记录器，设置后每条消息在解析前写入日志，可以用replay_journal回放
+        self.recorder: Optional[JournalRecorder] = None
+
+        # 可选的行情共享内存，设置后最新的ticker和盘口会写入对应symbol的槽位
+        self.md_store: Optional[MdShmWriter] = None
+
+        # 可选的共享内存环形缓冲区，设置后每条ticker、盘口和完整K线都会写入，供其他进程消费
+        self.tick_ring: Optional[ShmRingBuffer] = None
+        self.depth_ring: Optional[ShmRingBuffer] = None
+        self.kline_ring: Optional[ShmRingBuffer] = None
+
+        # 可选的ClickHouse写入缓冲，设置后每条ticker和完整K线都会写入对应的表
+        self.sink: Optional["ClickhouseSink"] = None
+        self.sink_ticks_table = DEFAULT_TICKS_TABLE
+        self.sink_klines_table = DEFAULT_KLINES_TABLE
+
+        # 可选的多进程解码流水线，设置后行情推送在接收线程中只写入解码队列，由解码进程解析和发布
+        self.pipeline: Optional["WebsocketDecodePipeline"] = None
+
+    def connect(self, proxy_host: str, proxy_port: int, host: Optional[str] = None):
+        """
+        :param host: 默认为WEBSOCKET_DATA_HOST，可以指向本地的BinanceSimulator
+        """
+        host = host or WEBSOCKET_DATA_HOST
         self.init(
             host=host,
             proxy_host=proxy_host,
@@ -38,11 +137,63 @@ class BinanceSpotDataWebsocketApi(WebsocketClient):
         )
         self.start()
 
+        if self.sender_thread is None:
+            self.sender_thread = threading.Thread(target=self._run_sender, daemon=True,
+                                                  name=f"{self.gateway_name}_subscription")
+            self.sender_thread.start()
+
+    def set_md_store(self, md_store: MdShmWriter):
+        """
+        设置行情共享内存，已订阅的symbol会立即分配槽位
+        """
+        self.md_store = md_store
+        for state in self.states.values():
+            state.slot = md_store.add_symbol(state.symbol)
+
+    def set_order_books(self, order_books: OrderBookManager):
+        """
+        设置本地盘口管理器，需要在订阅之前调用
+        """
+        if self.pipeline is not None:
+            raise ValueError("解码流水线模式不支持本地盘口")
+        self.order_books = order_books
+
+    def set_sink(self, sink: "ClickhouseSink", ticks_table: str = DEFAULT_TICKS_TABLE,
+                 klines_table: str = DEFAULT_KLINES_TABLE):
+        """
+        设置ClickHouse写入缓冲，ticker写入ticks_table，完整的1分钟K线写入klines_table，列与storage中的schema一致
+        写入线程由调用方通过sink.start()启动
+        """
+        sink.register(ticks_table, TICKS_SCHEMA)
+        sink.register(klines_table, KLINES_SCHEMA)
+        self.sink_ticks_table = ticks_table
+        self.sink_klines_table = klines_table
+        self.sink = sink
+
+    def set_pipeline(self, pipeline: "WebsocketDecodePipeline"):
+        """
+        设置多进程解码流水线，需要在连接之前调用
+        流水线模式下ticks、bar_aggregator和环形缓冲区不再更新，行情从解码进程的行情共享内存读取。
+        当前进程的md_ws_messages_total仍统计收到的全部消息，md_ws_decode_seconds和md_ws_latency_seconds
+        只在解码进程中记录，需要通过WebsocketDecodePipeline的metrics_dump_path导出
+        """
+        if self.order_books is not None:
+            raise ValueError("解码流水线模式不支持本地盘口")
+        self.pipeline = pipeline
+
+    def get_channels(self) -> list[str]:
+        if self.order_books is None:
+            return CHANNELS
+        return CHANNELS + [DEPTH_UPDATE_CHANNEL]
+
     def subscribe(self, req: SubscribeRequest):
         if req.symbol in self.ticks:
             return
 
-        self.req_id += 1
+        streams = [f"{req.symbol}@{channel}" for channel in self.get_channels()]
+        if len(self.streams) + len(streams) > WEBSOCKET_MAX_STREAMS_PER_CONNECTION:
+            raise ValueError(f"{self.gateway_name} 订阅的stream数量超过单连接上限"
+                             f"{WEBSOCKET_MAX_STREAMS_PER_CONNECTION}, 请使用BinanceSpotDataWebsocketManager分片订阅")
 
         tick: TickData = TickData(
             symbol=req.symbol,
@@ -56,98 +207,240 @@ class BinanceSpotDataWebsocketApi(WebsocketClient):
         tick.extra = {}
         self.ticks[req.symbol] = tick
 
+        state = SymbolState(req.symbol, tick)
+        tick.extra["depth"] = state.depth
+        if self.md_store is not None:
+            state.slot = self.md_store.add_symbol(req.symbol)
+        self.states[req.symbol] = state
+        self._add_handler(CHANNEL_TICKER, self._on_ticker, state)
+        # depth10推送不带事件时间，无法统计延迟
+        self._add_handler(CHANNEL_DEPTH, self._on_depth, state, has_event_time=False)
+        self._add_handler(CHANNEL_KLINE, self._on_kline, state)
+        if self.order_books is not None:
+            self.order_books.add_symbol(req.symbol)
+            self._add_handler(DEPTH_UPDATE_CHANNEL, self._on_depth_update, state)
+
+        self.streams.extend(streams)
         # 仅在连接活跃时发送订阅，否则将会在连接后自动订阅
-        if not self.active or not self.websocket_app:
-            self.pending_subscriptions.append(req)
-            return
+        if self.active and self.websocket_app:
+            self.subscription_queue.put(streams)
 
-        # 发送订阅请求
-        self._send_subscription(req)
+    def _add_handler(self, channel: str, handler: Callable[[SymbolState, dict], None], state: SymbolState,
+                     has_event_time: bool = True):
+        latency = WS_LATENCY_SECONDS.labels(state.symbol, channel) if has_event_time else None
+        self.handlers[f"{state.symbol}@{channel}"] = (handler, state, WS_DECODE_SECONDS.labels(channel), latency)
 
-    def _send_subscription(self, req: SubscribeRequest):
+    def _run_sender(self):
+        """
+        订阅发送线程，把排队的stream合并为批量SUBSCRIBE，发送间隔满足每秒消息数量限制
+        """
+        # 留一条给websocket的ping/pong等其他消息
+        interval = 1 / (WEBSOCKET_MAX_MESSAGES_PER_SECOND - 1)
+        pending: list[str] = []
+        while True:
+            if not pending:
+                pending.extend(self.subscription_queue.get())
+            while len(pending) < WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE:
+                try:
+                    pending.extend(self.subscription_queue.get_nowait())
+                except queue.Empty:
+                    break
 
-        channels = [f"{req.symbol}@{channel}" for channel in CHANNELS]
+            batch = pending[:WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE]
+            del pending[:WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE]
+            if not self.active or not self.websocket_app:
+                # 连接断开后会在on_open中重新订阅全部stream
+                continue
+            try:
+                self._send_subscription(batch)
+            except Exception:
+                logger.exception(f"{self.gateway_name} 发送订阅请求失败")
+            time.sleep(interval)
+
+    def _send_subscription(self, streams: list[str]):
+        self.req_id += 1
+        self.pending_acks[self.req_id] = streams
 
         req: dict = {
             "method": "SUBSCRIBE",
-            "params": channels,
+            "params": streams,
             "id": self.req_id
         }
         self.send(req)
 
+    def on_ack(self, packet: dict):
+        """
+        订阅请求的回复，成功时result为null，失败时带error
+        """
+        streams = self.pending_acks.pop(packet["id"], None)
+        if streams is None:
+            return
+        if "error" in packet:
+            logger.error("{} 订阅失败, id={}, error={}, streams={}",
+                         self.gateway_name, packet["id"], packet["error"], streams)
+        else:
+            logger.debug("{} 订阅成功, id={}, stream数量={}", self.gateway_name, packet["id"], len(streams))
+
     def on_open(self):
         """
         当websocket连接建立时调用
         """
         logger.info(f"{self.gateway_name} websocket connection established.")
 
-        if self.pending_subscriptions:
-            for req in self.pending_subscriptions:
-                self._send_subscription(req)
-            self.pending_subscriptions.clear()
+        # 断线期间的增量已经丢失，本地盘口需要重新同步
+        if self.order_books is not None:
+            self.order_books.reset()
+
+        # 旧连接上未确认的订阅不会再有回复
+        self.pending_acks.clear()
+        if self.streams:
+            self.subscription_queue.put(list(self.streams))
 
     def on_message(self, message: str):
         """
         当websocket收到消息时调用
         :param message: str，默认使用json格式的字符串
         """
-        data = json.loads(message)
-        logger.debug(f"{self.gateway_name} data received: {data}")
+        if self.recorder is not None:
+            self.recorder.record(message)
+        if self.pipeline is not None and self.pipeline.dispatch(message):
+            # 解析耗时和延迟由解码进程统计，接收进程只计数
+            WS_MESSAGES.inc()
+            return
+        self.process_message(message)
 
-        stream: str = data.get("stream", None)
+    def process_message(self, message: Union[str, bytes], receive_time: Optional[float] = None):
+        """
+        解析并处理一条消息
+        :param receive_time: 接收时间，解码流水线中由接收线程记录，默认为当前时间
+        """
+        WS_MESSAGES.inc()
+        sampled = not WS_MESSAGES.value % METRICS_SAMPLE_INTERVAL
+        if sampled:
+            if receive_time is None:
+                receive_time = time.time()
+            start = time.perf_counter_ns()
 
-        if not stream:
-            logger.error(f"{self.gateway_name} stream not found in data: {data}")
-            return
+        packet = loads(message)
+        # 使用loguru的参数格式化，debug级别关闭时不会格式化消息
+        logger.debug("{} data received: {}", self.gateway_name, message)
 
-        symbol, channel = stream.split('@')
-        data = data.get("data", None)
-
-        tick: TickData = self.ticks.get(symbol, None)
-        if channel == "ticker":
-            if tick:
-                tick.volume = float(data['v'])
-                tick.turnover = float(data['q'])
-                tick.open_price = float(data['o'])
-                tick.high_price = float(data['h'])
-                tick.low_price = float(data['l'])
-                tick.last_price = float(data['c'])
-                tick.exchange_time = data['E']
-                tick.local_time = datetime.now().timestamp()
-        elif channel == "depth10":
-            bids = data['bids']
-            for n in range(min(10, len(bids))):
-                price, volume = bids[n]
-                tick.__setattr__("bid_price_" + str(n + 1), float(price))
-                tick.__setattr__("bid_volume_" + str(n + 1), float(volume))
-
-            asks: list = data["asks"]
-            for n in range(min(10, len(asks))):
-                price, volume = asks[n]
-                tick.__setattr__("ask_price_" + str(n + 1), float(price))
-                tick.__setattr__("ask_volume_" + str(n + 1), float(volume))
-        else:
-            if data['e'] == "kline":
-                bar_ready: bool = data.get('x', False)  # 是否是完整的k线数据
-                if not bar_ready:
-                    logger.debug(f"{self.gateway_name} {symbol} kline is not ready.")
-                    return
-
-                kline_data = data['k']
-                tick.extra["kline"] = KLineData(
-                    symbol=symbol.upper(),
-                    exchange=Exchange.BINANCE,
-                    exchange_time=data['E'],
-                    local_time=datetime.now().timestamp(),
-                    interval=KLINE_INTERVAL,
-                    volume=float(kline_data['v']),
-                    turnover=float(kline_data['q']),
-                    open=float(kline_data['o']),
-                    high=float(kline_data['h']),
-                    low=float(kline_data['l']),
-                    close=float(kline_data['c']),
-                    gateway_name=self.gateway_name
-                )
+        stream = packet.get("stream")
+        entry = self.handlers.get(stream)
+        if entry is None:
+            if stream is None and "id" in packet:
+                self.on_ack(packet)
             else:
-                logger.error(f"{self.gateway_name} unknown data received: {data}")
-                return
+                logger.error("{} unknown data received: {}", self.gateway_name, message)
+            return
+
+        handler, state, decode_histogram, latency_histogram = entry
+        data = packet["data"]
+        handler(state, data)
+
+        if sampled:
+            decode_histogram.record(time.perf_counter_ns() - start)
+            if latency_histogram is not None:
+                latency_histogram.record(int(receive_time * 1000000) - data['E'] * 1000)
+
+    def _on_ticker(self, state: SymbolState, data: dict):
+        tick = state.tick
+        tick.volume = float(data['v'])
+        tick.turnover = float(data['q'])
+        tick.open_price = float(data['o'])
+        tick.high_price = float(data['h'])
+        tick.low_price = float(data['l'])
+        tick.last_price = float(data['c'])
+        tick.exchange_time = data['E']
+        tick.local_time = time.time()
+
+        if state.slot >= 0:
+            self.md_store.write_ticker(state.slot, tick.last_price, tick.volume, tick.high_price, tick.low_price,
+                                       tick.exchange_time)
+        if self.tick_ring is not None:
+            self.tick_ring.append((
+                state.symbol_bytes, tick.exchange_time, tick.local_time, tick.last_price, tick.volume,
+                tick.turnover, tick.open_price, tick.high_price, tick.low_price
+            ))
+        if self.sink is not None:
+            self.sink.append(self.sink_ticks_table, (
+                state.symbol_upper, Exchange.BINANCE.value, tick.exchange_time, int(tick.local_time * 1000),
+                tick.last_price, tick.volume, tick.turnover, tick.open_price, tick.high_price, tick.low_price,
+                get_trading_day(tick.exchange_time)
+            ))
+
+    def _on_depth(self, state: SymbolState, data: dict):
+        depth = state.depth
+        _fill_levels(depth[BID_PRICE], depth[BID_VOLUME], data['bids'])
+        _fill_levels(depth[ASK_PRICE], depth[ASK_VOLUME], data['asks'])
+
+        # 保持TickData的bid_price_N等字段可用，不足的档位为0
+        tick = state.tick
+        for names, values in zip(TICK_DEPTH_FIELDS, depth.tolist()):
+            for name, value in zip(names, values):
+                setattr(tick, name, value)
+
+        # depth10推送不带事件时间，使用本地接收时间
+        local_time = time.time()
+        tick.local_time = local_time
+        if state.slot >= 0:
+            self.md_store.write_depth(state.slot, depth[BID_PRICE], depth[BID_VOLUME], depth[ASK_PRICE],
+                                      depth[ASK_VOLUME], int(local_time * 1000))
+        if self.depth_ring is not None:
+            self.depth_ring.append((
+                state.symbol_bytes, 0, local_time, depth[BID_PRICE], depth[BID_VOLUME], depth[ASK_PRICE],
+                depth[ASK_VOLUME]
+            ))
+
+    def _on_depth_update(self, state: SymbolState, data: dict):
+        self.order_books.on_update(state.symbol, data)
+
+    def _on_kline(self, state: SymbolState, data: dict):
+        kline_data = data['k']
+        if not kline_data['x']:  # 是否是完整的k线数据
+            return
+
+        kline = KLineData(
+            symbol=state.symbol_upper,
+            exchange=Exchange.BINANCE,
+            exchange_time=data['E'],
+            local_time=time.time(),
+            interval=KLINE_INTERVAL,
+            volume=float(kline_data['v']),
+            turnover=float(kline_data['q']),
+            open=float(kline_data['o']),
+            high=float(kline_data['h']),
+            low=float(kline_data['l']),
+            close=float(kline_data['c']),
+            gateway_name=self.gateway_name
+        )
+        state.tick.extra["kline"] = kline
+        if self.bar_aggregator is not None:
+            self.bar_aggregator.update_kline(kline, kline_data['t'])
+        if self.kline_ring is not None:
+            self.kline_ring.append((
+                state.symbol_bytes, kline_data['t'], kline.exchange_time, kline.local_time, kline.open,
+                kline.high, kline.low, kline.close, kline.volume, kline.turnover
+            ))
+        if self.sink is not None:
+            # 列顺序与KLINES_SCHEMA一致，现货没有持仓量
+            self.sink.append(self.sink_klines_table, (
+                kline_data['t'], kline.open, kline.high, kline.low, kline.close, kline.volume, kline.turnover,
+                kline_data['n'], float(kline_data['V']), float(kline_data['Q']), int(kline.local_time * 1000),
+                kline.symbol, Exchange.BINANCE.value, KLINE_INTERVAL.value, 0.0, get_trading_day(kline_data['t'])
+            ))
+
+
+def _fill_levels(prices: np.ndarray, volumes: np.ndarray, levels: list):
+    """
+    将[[价格, 数量], ...]原地写入价格和数量数组，不足的档位填0
+    10档以内逐个float比先构造numpy数组再转换更快
+    """
+    count = 0
+    for price, volume in levels[:DEPTH_LEVELS]:
+        prices[count] = float(price)
+        volumes[count] = float(volume)
+        count += 1
+    if count < DEPTH_LEVELS:
+        prices[count:] = 0
+        volumes[count:] = 0
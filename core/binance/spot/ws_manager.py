@@ -0,0 +1,142 @@
+"""
+coding=utf-8
+@File   : ws_manager
+@Author : LiHan
+@Time   : 10/19/26:4:30 PM
+"""
+import multiprocessing
+from multiprocessing.synchronize import Event
+from typing import Optional
+
+from core.binance.spot.ws import CHANNELS, BinanceSpotDataWebsocketApi
+from core.utils.constant import WEBSOCKET_MAX_STREAMS_PER_CONNECTION
+from core.utils.shm import MdShmWriter
+from external.common.object import Exchange, SubscribeRequest, TickData
+from external.utils.log import logger
+
+
+class BinanceSpotDataWebsocketManager:
+    """
+    多连接的行情websocket管理器
+    按单连接stream数量上限把symbol分配到多个连接(分片)，每个连接有独立的接收线程，
+    订阅的批量发送、确认和断线重订阅由各连接的BinanceSpotDataWebsocketApi负责。
+    use_process=True时每个分片运行在独立进程中，行情通过共享内存(每个分片一个MdShmWriter段)输出
+    """
+
+    def __init__(self, proxy_host: str = "", proxy_port: int = 0,
+                 max_streams_per_connection: int = WEBSOCKET_MAX_STREAMS_PER_CONNECTION,
+                 use_process: bool = False, md_store_prefix: str = "binance_spot_md", host: Optional[str] = None):
+        """
+        :param proxy_host: 代理地址
+        :param proxy_port: 代理端口
+        :param max_streams_per_connection: 单连接最多订阅的stream数量
+        :param use_process: 是否每个分片使用独立进程
+        :param md_store_prefix: 进程模式下行情共享内存的名称前缀，分片i的名称为{md_store_prefix}_{i}
+        :param host: websocket地址，默认为WEBSOCKET_DATA_HOST
+        """
+        self.proxy_host = proxy_host
+        self.proxy_port = proxy_port
+        self.symbols_per_connection = max(max_streams_per_connection // len(CHANNELS), 1)
+        self.use_process = use_process
+        self.md_store_prefix = md_store_prefix
+        self.host = host
+
+        self.shards: list[list[str]] = []
+        self.apis: list[BinanceSpotDataWebsocketApi] = []
+        self.processes: list[multiprocessing.Process] = []
+        self.stop_event: Event = multiprocessing.Event()
+        self.connected = False
+
+    def subscribe(self, reqs: list[SubscribeRequest]):
+        """
+        订阅symbol，优先填满最后一个分片，分片已满时新建连接
+        进程模式下只能在connect之前订阅
+        """
+        if self.use_process and self.connected:
+            raise RuntimeError("进程模式下不支持连接后新增订阅")
+
+        subscribed = {symbol for shard in self.shards for symbol in shard}
+        for req in reqs:
+            if req.symbol in subscribed:
+                continue
+            subscribed.add(req.symbol)
+
+            if not self.shards or len(self.shards[-1]) >= self.symbols_per_connection:
+                self.shards.append([])
+                if self.connected:
+                    self._start_shard(len(self.shards) - 1)
+            self.shards[-1].append(req.symbol)
+            if self.connected:
+                self.apis[-1].subscribe(req)
+
+    def connect(self):
+        for index in range(len(self.shards)):
+            self._start_shard(index)
+        self.connected = True
+        logger.info(f"binance spot websocket manager started, shards: {len(self.shards)}, "
+                    f"symbols: {sum(len(shard) for shard in self.shards)}")
+
+    def close(self):
+        self.stop_event.set()
+        for api in self.apis:
+            api.stop()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.connected = False
+
+    @property
+    def ticks(self) -> dict[str, TickData]:
+        """
+        线程模式下所有分片的最新行情
+        """
+        ticks = {}
+        for api in self.apis:
+            ticks.update(api.ticks)
+        return ticks
+
+    def get_md_store_name(self, index: int) -> str:
+        return f"{self.md_store_prefix}_{index}"
+
+    def _start_shard(self, index: int):
+        symbols = self.shards[index]
+        if self.use_process:
+            process = multiprocessing.Process(
+                target=run_shard,
+                args=(symbols, self.proxy_host, self.proxy_port, self.get_md_store_name(index), self.stop_event,
+                      self.host),
+                name=f"binance_spot_ws_shard_{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+            return
+
+        api = BinanceSpotDataWebsocketApi()
+        api.gateway_name = f"binance_spot_data_ws_{index}"
+        for symbol in symbols:
+            api.subscribe(SubscribeRequest(symbol=symbol, exchange=Exchange.BINANCE))
+        api.connect(self.proxy_host, self.proxy_port, self.host)
+        self.apis.append(api)
+
+
+def run_shard(symbols: list[str], proxy_host: str, proxy_port: int, md_store_name: str,
+              stop_event: Optional[Event] = None, host: Optional[str] = None):
+    """
+    分片进程的入口，行情写入名为md_store_name的共享内存，直到stop_event被设置
+    """
+    md_store = MdShmWriter.create(md_store_name, symbols)
+    api = BinanceSpotDataWebsocketApi()
+    api.gateway_name = f"binance_spot_data_ws_{md_store_name}"
+    api.set_md_store(md_store)
+    for symbol in symbols:
+        api.subscribe(SubscribeRequest(symbol=symbol, exchange=Exchange.BINANCE))
+    api.connect(proxy_host, proxy_port, host)
+
+    try:
+        if stop_event is None:
+            api.join()
+        else:
+            stop_event.wait()
+    finally:
+        api.stop()
+        md_store.unlink()
@@ -0,0 +1,284 @@
+"""
+coding=utf-8
+@File   : ws_pipeline
+@Author : LiHan
+@Time   : 10/22/26:2:10 PM
+"""
+import multiprocessing
+import os
+import time
+import zlib
+from multiprocessing import resource_tracker
+from multiprocessing.synchronize import Event
+from typing import Optional, Union
+
+from core.binance.spot.ws import METRICS_SAMPLE_INTERVAL, BinanceSpotDataWebsocketApi
+from core.utils.metrics import MetricsFileDumper, counter, gauge, histogram
+from core.utils.shm import MdShmWriter
+from core.utils.shm_queue import ShmFrameQueue
+from external.common.object import Exchange, SubscribeRequest
+from external.utils.log import logger
+
+BACKPRESSURE_DROP = "drop"  # 队列满时直接丢弃消息
+BACKPRESSURE_BLOCK = "block"  # 队列满时阻塞接收线程等待解码进程，超过block_timeout后丢弃
+
+DEFAULT_DECODERS = 2
+DEFAULT_QUEUE_SIZE = 16 * 1024 * 1024  # 每个解码进程的队列字节数
+DEFAULT_BLOCK_TIMEOUT = 1.0  # 阻塞模式下单条消息最多等待的秒数
+DEFAULT_SYMBOL_CAPACITY = 1024  # 每个解码进程的行情共享内存最多容纳的symbol数
+DECODER_BATCH_SIZE = 256  # 解码进程每次从队列读取的最大帧数
+DECODER_IDLE_SLEEP = 0.0001  # 队列为空时解码进程的休眠秒数
+BLOCK_SLEEP = 0.00005  # 阻塞模式下接收线程重试的间隔秒数
+
+STREAM_PREFIX = '{"stream":"'  # 组合stream推送的开头，按此截取stream名称，不解析整条消息
+STREAM_PREFIX_BYTES = STREAM_PREFIX.encode()
+
+PIPELINE_QUEUE_FRAMES = gauge("md_pipeline_queue_frames", "解码队列中等待的消息数", ["shard"])
+PIPELINE_QUEUE_BYTES = gauge("md_pipeline_queue_bytes", "解码队列已使用的字节数", ["shard"])
+PIPELINE_DROPPED = counter("md_pipeline_dropped_total", "解码队列已满被丢弃的消息数", ["shard"])
+PIPELINE_BLOCKED_SECONDS = counter("md_pipeline_blocked_seconds_total", "接收线程等待解码队列的累计秒数", ["shard"])
+PIPELINE_QUEUE_LATENCY = histogram("md_pipeline_queue_latency_seconds", "消息从接收到解码完成的耗时(采样)", ["shard"])
+
+
+def parse_stream(message: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+    """
+    截取组合stream推送中的stream名称，不是行情推送(如订阅确认)时返回None
+    """
+    if isinstance(message, bytes):
+        prefix = STREAM_PREFIX_BYTES
+        quote = b'"'
+    else:
+        prefix = STREAM_PREFIX
+        quote = '"'
+    if not message.startswith(prefix):
+        return None
+    end = message.find(quote, len(prefix))
+    if end < 0:
+        return None
+    return message[len(prefix):end]
+
+
+def get_shard(symbol: str, decoders: int) -> int:
+    """
+    按symbol分配解码进程，同一symbol的消息始终由同一个进程按顺序处理
+    """
+    return zlib.crc32(symbol.encode()) % decoders
+
+
+class WebsocketDecodePipeline:
+    """
+    websocket消息的多进程解码流水线
+    接收线程只给原始消息打上接收时间并按symbol写入对应解码进程的共享内存队列(ShmFrameQueue)，
+    解析、处理和发布在解码进程中完成，解码的吞吐量不再受接收进程的GIL限制。
+    解码进程的行情写入各自的行情共享内存，名称为{md_store_prefix}_{i}，
+    队列长度、丢弃数和等待时间通过当前进程的指标导出
+    """
+
+    def __init__(self, decoders: int = DEFAULT_DECODERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 backpressure: str = BACKPRESSURE_BLOCK, block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+                 md_store_prefix: str = "binance_spot_md_decoder", symbol_capacity: int = DEFAULT_SYMBOL_CAPACITY,
+                 metrics_dump_path: str = ""):
+        """
+        :param decoders: 解码进程数
+        :param queue_size: 每个解码进程的队列字节数
+        :param backpressure: 队列满时的处理方式，BACKPRESSURE_BLOCK或BACKPRESSURE_DROP
+        :param block_timeout: 阻塞模式下单条消息最多等待的秒数
+        :param md_store_prefix: 解码进程行情共享内存的名称前缀
+        :param symbol_capacity: 每个解码进程最多处理的symbol数
+        :param metrics_dump_path: 不为空时解码进程把自己的指标写入{文件名}_decoder{i}{扩展名}
+        """
+        if backpressure not in (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP):
+            raise ValueError(f"不支持的backpressure: {backpressure}")
+        self.decoders = max(decoders, 1)
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self.md_store_prefix = md_store_prefix
+        self.symbol_capacity = symbol_capacity
+        self.metrics_dump_path = metrics_dump_path
+
+        self.queues: list[ShmFrameQueue] = []
+        self.processes: list[multiprocessing.Process] = []
+        self.stop_event: Event = multiprocessing.get_context("spawn").Event()
+        # stream名称 -> 解码队列序号，第一次收到时计算
+        self.stream_shards: dict[str, int] = {}
+        self.dropped = []
+        self.blocked_seconds = []
+        self.dead_decoders: set[int] = set()  # 已退出的解码进程序号
+
+    def start(self, symbols: list[str] = ()):
+        """
+        创建队列并启动解码进程，symbols会预先分配到各解码进程，之后新增的symbol在第一次收到消息时分配
+        """
+        if self.processes:
+            return
+        shards = [[] for _ in range(self.decoders)]
+        for symbol in symbols:
+            shards[get_shard(symbol, self.decoders)].append(symbol)
+
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.decoders):
+            frame_queue = ShmFrameQueue.create(self.get_queue_name(index), self.queue_size)
+            self.queues.append(frame_queue)
+            shard = str(index)
+            PIPELINE_QUEUE_FRAMES.labels(shard).set_function(lambda q=frame_queue: q.frames)
+            PIPELINE_QUEUE_BYTES.labels(shard).set_function(lambda q=frame_queue: q.used_bytes)
+            self.dropped.append(PIPELINE_DROPPED.labels(shard))
+            self.blocked_seconds.append(PIPELINE_BLOCKED_SECONDS.labels(shard))
+
+            process = context.Process(
+                target=run_decoder,
+                args=(index, frame_queue.name, self.get_md_store_name(index), shards[index], self.symbol_capacity,
+                      self.stop_event, self._get_metrics_dump_path(index)),
+                name=f"binance_spot_ws_decoder_{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        logger.info(f"websocket decode pipeline started, decoders: {self.decoders}, symbols: {len(symbols)}")
+
+    def stop(self):
+        """
+        停止解码进程，队列中尚未解码的消息会被丢弃
+        """
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=5)
+        for index, frame_queue in enumerate(self.queues):
+            PIPELINE_QUEUE_FRAMES.remove(str(index))
+            PIPELINE_QUEUE_BYTES.remove(str(index))
+            # 解码进程attach时的unregister会去掉共用resource_tracker中的登记，删除前重新登记
+            resource_tracker.register(frame_queue.shm._name, "shared_memory")
+            frame_queue.unlink()
+        self.processes.clear()
+        self.queues.clear()
+        self.dead_decoders.clear()
+
+    def get_queue_name(self, index: int) -> str:
+        return f"{self.md_store_prefix}_queue_{index}"
+
+    def get_md_store_name(self, index: int) -> str:
+        return f"{self.md_store_prefix}_{index}"
+
+    def dispatch(self, message: str) -> bool:
+        """
+        在接收线程中调用，把行情推送写入对应的解码队列
+        :return: 不是行情推送时返回False，由调用方在当前线程处理
+        """
+        stream = parse_stream(message)
+        if stream is None:
+            return False
+        index = self.stream_shards.get(stream)
+        if index is None:
+            index = self.stream_shards[stream] = get_shard(stream.split("@", 1)[0], self.decoders)
+
+        data = message.encode()
+        receive_time = time.time_ns()
+        frame_queue = self.queues[index]
+        if frame_queue.put(data, receive_time):
+            return True
+        # 队列满时先确认解码进程还在运行，已退出的分片直接丢弃，不阻塞接收线程
+        if self.backpressure == BACKPRESSURE_BLOCK and self._is_alive(index) \
+                and self._put_blocking(index, data, receive_time):
+            return True
+        self.dropped[index].inc()
+        return True
+
+    def _put_blocking(self, index: int, data: bytes, receive_time: int) -> bool:
+        frame_queue = self.queues[index]
+        start = time.perf_counter()
+        deadline = start + self.block_timeout
+        try:
+            while time.perf_counter() < deadline:
+                time.sleep(BLOCK_SLEEP)
+                if frame_queue.put(data, receive_time):
+                    return True
+                if not self._is_alive(index):
+                    return False
+            return False
+        finally:
+            self.blocked_seconds[index].inc(time.perf_counter() - start)
+
+    def _is_alive(self, index: int) -> bool:
+        """
+        解码进程是否在运行，第一次发现退出时记录错误日志，之后该分片的消息都会被丢弃
+        """
+        if index in self.dead_decoders:
+            return False
+        process = self.processes[index]
+        if process.is_alive():
+            return True
+        self.dead_decoders.add(index)
+        logger.error(f"解码进程{process.name}已退出, exitcode: {process.exitcode}, 该分片的消息将被丢弃")
+        return False
+
+    def _get_metrics_dump_path(self, index: int) -> str:
+        if not self.metrics_dump_path:
+            return ""
+        root, ext = os.path.splitext(self.metrics_dump_path)
+        return f"{root}_decoder{index}{ext}"
+
+
+def run_decoder(index: int, queue_name: str, md_store_name: str, symbols: list[str], symbol_capacity: int,
+                stop_event: Event, metrics_dump_path: str = ""):
+    """
+    解码进程的入口，从队列读取原始消息，使用BinanceSpotDataWebsocketApi的解析逻辑处理后写入行情共享内存，
+    直到stop_event被设置
+    """
+    frame_queue = ShmFrameQueue.attach(queue_name)
+    md_store = MdShmWriter.create(md_store_name, [], max(symbol_capacity, len(symbols)))
+    api = BinanceSpotDataWebsocketApi()
+    api.gateway_name = f"binance_spot_data_ws_decoder_{index}"
+    api.set_md_store(md_store)
+    for symbol in symbols:
+        _subscribe_symbol(api, symbol)
+
+    dumper = None
+    if metrics_dump_path:
+        dumper = MetricsFileDumper(metrics_dump_path)
+        dumper.start()
+    queue_latency = PIPELINE_QUEUE_LATENCY.labels(str(index))
+    handlers = api.handlers
+    frames_decoded = 0
+
+    try:
+        while not stop_event.is_set():
+            frames = frame_queue.get_many(DECODER_BATCH_SIZE)
+            if not frames:
+                time.sleep(DECODER_IDLE_SLEEP)
+                continue
+            for receive_time, frame in frames:
+                stream = parse_stream(frame).decode()
+                if stream not in handlers:
+                    _subscribe_stream(api, stream)
+                try:
+                    api.process_message(frame, receive_time / 1e9)
+                except Exception:
+                    logger.exception(f"{api.gateway_name} 处理消息失败: {frame[:200]}")
+                frames_decoded += 1
+                if not frames_decoded % METRICS_SAMPLE_INTERVAL:
+                    queue_latency.record((time.time_ns() - receive_time) // 1000)
+    finally:
+        if dumper is not None:
+            dumper.stop()
+        frame_queue.close()
+        md_store.unlink()
+
+
+def _subscribe_stream(api: BinanceSpotDataWebsocketApi, stream: str):
+    """
+    解码进程第一次收到某个symbol的消息时注册它的解析状态
+    """
+    symbol = stream.split("@", 1)[0]
+    if symbol in api.ticks:
+        return
+    try:
+        _subscribe_symbol(api, symbol)
+    except ValueError:
+        logger.exception(f"{api.gateway_name} 无法处理{symbol}")
+
+
+def _subscribe_symbol(api: BinanceSpotDataWebsocketApi, symbol: str):
+    api.subscribe(SubscribeRequest(symbol=symbol, exchange=Exchange.BINANCE))
+    # 解码进程不建立连接，不受单连接stream数量上限的限制
+    api.streams.clear()
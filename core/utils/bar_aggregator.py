@@ -0,0 +1,240 @@
+"""
+coding=utf-8
+@File   : bar_aggregator
+@Author : LiHan
+@Time   : 10/20/26:2:40 PM
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from core.utils.interval import UNIT_MILLISECONDS, interval_to_milliseconds
+from external.common.object import Interval, KLineData
+
+MINUTE_MILLISECONDS = 60 * 1000
+WEEK_MILLISECONDS = UNIT_MILLISECONDS["w"]
+WEEK_OFFSET_MILLISECONDS = 4 * UNIT_MILLISECONDS["d"]  # 1970-01-01是周四，Binance的周K线从周一(1970-01-05)开始
+DEFAULT_INTERVALS = ["5m", "15m", "1h", "4h", "1d"]
+
+BAR_TYPE_VOLUME = "volume"  # 按成交量切分
+BAR_TYPE_DOLLAR = "dollar"  # 按成交额切分
+
+# 由1分钟K线合成时各列的聚合方式，列名与K线存储的列名一致
+KLINE_AGGREGATIONS = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Volume": "sum",
+    "Turnover": "sum",
+    "NumberOfTrades": "sum",
+    "TakerBuyBaseAssetVolume": "sum",
+    "TakerBuyQuoteAssetVolume": "sum",
+}
+
+
+@dataclass
+class Bar:
+    """
+    合成的K线
+    """
+    symbol: str
+    interval: str  # 时间K线为周期，如5m；成交量/成交额K线为volume或dollar
+    open_time: int  # 第一根1分钟K线的开盘时间，毫秒
+    close_time: int  # 最后一根1分钟K线的收盘时间，毫秒
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    turnover: float
+    count: int  # 合成的1分钟K线数量，时间K线小于周期内分钟数时说明有缺失
+
+    def update(self, open_time: int, high: float, low: float, close: float, volume: float, turnover: float):
+        self.close_time = open_time + MINUTE_MILLISECONDS - 1
+        self.high = max(self.high, high)
+        self.low = min(self.low, low)
+        self.close = close
+        self.volume += volume
+        self.turnover += turnover
+        self.count += 1
+
+
+class BarAggregator:
+    """
+    流式K线合成器，输入已完成的1分钟K线，同时合成多个周期的时间K线以及成交量/成交额K线
+    时间K线按UTC对齐(与Binance一致，周K线从周一开始)，周期内最后一分钟到达时立即推送，
+    如果周期最后一分钟缺失，则在下一个周期的第一根K线到达时推送
+    """
+
+    def __init__(self, on_bar: Callable[[Bar], None], intervals: Optional[list[Union[Interval, str]]] = None,
+                 volume_threshold: float = 0, dollar_threshold: float = 0):
+        """
+        :param on_bar: 合成完成的回调
+        :param intervals: 时间K线的周期，默认为5m、15m、1h、4h、1d
+        :param volume_threshold: 成交量K线的阈值，0表示不合成
+        :param dollar_threshold: 成交额K线的阈值，0表示不合成
+        """
+        self.on_bar = on_bar
+        intervals = DEFAULT_INTERVALS if intervals is None else intervals
+        self.intervals: list[tuple[str, int]] = []
+        for interval in intervals:
+            value = interval.value if isinstance(interval, Interval) else interval
+            interval_ms = interval_to_milliseconds(value)
+            if interval_ms % MINUTE_MILLISECONDS or interval_ms <= MINUTE_MILLISECONDS:
+                raise ValueError(f"只能合成大于1分钟且为整数分钟的周期: {value}")
+            self.intervals.append((value, interval_ms))
+        self.thresholds: list[tuple[str, float]] = [
+            (bar_type, threshold)
+            for bar_type, threshold in ((BAR_TYPE_VOLUME, volume_threshold), (BAR_TYPE_DOLLAR, dollar_threshold))
+            if threshold > 0
+        ]
+
+        # (symbol, 周期) -> 正在合成的K线
+        self.bars: dict[tuple[str, str], Bar] = {}
+
+    def update_kline(self, kline: KLineData, open_time: int):
+        """
+        输入一根已完成的1分钟K线
+        :param kline: websocket推送的K线
+        :param open_time: K线的开盘时间，毫秒
+        """
+        self.update(kline.symbol, open_time, kline.open, kline.high, kline.low, kline.close, kline.volume,
+                    kline.turnover)
+
+    def update(self, symbol: str, open_time: int, open_price: float, high: float, low: float, close: float,
+               volume: float, turnover: float):
+        for interval, interval_ms in self.intervals:
+            bar_start = get_bar_start(open_time, interval_ms)
+            key = (symbol, interval)
+            bar = self.bars.get(key)
+            if bar is not None and bar.open_time != bar_start:
+                # 上一个周期的最后一分钟缺失，新周期开始时推送
+                del self.bars[key]
+                self.on_bar(bar)
+                bar = None
+
+            if bar is None:
+                bar = self.bars[key] = Bar(symbol, interval, bar_start, open_time + MINUTE_MILLISECONDS - 1,
+                                           open_price, high, low, close, volume, turnover, 1)
+            else:
+                bar.update(open_time, high, low, close, volume, turnover)
+
+            if open_time + MINUTE_MILLISECONDS >= bar_start + interval_ms:
+                del self.bars[key]
+                self.on_bar(bar)
+
+        for bar_type, threshold in self.thresholds:
+            key = (symbol, bar_type)
+            bar = self.bars.get(key)
+            if bar is None:
+                bar = self.bars[key] = Bar(symbol, bar_type, open_time, open_time + MINUTE_MILLISECONDS - 1,
+                                           open_price, high, low, close, volume, turnover, 1)
+            else:
+                bar.update(open_time, high, low, close, volume, turnover)
+
+            # 最小粒度为1分钟，实际的量会略超过阈值
+            if (bar.volume if bar_type == BAR_TYPE_VOLUME else bar.turnover) >= threshold:
+                del self.bars[key]
+                self.on_bar(bar)
+
+    def flush(self, symbol: Optional[str] = None):
+        """
+        推送所有未完成的K线，如停止时调用
+        """
+        for key in [key for key in self.bars if symbol is None or key[0] == symbol]:
+            self.on_bar(self.bars.pop(key))
+
+
+def get_bar_start(open_time, interval_ms: int):
+    """
+    计算开盘时间所在周期的开始时间，按UTC对齐，周K线对齐到周一
+    :param open_time: 开盘时间，毫秒，可以是numpy数组
+    :param interval_ms: 周期的毫秒数
+    """
+    offset = WEEK_OFFSET_MILLISECONDS if interval_ms % WEEK_MILLISECONDS == 0 else 0
+    return open_time - (open_time - offset) % interval_ms
+
+
+def aggregate_klines(df: pd.DataFrame, interval: Union[Interval, str]) -> pd.DataFrame:
+    """
+    将1分钟K线批量合成为更大周期的K线
+    :param df: 1分钟K线，列名与K线存储一致，需要包含ExchangeTime(开盘时间)，可以包含多个Symbol
+    :param interval: 目标周期，如5m、1h
+    :return: 合成的K线，列与输入一致，ExchangeTime为周期的开盘时间，Interval为目标周期
+    """
+    value = interval.value if isinstance(interval, Interval) else interval
+    if df.empty:
+        return df
+    interval_ms = interval_to_milliseconds(value)
+
+    df = df.sort_values("ExchangeTime", ignore_index=True)
+    open_times = df["ExchangeTime"].to_numpy()
+    keys = {"ExchangeTime": get_bar_start(open_times, interval_ms)}
+    return _aggregate(df, keys, value)
+
+
+def aggregate_threshold_bars(df: pd.DataFrame, threshold: float, bar_type: str = BAR_TYPE_VOLUME) -> pd.DataFrame:
+    """
+    将1分钟K线批量合成为成交量或成交额K线
+    每根K线在累计量达到阈值时结束，最小粒度为1分钟，与BarAggregator的结果一致
+    :param df: 1分钟K线，可以包含多个Symbol
+    :param threshold: 阈值
+    :param bar_type: volume按成交量，dollar按成交额
+    :return: 合成的K线，ExchangeTime为第一根1分钟K线的开盘时间
+    """
+    if df.empty:
+        return df
+    column = "Volume" if bar_type == BAR_TYPE_VOLUME else "Turnover"
+    df = df.sort_values(["Symbol", "ExchangeTime"] if "Symbol" in df.columns else ["ExchangeTime"],
+                        ignore_index=True)
+
+    groups = df.groupby("Symbol", sort=False) if "Symbol" in df.columns else [(None, df)]
+    bar_ids = np.empty(len(df), dtype=np.int64)
+    for _, group in groups:
+        bar_ids[group.index.to_numpy()] = _threshold_bar_ids(group[column].to_numpy(), threshold)
+
+    res = _aggregate(df, {"BarId": bar_ids}, bar_type)
+    return res.drop(columns=["BarId"])
+
+
+def _threshold_bar_ids(values: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    按累计量切分，累计量达到阈值的那一行属于当前K线，下一行开始新的K线
+    阈值切分依赖前一根K线的剩余量，无法完全向量化，这里用一次线性扫描
+    """
+    bar_ids = np.empty(len(values), dtype=np.int64)
+    bar_id = 0
+    total = 0.0
+    for index, value in enumerate(values.tolist()):
+        bar_ids[index] = bar_id
+        total += value
+        if total >= threshold:
+            bar_id += 1
+            total = 0.0
+    return bar_ids
+
+
+def _group_keys(df: pd.DataFrame, keys: dict[str, np.ndarray]) -> list:
+    group_keys = [df["Symbol"]] if "Symbol" in df.columns else []
+    return group_keys + [pd.Series(values, index=df.index, name=name) for name, values in keys.items()]
+
+
+def _aggregate(df: pd.DataFrame, keys: dict[str, np.ndarray], interval: str) -> pd.DataFrame:
+    """
+    按keys分组聚合，df需要已按时间排序，keys与df的行一一对应
+    """
+    aggregations = {column: how for column, how in KLINE_AGGREGATIONS.items() if column in df.columns}
+    if "ExchangeTime" not in keys:
+        aggregations["ExchangeTime"] = "first"
+    # 其他列(Exchange、LocalTime等)取周期内最后一行
+    aggregations.update({column: "last" for column in df.columns
+                         if column not in aggregations and column not in ("Symbol", *keys)})
+
+    res = df.groupby(_group_keys(df, keys), sort=True).agg(aggregations).reset_index()
+    if "Interval" in res.columns:
+        res["Interval"] = interval
+    return res[[column for column in df.columns if column in res.columns]
+               + [column for column in keys if column not in df.columns]]
@@ -4,16 +4,130 @@ coding=utf-8
 @Author : LiHan
 @Time   : 11/6/24:2:00 PM
 """
+import os
+import queue
+import tempfile
+import threading
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from multiprocessing import get_context
-from typing import Union
+from typing import Callable, Iterator, Optional, Union
 
 import clickhouse_connect
 import pandas as pd
 import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+from clickhouse_connect.driver.client import Client
+from clickhouse_connect.driver.exceptions import OperationalError
 from loguru import logger
 
-import numpy as np
+from core.utils.metrics import counter, histogram
+
+# 每个连接的会话设置，随每个请求一起发送，不再单独执行SET
+DEFAULT_SETTINGS = {
+    "connect_timeout_with_failover_ms": 1000,
+    "max_network_bandwidth": 3000000,
+}
+DEFAULT_POOL_SIZE = 8
+POOL_CHECKOUT_TIMEOUT_SECONDS = 60
+HEALTH_CHECK_INTERVAL_SECONDS = 30  # 连接空闲超过该时间后，取出时先ping一次
+DEFAULT_STREAM_BLOCK_SIZE = 100000  # 流式查询每块的行数
+INSERT_MAX_RETRY = 3  # 并行插入时每个批次的最大尝试次数
+SHM_DIRECTORY = "/dev/shm"  # 并行插入的临时文件优先放在内存文件系统中
+
+CLICKHOUSE_INSERT_SECONDS = histogram("md_clickhouse_insert_seconds", "ClickHouse单批插入耗时", ["table"])
+CLICKHOUSE_INSERT_ROWS = counter("md_clickhouse_insert_rows_total", "ClickHouse插入的行数", ["table"])
+CLICKHOUSE_INSERT_FAILURES = counter("md_clickhouse_insert_failures_total", "ClickHouse插入失败的批次数", ["table"])
+
+
+class ClickhouseClientPool:
+    """
+    线程安全的clickhouse_connect客户端连接池
+    连接按需创建，最多max_size个；空闲过久的连接在取出时做健康检查，网络错误后的连接直接丢弃重建
+    """
+
+    def __init__(self, factory: Callable[[], Client], max_size: int = DEFAULT_POOL_SIZE,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL_SECONDS):
+        self.factory = factory
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+
+        self.idle: queue.LifoQueue[tuple[Client, float]] = queue.LifoQueue()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        client = self.checkout()
+        try:
+            yield client
+        except OperationalError:
+            self.discard(client)
+            raise
+        except BaseException:
+            self.checkin(client)
+            raise
+        else:
+            self.checkin(client)
+
+    def checkout(self, timeout: float = POOL_CHECKOUT_TIMEOUT_SECONDS) -> Client:
+        while True:
+            try:
+                client, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                client = self._create()
+                if client is not None:
+                    return client
+                try:
+                    client, last_used = self.idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"等待clickhouse连接超时, 连接池大小: {self.max_size}")
+
+            if time.monotonic() - last_used < self.health_check_interval or self._ping(client):
+                return client
+            logger.warning("clickhouse连接健康检查失败, 重新创建连接")
+            self.discard(client)
+
+    def checkin(self, client: Client):
+        self.idle.put((client, time.monotonic()))
+
+    def discard(self, client: Client):
+        with self.lock:
+            self.size -= 1
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                client, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(client)
+
+    def _create(self) -> Optional[Client]:
+        with self.lock:
+            if self.size >= self.max_size:
+                return None
+            self.size += 1
+        try:
+            return self.factory()
+        except BaseException:
+            with self.lock:
+                self.size -= 1
+            raise
+
+    @staticmethod
+    def _ping(client: Client) -> bool:
+        try:
+            return client.ping()
+        except Exception:
+            return False
 
 
 class ClickhouseClient:
@@ -25,6 +139,7 @@ class ClickhouseClient:
             passwd: str,
             port: int = 8123,
             database: str = "default",
+            pool_size: int = DEFAULT_POOL_SIZE,
     ):
         self.host = host
         self.username = username
@@ -32,166 +147,321 @@ class ClickhouseClient:
         self.port = port
         self.database = database
         self.compression = "lz4"
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.pool = ClickhouseClientPool(self.get_client, pool_size)
 
     def set_compress(self, compression: str):
         # local link table 不支持lz4压缩，需要用gzip
         self.compression = compression
+        # 已有连接使用旧的压缩方式，需要重建
+        self.pool.close()
 
-    def get_client(self):
-        client = clickhouse_connect.get_client(
+    def get_client(self) -> Client:
+        """
+        创建一个新的客户端，一般通过连接池使用
+        """
+        return clickhouse_connect.get_client(
             host=self.host,
             username=self.username,
             password=self.passwd,
             port=self.port,
-            compression=self.compression
+            database=self.database,
+            compression=self.compression,
+            settings=self.settings,
+            # 不使用会话，同一个客户端可以在不同线程间复用
+            autogenerate_session_id=False,
         )
-        client.command("set connect_timeout_with_failover_ms = 1000;")
-        client.command("set max_network_bandwidth = 3000000;")
-        return client
+
+    def connection(self):
+        """
+        从连接池取出一个客户端，with语句结束后归还
+        """
+        return self.pool.connection()
+
+    def close(self):
+        self.pool.close()
 
     def command(self, sql):
-        with self.get_client() as client:
-            client.command(sql)
+        with self.connection() as client:
+            return client.command(sql)
 
     def query(self, sql):
-        with self.get_client() as client:
+        with self.connection() as client:
             return client.query(sql)
 
     def delete(self, table_name: str, condition: str):
         sql = f"ALTER TABLE {table_name} DELETE WHERE {condition}"
         self.command(sql)
 
-    def query_dataframe(self, sql):
-        result = self.query(sql)
-        df = pd.DataFrame(result.result_rows, columns=result.column_names)
-        return df
-
-    def query_value(self, sql):
-        result = self.query(sql)
-        if len(result.result_rows) == 0:
-            return None
-        return result.result_rows[0][0]
-
-    def insert_dataframe(self, table_name: str, df: Union[pd.DataFrame, pl.DataFrame], batch_size: int = 100000):
+    def query_dataframe(self, sql) -> pd.DataFrame:
         """
-        使用clickhouse_connect的原生insert_df方法批量插入数据
+        查询并返回pandas.DataFrame，结果按列直接由Arrow转换，不经过逐行的Python元组
         """
-        start = time.time()
+        return self.query_arrow(sql).to_pandas()
 
-        df = self._to_pandas(df)
+    def query_arrow(self, sql, parameters: Optional[dict] = None) -> pa.Table:
+        """
+        以Arrow格式查询，服务端直接返回列式数据
+        """
+        with self.connection() as client:
+            return client.query_arrow(sql, parameters=parameters)
 
-        # 处理DataFrame中的特殊值，避免插入错误
-        df = self._handle_special_values(df)
+    def query_polars(self, sql, parameters: Optional[dict] = None) -> pl.DataFrame:
+        return pl.from_arrow(self.query_arrow(sql, parameters))
 
-        total_rows = len(df)
+    def query_df_stream(self, sql, block_size: int = DEFAULT_STREAM_BLOCK_SIZE, parameters: Optional[dict] = None,
+                        cancel: Optional[threading.Event] = None):
+        """
+        流式查询，按块返回pandas.DataFrame，内存占用与块大小相关而与结果总量无关
+        用法:
+            with client.query_df_stream(sql) as blocks:
+                for df in blocks:
+                    ...
+        提前退出with(或设置cancel)会关闭HTTP响应，服务端随之停止查询
+        :param sql: 查询语句
+        :param block_size: 每块的行数(服务端的max_block_size，实际块可能略小)
+        :param parameters: 查询参数
+        :param cancel: 其他线程设置后，在下一块到达时停止
+        """
+        return self._query_stream("query_df_stream", sql, block_size, parameters, cancel)
 
-        with self.get_client() as client:
-            for i in range(0, total_rows, batch_size):
-                batch_df = df.iloc[i:i + batch_size]
-                # logger.info(f"插入数据到{table_name} {i} - {min(i + batch_size, total_rows)} / 总共 {total_rows}")
-                client.insert_df(table_name, batch_df)
+    def query_np_stream(self, sql, block_size: int = DEFAULT_STREAM_BLOCK_SIZE, parameters: Optional[dict] = None,
+                        cancel: Optional[threading.Event] = None):
+        """
+        流式查询，按块返回numpy结构化数组，用法同query_df_stream
+        """
+        return self._query_stream("query_np_stream", sql, block_size, parameters, cancel)
 
-        end = time.time()
-        duration = end - start
-        # logger.info(
-        #     f"插入数据到{table_name}成功, batch: {batch_size}, 耗时: {duration:.2f}秒, "
-        #     f"行数: {total_rows}, 平均每秒插入: {total_rows / duration:.2f}行"
-        # )
+    def query_arrow_stream(self, sql, block_size: int = DEFAULT_STREAM_BLOCK_SIZE, parameters: Optional[dict] = None,
+                           cancel: Optional[threading.Event] = None):
+        """
+        流式查询，按块返回pyarrow.RecordBatch，用法同query_df_stream
+        """
+        return self._query_stream("query_arrow_stream", sql, block_size, parameters, cancel)
 
-    def insert_dataframe_parallel(self, table_name: str, df: pd.DataFrame, batch_size: int = 100000,
-                                  max_workers: int = 4):
+    @contextmanager
+    def query_polars_stream(self, sql, block_size: int = DEFAULT_STREAM_BLOCK_SIZE,
+                            parameters: Optional[dict] = None, cancel: Optional[threading.Event] = None):
         """
-        并行批量插入数据
+        流式查询，按块返回polars.DataFrame，用法同query_df_stream
         """
-        start = time.time()
-        logger.info(f"开始并行插入数据到{table_name}")
+        with self.query_arrow_stream(sql, block_size, parameters, cancel) as batches:
+            yield (pl.from_arrow(batch) for batch in batches)
 
-        df = self._to_pandas(df)
+    @contextmanager
+    def _query_stream(self, method: str, sql, block_size: int, parameters: Optional[dict],
+                      cancel: Optional[threading.Event]):
+        settings = {"max_block_size": block_size}
+        with self.connection() as client:
+            with getattr(client, method)(sql, parameters=parameters, settings=settings) as stream:
+                yield _cancellable(stream, cancel)
 
-        # 处理DataFrame中的特殊值
-        df = self._handle_special_values(df)
+    def query_value(self, sql):
+        result = self.query(sql)
+        if len(result.result_rows) == 0:
+            return None
+        return result.result_rows[0][0]
 
-        # 将数据分割成多个批次
-        total_rows = len(df)
-        batches = [df.iloc[i:i + batch_size] for i in range(0, total_rows, batch_size)]
+    def insert_dataframe(self, table_name: str, df: Union[pd.DataFrame, pl.DataFrame, pa.Table],
+                         batch_size: int = 100000):
+        """
+        批量插入数据，统一转换为Arrow后以Arrow格式插入
+        """
+        self.insert_arrow(table_name, df, batch_size)
 
-        # 准备连接参数
-        connection_params = {
+    def insert_arrow(self, table_name: str, data: Union[pd.DataFrame, pl.DataFrame, pa.Table],
+                     batch_size: Optional[int] = None, settings: Optional[dict] = None) -> int:
+        """
+        以Arrow格式插入数据，polars和Arrow表不经过pandas，分批时按切片插入，不复制数据
+        :param table_name: 表名
+        :param data: pandas/polars DataFrame或Arrow表
+        :param batch_size: 每批行数，None表示一次插入
+        :param settings: 本次插入的设置，如async_insert、insert_deduplication_token
+        :return: 插入的行数
+        """
+        table = self._handle_special_values_arrow(self._to_arrow(data))
+        total_rows = table.num_rows
+        batch_size = batch_size or total_rows
+
+        insert_seconds = CLICKHOUSE_INSERT_SECONDS.labels(table_name)
+        insert_rows = CLICKHOUSE_INSERT_ROWS.labels(table_name)
+        with self.connection() as client:
+            for i in range(0, total_rows, batch_size):
+                batch = table.slice(i, batch_size)
+                start = time.perf_counter()
+                try:
+                    client.insert_arrow(table_name, batch, settings=settings)
+                except Exception:
+                    CLICKHOUSE_INSERT_FAILURES.labels(table_name).inc()
+                    raise
+                insert_seconds.record(int((time.perf_counter() - start) * 1000000))
+                insert_rows.inc(batch.num_rows)
+        return total_rows
+
+    def get_connection_params(self) -> dict:
+        """
+        创建客户端的参数，用于在子进程中创建相同配置的客户端
+        """
+        return {
             'host': self.host,
             'username': self.username,
             'password': self.passwd,
-            'database': self.database
+            'port': self.port,
+            'database': self.database,
+            'compression': self.compression,
+            'settings': self.settings,
+            'autogenerate_session_id': False,
         }
 
-        # 准备进程池的参数
-        batch_args = [
-            (batch, connection_params, table_name, i, len(batches))
-            for i, batch in enumerate(batches)
-        ]
-
-        # 使用进程池并行执行插入
-        ctx = get_context("spawn")
-        with ctx.Pool(processes=max_workers) as pool:
-            results = pool.map(_insert_batch, batch_args)
-
-        # 统计成功和失败的批次
-        success_count = sum(results)
-        failed_count = len(results) - success_count
-
-        end = time.time()
-        duration = end - start
-
-        # 记录执行统计信息
+    def insert_dataframe_parallel(self, table_name: str, df: Union[pd.DataFrame, pl.DataFrame, pa.Table],
+                                  batch_size: int = 100000, max_workers: int = 4,
+                                  max_retry: int = INSERT_MAX_RETRY, insert_id: Optional[str] = None) -> int:
+        """
+        多进程并行批量插入数据
+        数据只写一次Arrow IPC临时文件(优先放在/dev/shm)，子进程以内存映射方式读取，只传递批次的偏移量，不序列化数据；
+        每个子进程复用一个连接，每个批次带insert_deduplication_token，失败重试时服务端会去重，不会重复写入。
+        注意: 非复制表需要设置non_replicated_deduplication_window，去重才会生效
+        :param table_name: 表名
+        :param df: pandas/polars DataFrame或Arrow表
+        :param batch_size: 每批行数
+        :param max_workers: 进程数
+        :param max_retry: 每个批次的最大尝试次数
+        :param insert_id: 本次插入的标识，用于生成去重token，重新执行同一次插入时传入相同的值可以避免重复
+        :return: 插入的行数，有批次最终失败时抛出异常
+        """
+        start = time.time()
+        table = self._handle_special_values_arrow(self._to_arrow(df))
+        total_rows = table.num_rows
+        if not total_rows:
+            return 0
+        insert_id = insert_id or uuid.uuid4().hex
+        batches = [(index, offset, min(batch_size, total_rows - offset))
+                   for index, offset in enumerate(range(0, total_rows, batch_size))]
+        logger.info(f"开始并行插入数据到{table_name}, 行数: {total_rows}, 批次数: {len(batches)}, 进程数: {max_workers}")
+
+        ipc_path = _write_ipc_file(table)
+        del table
+        failed = []
+        try:
+            ctx = get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx, initializer=_init_insert_worker,
+                                     initargs=(self.get_connection_params(), ipc_path)) as executor:
+                futures = [
+                    executor.submit(_insert_batch, table_name, index, offset, length, f"{insert_id}-{index}",
+                                    max_retry)
+                    for index, offset, length in batches
+                ]
+                for future in as_completed(futures):
+                    index, rows, duration, error = future.result()
+                    if error:
+                        CLICKHOUSE_INSERT_FAILURES.labels(table_name).inc()
+                        failed.append(index)
+                        logger.error(f"批次 {index + 1}/{len(batches)} 插入失败: {error}")
+                    else:
+                        CLICKHOUSE_INSERT_SECONDS.labels(table_name).record(int(duration * 1000000))
+                        CLICKHOUSE_INSERT_ROWS.labels(table_name).inc(rows)
+                        logger.debug(f"批次 {index + 1}/{len(batches)} 插入{rows}行, 耗时{duration:.2f}秒, "
+                                     f"{rows / max(duration, 1e-6):.0f}行/秒")
+        finally:
+            os.remove(ipc_path)
+
+        duration = time.time() - start
         logger.info(
             f"多进程并行插入数据到{table_name}完成:\n"
             f"- 总批次数: {len(batches)}\n"
-            f"- 成功批次: {success_count}\n"
-            f"- 失败批次: {failed_count}\n"
+            f"- 成功批次: {len(batches) - len(failed)}\n"
+            f"- 失败批次: {len(failed)}\n"
             f"- 进程数: {max_workers}\n"
             f"- 批次大小: {batch_size}\n"
             f"- 总行数: {total_rows}\n"
             f"- 总耗时: {duration:.2f}秒\n"
             f"- 平均每秒插入: {total_rows / duration:.2f}行"
         )
+        if failed:
+            raise RuntimeError(f"插入{table_name}有{len(failed)}个批次失败: {sorted(failed)}, "
+                               f"使用相同的insert_id={insert_id}重新执行不会重复写入已成功的批次")
+        return total_rows
 
     @staticmethod
-    def _handle_special_values(df: pd.DataFrame) -> pd.DataFrame:
+    def _handle_special_values_arrow(table: pa.Table) -> pa.Table:
         """
-        处理DataFrame中的特殊值，避免插入错误
+        处理特殊值，避免插入错误: TradingDay字符串转换为日期，浮点列中的inf替换为nan
+        只替换需要修改的列，其他列不复制
         """
-        if "TradingDay" in df.columns:
-            if df["TradingDay"].dtype == "object":
-                df["TradingDay"] = pd.to_datetime(df["TradingDay"]).dt.date
-
-        return df.replace([np.inf, -np.inf], np.nan)
+        for index, field in enumerate(table.schema):
+            column = table.column(index)
+            if field.name == "TradingDay" and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+                table = table.set_column(index, field.name, column.cast(pa.date32()))
+            elif pa.types.is_floating(field.type) and pc.any(pc.is_inf(column)).as_py():
+                table = table.set_column(index, field.name, pc.if_else(pc.is_inf(column), float("nan"), column))
+        return table
 
     @staticmethod
-    def _to_pandas(df: Union[pd.DataFrame, pl.DataFrame]) -> pd.DataFrame:
+    def _to_arrow(df: Union[pd.DataFrame, pl.DataFrame, pa.Table]) -> pa.Table:
         """
-        将 DataFrame 转换为 pandas.DataFrame，如果已经是 pandas.DataFrame 则无需转换
+        将 DataFrame 转换为 pyarrow.Table，polars转换不复制数据
         """
-        if isinstance(df, pd.DataFrame):
+        if isinstance(df, pa.Table):
             return df
         elif isinstance(df, pl.DataFrame):
-            return df.to_pandas()
+            return df.to_arrow()
+        elif isinstance(df, pd.DataFrame):
+            return pa.Table.from_pandas(df, preserve_index=False)
         else:
-            raise TypeError("DataFrame 类型必须为 pandas.DataFrame 或 polars.DataFrame")
+            raise TypeError("DataFrame 类型必须为 pandas.DataFrame、polars.DataFrame 或 pyarrow.Table")
+
 
+def _cancellable(blocks, cancel: Optional[threading.Event]):
+    for block in blocks:
+        if cancel is not None and cancel.is_set():
+            logger.info("流式查询已取消")
+            return
+        yield block
 
-def _insert_batch(args):
+
+# 子进程中的客户端和内存映射的数据，由进程池的initializer创建，每个进程一份
+_worker_client: Optional[Client] = None
+_worker_table: Optional[pa.Table] = None
+
+
+def _write_ipc_file(table: pa.Table) -> str:
+    """
+    将数据写入不压缩的Arrow IPC临时文件，子进程可以直接内存映射读取
     """
-    执行单个批次数据插入的独立函数
+    directory = SHM_DIRECTORY if os.path.isdir(SHM_DIRECTORY) else None
+    fd, path = tempfile.mkstemp(prefix="clickhouse_insert_", suffix=".arrow", dir=directory)
+    with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, table.schema) as writer:
+        writer.write_table(table)
+    return path
+
+
+def _init_insert_worker(connection_params: dict, ipc_path: str):
+    global _worker_client, _worker_table
+    _worker_client = clickhouse_connect.get_client(**connection_params)
+    _worker_table = pa.ipc.open_file(pa.memory_map(ipc_path, "r")).read_all()
+
+
+def _insert_batch(table_name: str, index: int, offset: int, length: int, dedup_token: str,
+                  max_retry: int) -> tuple[int, int, float, Optional[str]]:
+    """
+    在子进程中插入一个批次，失败时使用相同的去重token重试
     必须定义在类外部以支持多进程序列化
+    :return: (批次序号, 行数, 耗时, 错误信息)
     """
-    batch_df, connection_params, table_name, batch_num, total_batches = args
-    try:
-        client = clickhouse_connect.get_client(**connection_params)
-        client.insert_df(table_name, batch_df)
-        client.close()
-        return True
-    except Exception as e:
-        logger.error(f"批次 {batch_num + 1}/{total_batches} 插入失败: {str(e)}")
-        return False
+    batch = _worker_table.slice(offset, length)
+    settings = {"insert_deduplication_token": dedup_token}
+    error = None
+    for attempt in range(max_retry):
+        start = time.time()
+        try:
+            _worker_client.insert_arrow(table_name, batch, settings=settings)
+            return index, length, time.time() - start, None
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"批次 {index + 1} 第{attempt + 1}次插入失败: {error}")
+            if attempt + 1 < max_retry:
+                time.sleep(min(2 ** attempt, 30))
+    return index, length, 0.0, error
 
 
 def sync_data_from_remote(
@@ -200,26 +470,14 @@ def sync_data_from_remote(
         from_table_name: str,
         trading_day: str,
         to_table_name: str = None,
-):
-    # 1. 删除目标表数据
-    if to_table_name is None:
-        to_table_name = from_table_name
-    logger.info(f"删除目标表{to_table_name}数据")
-    to_client.delete(to_table_name, f"TradingDay = '{trading_day}'")
-
-    # 2. 插入数据
-    logger.info(f"从{from_client.host} 同步数据{from_table_name} 到{to_client.host} {to_table_name}")
-    sql = f"""
-           INSERT INTO {to_table_name}
-           SELECT *
-           FROM remote('{from_client.host}', '{from_table_name}', '{from_client.username}', '{from_client.passwd}')
-           WHERE TradingDay='{trading_day}' 
+        max_workers: int = 4,
+) -> int:
     """
-    try:
-        to_client.command(sql)
-    except Exception as _:
-        import traceback
-        exec = traceback.format_exc()
-        logger.error(f"同步数据失败, {exec}")
-        exit(1)
-    logger.info(f"同步数据{from_table_name}完成")
\ No newline at end of file
+    从远程集群同步一个交易日的数据，先写入暂存表并校验，再原子替换目标表的分区，
+    失败时抛出异常且不会删除目标表的数据，详见ClickhouseSyncEngine
+    :return: 同步的行数
+    """
+    from core.utils.clickhouse_sync import ClickhouseSyncEngine
+
+    engine = ClickhouseSyncEngine(from_client, to_client, from_table_name, to_table_name, max_workers=max_workers)
+    return engine.sync_day(trading_day)
@@ -0,0 +1,281 @@
+"""
+coding=utf-8
+@File   : clickhouse_sink
+@Author : LiHan
+@Time   : 10/22/26:4:20 PM
+"""
+import glob
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Sequence
+
+import pyarrow as pa
+from clickhouse_connect.driver.exceptions import OperationalError
+from loguru import logger
+
+from core.utils.clickhouse import ClickhouseClient
+from core.utils.metrics import counter, gauge
+
+DEFAULT_MAX_ROWS = 100000  # 单表缓冲达到该行数时立即写入
+DEFAULT_MAX_DELAY = 1.0  # 单表最早一行缓冲超过该秒数时写入，决定数据落库的最大延迟
+DEFAULT_RETRY_INTERVAL = 5.0  # ClickHouse不可用时重试回放溢写文件的间隔秒数
+DEFAULT_MAX_REPLAY_ATTEMPTS = 3  # 非连接错误导致回放失败的最大次数，超过后隔离该文件
+MIN_CHECK_INTERVAL = 0.05  # 写入线程检查缓冲的最小间隔秒数
+SPILL_SUFFIX = ".arrow"
+QUARANTINE_SUFFIX = ".bad"  # 无法回放的溢写文件改为该后缀，不再回放，需要人工处理
+
+# 连接类错误，ClickHouse恢复后可以重试；其余错误(如表结构不一致)重试也不会成功
+CONNECTION_ERRORS = (OperationalError, OSError, TimeoutError)
+
+# 服务端合并小批量插入，wait_for_async_insert=1时插入失败仍会返回错误，溢写逻辑不受影响；
+# async_insert默认不做插入去重，需要开启async_insert_deduplicate才会使用insert_deduplication_token
+ASYNC_INSERT_SETTINGS = {
+    "async_insert": 1,
+    "wait_for_async_insert": 1,
+    "async_insert_deduplicate": 1,
+}
+
+SINK_BUFFERED_ROWS = gauge("md_sink_buffered_rows", "ClickhouseSink缓冲中等待写入的行数", ["table"])
+SINK_FLUSHED_ROWS = counter("md_sink_flushed_rows_total", "ClickhouseSink写入ClickHouse的行数", ["table"])
+SINK_SPILLED_ROWS = counter("md_sink_spilled_rows_total", "ClickHouse不可用时溢写到本地磁盘的行数", ["table"])
+SINK_REPLAYED_ROWS = counter("md_sink_replayed_rows_total", "从溢写文件回放到ClickHouse的行数", ["table"])
+SINK_DROPPED_ROWS = counter("md_sink_dropped_rows_total", "写入和溢写都失败而丢弃的行数", ["table"])
+SINK_QUARANTINED_ROWS = counter("md_sink_quarantined_rows_total", "无法回放而被隔离的溢写行数", ["table"])
+SINK_SPILL_FILES = gauge("md_sink_spill_files", "等待回放的溢写文件数").labels()
+
+
+class _TableBuffer:
+    """
+    单个表的列式缓冲，每列一个list，写入时整体交换出去再转换为Arrow表
+    """
+
+    def __init__(self, name: str, schema: pa.Schema):
+        self.name = name
+        self.schema = schema
+        self.columns: list[list] = [[] for _ in schema]
+        self.rows = 0
+        self.first_time = 0.0  # 缓冲中第一行的时间，monotonic
+        self.lock = threading.Lock()
+        SINK_BUFFERED_ROWS.labels(name).set_function(lambda: self.rows)
+
+    def append(self, row: Sequence) -> int:
+        with self.lock:
+            if not self.rows:
+                self.first_time = time.monotonic()
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.rows += 1
+            return self.rows
+
+    def take(self) -> Optional[pa.Table]:
+        with self.lock:
+            if not self.rows:
+                return None
+            columns = self.columns
+            self.columns = [[] for _ in self.schema]
+            self.rows = 0
+        return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                                    schema=self.schema)
+
+
+class ClickhouseSink:
+    """
+    实时行情写入ClickHouse的缓冲层
+    行情逐条append到每个表的列式缓冲，后台线程在行数达到max_rows或最早一行等待超过max_delay时整批插入，
+    ClickHouse的part数量只与写入频率有关，与行情频率无关。
+    插入失败时整批以Arrow IPC文件溢写到spill_dir/{表名}/，之后新的批次也直接溢写，
+    每隔retry_interval按文件顺序回放，全部回放成功后恢复直接插入；启动时会先回放上次遗留的文件。
+    每个批次生成一个insert_deduplication_token，溢写文件以它命名，回放时使用同一个token，
+    插入超时但实际已写入、或回放成功但删除文件前退出时，重复插入会被服务端去重
+    (非复制表需要设置non_replicated_deduplication_window)。
+    连接类错误会一直重试；其他错误累计max_replay_attempts次后把文件改为.bad后缀隔离，不阻塞后续文件
+    """
+
+    def __init__(self, client: ClickhouseClient, spill_dir: str, max_rows: int = DEFAULT_MAX_ROWS,
+                 max_delay: float = DEFAULT_MAX_DELAY, async_insert: bool = False,
+                 retry_interval: float = DEFAULT_RETRY_INTERVAL,
+                 max_replay_attempts: int = DEFAULT_MAX_REPLAY_ATTEMPTS):
+        """
+        :param client: ClickHouse客户端
+        :param spill_dir: 溢写目录
+        :param max_rows: 单表缓冲达到该行数时立即写入
+        :param max_delay: 单表最早一行缓冲超过该秒数时写入
+        :param async_insert: 是否使用服务端的async_insert
+        :param retry_interval: ClickHouse不可用时重试的间隔秒数
+        :param max_replay_attempts: 非连接错误导致回放失败的最大次数
+        """
+        self.client = client
+        self.spill_dir = spill_dir
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.retry_interval = retry_interval
+        self.max_replay_attempts = max_replay_attempts
+        self.insert_settings = dict(ASYNC_INSERT_SETTINGS) if async_insert else {}
+        self.replay_failures: dict[str, int] = {}  # 溢写文件 -> 非连接错误导致的回放失败次数
+
+        self.buffers: dict[str, _TableBuffer] = {}
+        self.healthy = True
+        self.next_retry = 0.0
+        self.flush_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        os.makedirs(spill_dir, exist_ok=True)
+        SINK_SPILL_FILES.set(len(self._list_spill_files()))
+
+    def register(self, table_name: str, schema: pa.Schema):
+        """
+        注册表和列顺序，append的每一行按schema的列顺序排列，重复注册时忽略
+        """
+        if table_name not in self.buffers:
+            self.buffers[table_name] = _TableBuffer(table_name, schema)
+
+    def append(self, table_name: str, row: Sequence):
+        """
+        追加一行，可以在任意线程调用
+        """
+        if self.buffers[table_name].append(row) >= self.max_rows:
+            self.flush_event.set()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="clickhouse_sink")
+        self.thread.start()
+
+    def stop(self):
+        """
+        停止写入线程，并写入(或溢写)缓冲中剩余的数据
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.flush_event.set()
+            self.thread.join()
+            self.thread = None
+        self.flush(force=True)
+
+    def flush(self, force: bool = False):
+        """
+        写入达到阈值的缓冲，force=True时写入全部缓冲
+        """
+        with self.flush_lock:
+            now = time.monotonic()
+            for buffer in list(self.buffers.values()):
+                if not buffer.rows:
+                    continue
+                if force or buffer.rows >= self.max_rows or now - buffer.first_time >= self.max_delay:
+                    self._flush_buffer(buffer)
+
+    def _run(self):
+        interval = max(self.max_delay / 4, MIN_CHECK_INTERVAL)
+        self._replay()
+        while not self.stop_event.is_set():
+            self.flush_event.wait(interval)
+            self.flush_event.clear()
+            self.flush()
+            if not self.healthy and time.monotonic() >= self.next_retry:
+                self._replay()
+
+    def _flush_buffer(self, buffer: _TableBuffer):
+        table = buffer.take()
+        if table is None:
+            return
+        # 文件名以时间开头，回放时按写入顺序排列
+        token = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        if not self.healthy:
+            self._spill(buffer.name, table, token)
+            return
+        try:
+            self.client.insert_arrow(buffer.name, table,
+                                     settings={**self.insert_settings, "insert_deduplication_token": token})
+        except Exception:
+            logger.exception(f"写入{buffer.name}失败, {table.num_rows}行溢写到本地, "
+                             f"{self.retry_interval}秒后重试")
+            self._set_unhealthy()
+            self._spill(buffer.name, table, token)
+            return
+        SINK_FLUSHED_ROWS.labels(buffer.name).inc(table.num_rows)
+
+    def _spill(self, table_name: str, table: pa.Table, token: str):
+        directory = os.path.join(self.spill_dir, table_name)
+        path = os.path.join(directory, f"{token}{SPILL_SUFFIX}")
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except Exception:
+            logger.exception(f"溢写{table_name}失败, 丢弃{table.num_rows}行")
+            SINK_DROPPED_ROWS.labels(table_name).inc(table.num_rows)
+            return
+        SINK_SPILLED_ROWS.labels(table_name).inc(table.num_rows)
+        SINK_SPILL_FILES.inc()
+
+    def _replay(self):
+        """
+        按顺序回放溢写文件，失败时停止，等待下次重试
+        """
+        with self.flush_lock:
+            self._replay_files(self._list_spill_files())
+
+    def _replay_files(self, paths: list[str]):
+        remaining = len(paths)
+        for path in paths:
+            table_name = os.path.basename(os.path.dirname(path))
+            token = os.path.basename(path)[:-len(SPILL_SUFFIX)]
+            try:
+                with pa.OSFile(path, "rb") as source:
+                    table = pa.ipc.open_file(source).read_all()
+            except Exception:
+                logger.exception(f"读取溢写文件{path}失败, 已隔离")
+                self._quarantine(path, table_name, 0)
+                remaining -= 1
+                continue
+            try:
+                self.client.insert_arrow(table_name, table, settings={"insert_deduplication_token": token})
+            except CONNECTION_ERRORS:
+                logger.warning(f"回放溢写文件失败, 剩余{remaining}个文件, {self.retry_interval}秒后重试")
+                self._set_unhealthy()
+                SINK_SPILL_FILES.set(remaining)
+                return
+            except Exception:
+                failures = self.replay_failures.get(path, 0) + 1
+                if failures < self.max_replay_attempts:
+                    logger.exception(f"回放溢写文件{path}失败({failures}/{self.max_replay_attempts}), "
+                                     f"{self.retry_interval}秒后重试")
+                    self.replay_failures[path] = failures
+                    self._set_unhealthy()
+                    SINK_SPILL_FILES.set(remaining)
+                    return
+                logger.exception(f"回放溢写文件{path}失败{failures}次, 已隔离")
+                self._quarantine(path, table_name, table.num_rows)
+                remaining -= 1
+                continue
+            os.remove(path)
+            self.replay_failures.pop(path, None)
+            SINK_REPLAYED_ROWS.labels(table_name).inc(table.num_rows)
+            remaining -= 1
+        if paths:
+            logger.info(f"已回放{len(paths)}个溢写文件")
+        SINK_SPILL_FILES.set(0)
+        self.healthy = True
+
+    def _quarantine(self, path: str, table_name: str, rows: int):
+        """
+        把无法回放的溢写文件改为.bad后缀，之后不再回放
+        """
+        os.rename(path, f"{path}{QUARANTINE_SUFFIX}")
+        self.replay_failures.pop(path, None)
+        SINK_QUARANTINED_ROWS.labels(table_name).inc(rows)
+
+    def _set_unhealthy(self):
+        self.healthy = False
+        self.next_retry = time.monotonic() + self.retry_interval
+
+    def _list_spill_files(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.spill_dir, "*", f"*{SPILL_SUFFIX}")), key=os.path.basename)
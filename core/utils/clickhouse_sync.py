@@ -0,0 +1,224 @@
+"""
+coding=utf-8
+@File   : clickhouse_sync
+@Author : LiHan
+@Time   : 10/21/26:10:30 AM
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from loguru import logger
+
+from core.utils.clickhouse import ClickhouseClient
+
+DEFAULT_SYNC_WORKERS = 4
+DEFAULT_CHUNK_ROWS = 20_000_000  # 每个分块的目标行数，按Symbol合并
+STAGING_SUFFIX = "__sync_staging"
+
+
+class ClickhouseSyncEngine:
+    """
+    按交易日从远程集群同步表数据
+    1. 在目标集群创建与目标表结构、分区相同的暂存表
+    2. 按Symbol把当天数据切成多个分块，多线程并行INSERT ... SELECT FROM remote()写入暂存表
+    3. 每个分块写入后校验行数和校验和(cityHash64)，与源表一致才算完成
+    4. 目标表按月等粗粒度分区时，把目标表同分区中其他交易日的数据复制到暂存表
+    5. 全部分块完成后用REPLACE PARTITION把暂存表的分区原子替换到目标表，再校验目标表
+    中断后重新执行时，暂存表中已校验通过的分块会被跳过，只重新同步未完成的分块；
+    目标表只在最后一步被原子替换，任何一步失败都不会删除目标表的数据。
+    第4步到第5步之间写入目标表同分区其他交易日的数据会被替换掉，同步时不要并发写入这些分区。
+    源表当天没有数据时删除目标表当天的数据，与源表保持一致
+    """
+
+    def __init__(self, from_client: ClickhouseClient, to_client: ClickhouseClient, from_table_name: str,
+                 to_table_name: Optional[str] = None, chunk_column: Optional[str] = "Symbol",
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, max_workers: int = DEFAULT_SYNC_WORKERS):
+        """
+        :param from_client: 源集群
+        :param to_client: 目标集群
+        :param from_table_name: 源表
+        :param to_table_name: 目标表，默认与源表相同
+        :param chunk_column: 分块的列，None表示不分块
+        :param chunk_rows: 每个分块的目标行数
+        :param max_workers: 并行同步的分块数
+        """
+        self.from_client = from_client
+        self.to_client = to_client
+        self.from_table_name = from_table_name
+        self.to_table_name = to_table_name or from_table_name
+        self.chunk_column = chunk_column
+        self.chunk_rows = chunk_rows
+        self.max_workers = max_workers
+
+    def get_staging_table_name(self, trading_day: str) -> str:
+        """
+        每个交易日使用独立的暂存表，不同交易日可以同时同步
+        """
+        return f"{self.to_table_name}{STAGING_SUFFIX}_{trading_day.replace('-', '')}"
+
+    @property
+    def remote_table(self) -> str:
+        c = self.from_client
+        return (f"remote('{c.host}', '{self.from_table_name}', '{_escape(c.username)}', "
+                f"'{_escape(c.passwd)}')")
+
+    def sync_days(self, trading_days: list[str]):
+        for trading_day in trading_days:
+            self.sync_day(trading_day)
+
+    def sync_day(self, trading_day: str) -> int:
+        """
+        同步一个交易日，失败时抛出异常，目标表保持原样
+        :return: 同步的行数
+        """
+        start = time.time()
+        day_condition = f"TradingDay = '{_escape(trading_day)}'"
+        logger.info(f"从{self.from_client.host} 同步{self.from_table_name} {trading_day} "
+                    f"到{self.to_client.host} {self.to_table_name}")
+
+        chunks = self._plan_chunks(day_condition)
+        total_rows = sum(rows for _, rows in chunks)
+        if not total_rows:
+            stale = self.to_client.query_value(f"SELECT count() FROM {self.to_table_name} WHERE {day_condition}")
+            if stale:
+                logger.warning(f"源表{self.from_table_name} {trading_day}没有数据, "
+                               f"删除目标表{self.to_table_name}当天的{stale}行")
+                self.to_client.command(
+                    f"ALTER TABLE {self.to_table_name} DELETE WHERE {day_condition} SETTINGS mutations_sync = 2"
+                )
+            else:
+                logger.warning(f"源表{self.from_table_name} {trading_day}没有数据, 跳过同步")
+            return 0
+
+        staging_table_name = self.get_staging_table_name(trading_day)
+        self.to_client.command(f"CREATE TABLE IF NOT EXISTS {staging_table_name} AS {self.to_table_name}")
+
+        conditions = [f"{day_condition} AND {chunk}" if chunk else day_condition for chunk, _ in chunks]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            synced = list(executor.map(lambda condition: self._sync_chunk(staging_table_name, condition),
+                                       conditions))
+        logger.info(f"{trading_day} 共{len(chunks)}个分块, 本次同步{sum(synced)}个, "
+                    f"跳过已完成的{len(synced) - sum(synced)}个")
+
+        # 全部分块一致后，整体再校验一次
+        source = self._checksum(self.from_client, self.remote_table, day_condition)
+        staging = self._checksum(self.to_client, staging_table_name, day_condition)
+        if source != staging:
+            raise RuntimeError(f"暂存表{staging_table_name} {trading_day}校验失败, 源: {source}, 暂存: {staging}")
+
+        self._replace_partitions(staging_table_name, day_condition)
+        target = self._checksum(self.to_client, self.to_table_name, day_condition)
+        if source != target:
+            raise RuntimeError(f"目标表{self.to_table_name} {trading_day}校验失败, 源: {source}, 目标: {target}")
+
+        self.to_client.command(f"DROP TABLE IF EXISTS {staging_table_name}")
+        logger.info(f"同步{self.from_table_name} {trading_day}完成, 行数: {total_rows}, "
+                    f"耗时: {time.time() - start:.2f}秒")
+        return total_rows
+
+    def _plan_chunks(self, day_condition: str) -> list[tuple[str, int]]:
+        """
+        按chunk_column的取值把数据合并为行数接近chunk_rows的分块
+        :return: [(分块条件, 行数)]
+        """
+        if not self.chunk_column:
+            rows = self.from_client.query_value(f"SELECT count() FROM {self.remote_table} WHERE {day_condition}")
+            return [("", rows or 0)]
+
+        counts = self.from_client.query(
+            f"SELECT {self.chunk_column}, count() FROM {self.remote_table} WHERE {day_condition} "
+            f"GROUP BY {self.chunk_column} ORDER BY {self.chunk_column}"
+        ).result_rows
+
+        chunks = []
+        values, rows = [], 0
+        for value, count in counts:
+            values.append(value)
+            rows += count
+            if rows >= self.chunk_rows:
+                chunks.append((self._in_condition(values), rows))
+                values, rows = [], 0
+        if values:
+            chunks.append((self._in_condition(values), rows))
+        return chunks
+
+    def _in_condition(self, values: list) -> str:
+        return f"{self.chunk_column} IN ({', '.join(_quote(value) for value in values)})"
+
+    def _sync_chunk(self, staging_table_name: str, condition: str) -> bool:
+        """
+        同步一个分块到暂存表，暂存表中已一致的分块直接跳过
+        :return: 是否执行了同步
+        """
+        source = self._checksum(self.from_client, self.remote_table, condition)
+        staging = self._checksum(self.to_client, staging_table_name, condition)
+        if source == staging:
+            return False
+
+        if staging[0]:
+            # 上次中断留下的不完整数据
+            self.to_client.command(
+                f"ALTER TABLE {staging_table_name} DELETE WHERE {condition} SETTINGS mutations_sync = 2"
+            )
+        self.to_client.command(
+            f"INSERT INTO {staging_table_name} SELECT * FROM {self.remote_table} WHERE {condition}"
+        )
+
+        staging = self._checksum(self.to_client, staging_table_name, condition)
+        if source != staging:
+            raise RuntimeError(f"分块[{condition}]校验失败, 源: {source}, 暂存: {staging}")
+        return True
+
+    def _replace_partitions(self, staging_table_name: str, day_condition: str):
+        """
+        把暂存表的分区原子替换到目标表。REPLACE PARTITION替换整个分区，
+        分区包含多个交易日时先把目标表中其他交易日的数据复制到暂存表，替换后这些数据保持不变
+        """
+        partition_ids = [row[0] for row in self.to_client.query(
+            f"SELECT DISTINCT _partition_id FROM {staging_table_name}"
+        ).result_rows]
+        id_list = ", ".join(_quote(partition_id) for partition_id in partition_ids)
+
+        other_days = f"_partition_id IN ({id_list}) AND NOT ({day_condition})"
+        target = self._checksum(self.to_client, self.to_table_name, other_days)
+        staging = self._checksum(self.to_client, staging_table_name, other_days)
+        if target != staging:
+            if staging[0]:
+                # 上次中断留下的数据，或目标表在中断后又写入了其他交易日
+                self.to_client.command(
+                    f"ALTER TABLE {staging_table_name} DELETE WHERE {other_days} SETTINGS mutations_sync = 2"
+                )
+            logger.info(f"目标表{self.to_table_name}的分区{partition_ids}包含其他交易日的{target[0]}行, "
+                        f"复制到暂存表")
+            self.to_client.command(
+                f"INSERT INTO {staging_table_name} SELECT * FROM {self.to_table_name} WHERE {other_days}"
+            )
+            staging = self._checksum(self.to_client, staging_table_name, other_days)
+            if target != staging:
+                raise RuntimeError(f"暂存表{staging_table_name}复制其他交易日校验失败, "
+                                   f"目标: {target}, 暂存: {staging}")
+
+        for partition_id in partition_ids:
+            self.to_client.command(
+                f"ALTER TABLE {self.to_table_name} REPLACE PARTITION ID {_quote(partition_id)} "
+                f"FROM {staging_table_name}"
+            )
+
+    @staticmethod
+    def _checksum(client: ClickhouseClient, table: str, condition: str) -> tuple[int, int]:
+        """
+        行数和与行顺序无关的校验和
+        """
+        row = client.query(f"SELECT count(), sum(cityHash64(*)) FROM {table} WHERE {condition}").result_rows[0]
+        return int(row[0]), int(row[1] or 0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+
+def _quote(value) -> str:
+    if isinstance(value, (int, float)):
+        return str(value)
+    return f"'{_escape(value)}'"
@@ -7,6 +7,13 @@ coding=utf-8
 from enum import Enum
 
 WEBSOCKET_RECEIVE_TIMEOUT_SECOND = 24 * 60 * 60
+WEBSOCKET_MAX_STREAMS_PER_CONNECTION = 1024  # Binance单个连接最多订阅的stream数量
+WEBSOCKET_MAX_MESSAGES_PER_SECOND = 5  # Binance单个连接每秒最多接收客户端的消息数量
+WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE = 200  # 单个SUBSCRIBE请求包含的stream数量，避免消息过大
+
+REST_WEIGHT_LIMIT_1M = 6000  # Binance单IP每分钟请求权重上限
+REST_WEIGHT_SAFETY_RATIO = 0.9  # 只使用上限的一部分，给其他进程留余量
+REST_RATE_LIMIT_MAX_RETRY = 5  # 429/418 最大重试次数
 
 
 class Security(Enum):
@@ -0,0 +1,30 @@
+"""
+coding=utf-8
+@File   : interval
+@Author : LiHan
+@Time   : 10/17/26:1:35 PM
+"""
+from typing import Union
+
+from external.common.object import Interval
+
+UNIT_MILLISECONDS = {
+    "s": 1000,
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+    "w": 7 * 24 * 60 * 60 * 1000,
+}
+
+
+def interval_to_milliseconds(interval: Union[Interval, str]) -> int:
+    """
+    将K线周期转换为毫秒，如1m -> 60000
+    :param interval: Interval或Binance格式的周期字符串，如5m、4h、1d
+    :return: 毫秒数
+    """
+    value = interval.value if isinstance(interval, Interval) else interval
+    unit = value[-1]
+    if unit not in UNIT_MILLISECONDS or not value[:-1].isdigit():
+        raise ValueError(f"不支持的K线周期: {value}")
+    return int(value[:-1]) * UNIT_MILLISECONDS[unit]
@@ -0,0 +1,247 @@
+"""
+coding=utf-8
+@File   : journal
+@Author : LiHan
+@Time   : 10/20/26:10:15 AM
+"""
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+import pyarrow as pa
+
+from core.utils.metrics import counter
+from external.utils.log import logger
+
+# 日志文件布局: 文件头 | 数据块 | 数据块 | ...
+# 文件头: magic(8字节) + 压缩算法名(8字节，右侧补0)
+# 数据块: 块头(压缩后长度u4, 原始长度u4, 记录数u4) + 压缩数据
+# 块内记录: 本地接收时间(纳秒i8) + 消息长度(u4) + 消息内容
+JOURNAL_MAGIC = b"NQJRNL01"
+JOURNAL_SUFFIX = ".jrnl"
+FILE_HEADER = struct.Struct("<8s8s")
+BLOCK_HEADER = struct.Struct("<III")
+RECORD_HEADER = struct.Struct("<qI")
+
+CODEC_ZSTD = "zstd"
+CODEC_LZ4 = "lz4"  # lz4 frame格式
+
+DEFAULT_BLOCK_SIZE = 1 << 20  # 每块压缩前的大小
+DEFAULT_ROTATE_BYTES = 256 << 20  # 单个文件压缩后的大小上限
+DEFAULT_FLUSH_INTERVAL = 1.0  # 数据块未写满时最长的落盘间隔，秒
+
+JOURNAL_DROPPED = counter("md_journal_dropped_total", "行情日志记录器未运行时丢弃的消息数").labels()
+
+
+class JournalRecorder:
+    """
+    原始行情消息记录器，按数据块压缩后追加写入日志文件
+    record只把消息放入队列，编码、压缩和写文件都在后台线程中完成，不占用websocket线程。
+    文件按大小和日期滚动，写入中的文件以"."开头，滚动或关闭后重命名，读取方只需要读取不以"."开头的文件
+    """
+
+    def __init__(self, directory: Union[str, Path], prefix: str = "binance_spot", codec: str = CODEC_ZSTD,
+                 block_size: int = DEFAULT_BLOCK_SIZE, rotate_bytes: int = DEFAULT_ROTATE_BYTES,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        :param directory: 日志目录
+        :param prefix: 文件名前缀
+        :param codec: 压缩算法，zstd或lz4
+        :param block_size: 每块压缩前的大小
+        :param rotate_bytes: 单个文件的大小上限
+        :param flush_interval: 数据块未写满时最长的落盘间隔，秒
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.codec = pa.Codec(codec)
+        self.codec_name = codec
+        self.block_size = block_size
+        self.rotate_bytes = rotate_bytes
+        self.flush_interval = flush_interval
+
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+        self.active = False
+        # 保护active和入队，stop放入结束标记之后不会再有消息入队而未被写入
+        self.lock = threading.Lock()
+
+        self.file = None
+        self.file_path: Optional[Path] = None
+        self.file_day = ""
+        self.file_bytes = 0
+
+        self.records = 0
+        self.bytes_written = 0
+        self.dropped = 0  # 记录器未运行时丢弃的消息数
+
+    def start(self):
+        with self.lock:
+            if self.active:
+                return
+            self.active = True
+            self.thread = threading.Thread(target=self._run, daemon=True, name="journal_recorder")
+            self.thread.start()
+
+    def stop(self):
+        """
+        停止记录，写完队列中剩余的消息后关闭文件
+        """
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+            self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def record(self, message: Union[str, bytes], local_time: Optional[int] = None):
+        """
+        记录一条消息，可以在任意线程调用，start之前或stop之后的消息会被丢弃并计数
+        :param message: 原始消息
+        :param local_time: 本地接收时间，纳秒，默认为当前时间
+        """
+        with self.lock:
+            if self.active:
+                self.queue.put((local_time or time.time_ns(), message))
+                return
+            # 未启动或已停止时没有线程消费队列，直接丢弃，避免队列无限增长
+            if not self.dropped:
+                logger.warning(f"行情日志记录器{self.prefix}未启动, 丢弃消息")
+            self.dropped += 1
+        JOURNAL_DROPPED.inc()
+
+    def _run(self):
+        block = bytearray()
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+            if item:
+                local_time, message = item
+                if isinstance(message, str):
+                    message = message.encode()
+                block += RECORD_HEADER.pack(local_time, len(message))
+                block += message
+                count += 1
+
+            if len(block) >= self.block_size or (count and time.monotonic() >= deadline):
+                self._write_block(block, count)
+                block = bytearray()
+                count = 0
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+        if count:
+            self._write_block(block, count)
+        self._close_file()
+
+    def _write_block(self, block: bytearray, count: int):
+        try:
+            day = datetime.now().strftime("%Y%m%d")
+            if self.file is None or self.file_bytes >= self.rotate_bytes or day != self.file_day:
+                self._close_file()
+                self._open_file(day)
+
+            compressed = self.codec.compress(block, asbytes=True)
+            self.file.write(BLOCK_HEADER.pack(len(compressed), len(block), count))
+            self.file.write(compressed)
+            self.file.flush()
+
+            written = BLOCK_HEADER.size + len(compressed)
+            self.file_bytes += written
+            self.bytes_written += written
+            self.records += count
+        except Exception:
+            logger.exception(f"写入行情日志{self.file_path}失败, 丢弃{count}条消息")
+
+    def _open_file(self, day: str):
+        name = f"{self.prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{JOURNAL_SUFFIX}"
+        self.file_path = self.directory / name
+        self.file_day = day
+        self.file = open(self.directory / f".{name}", "wb")
+        self.file.write(FILE_HEADER.pack(JOURNAL_MAGIC, self.codec_name.encode()))
+        self.file_bytes = FILE_HEADER.size
+
+    def _close_file(self):
+        if self.file is None:
+            return
+        self.file.close()
+        os.replace(self.directory / f".{self.file_path.name}", self.file_path)
+        self.file = None
+
+
+def read_journal(path: Union[str, Path]) -> Iterator[tuple[int, bytes]]:
+    """
+    逐条读取日志文件
+    :param path: 日志文件路径
+    :return: (本地接收时间纳秒, 原始消息)的迭代器，文件末尾不完整的数据块会被忽略
+    """
+    with open(path, "rb") as f:
+        magic, codec_name = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != JOURNAL_MAGIC:
+            raise ValueError(f"{path}不是行情日志文件")
+        codec = pa.Codec(codec_name.rstrip(b"\0").decode())
+
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            compressed_size, raw_size, count = BLOCK_HEADER.unpack(header)
+            compressed = f.read(compressed_size)
+            if len(compressed) < compressed_size:
+                # 写入过程中进程退出留下的半个数据块
+                logger.warning(f"{path}末尾的数据块不完整, 已忽略")
+                break
+
+            block = memoryview(codec.decompress(compressed, decompressed_size=raw_size, asbytes=True))
+            offset = 0
+            for _ in range(count):
+                local_time, length = RECORD_HEADER.unpack_from(block, offset)
+                offset += RECORD_HEADER.size
+                yield local_time, bytes(block[offset:offset + length])
+                offset += length
+
+
+def list_journals(directory: Union[str, Path], prefix: str = "") -> list[Path]:
+    """
+    目录下已完成的日志文件，按文件名(即创建时间)排序
+    """
+    return sorted(path for path in Path(directory).glob(f"{prefix}*{JOURNAL_SUFFIX}")
+                  if not path.name.startswith("."))
+
+
+def replay_journal(paths: Iterable[Union[str, Path]], on_message: Callable[[str], None],
+                   speed: Optional[float] = None) -> int:
+    """
+    把日志中的消息按顺序重新推送给on_message，如BinanceSpotDataWebsocketApi.on_message
+    :param paths: 日志文件，按时间顺序
+    :param on_message: 消息处理函数
+    :param speed: 回放速度倍数，1为按原始间隔回放，None为不等待尽快回放
+    :return: 回放的消息数量
+    """
+    count = 0
+    start_local = start_clock = None
+    for path in paths:
+        for local_time, message in read_journal(path):
+            if speed:
+                if start_local is None:
+                    start_local, start_clock = local_time, time.perf_counter()
+                delay = (local_time - start_local) / 1e9 / speed - (time.perf_counter() - start_clock)
+                if delay > 0:
+                    time.sleep(delay)
+            on_message(message.decode())
+            count += 1
+    return count
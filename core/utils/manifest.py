@@ -0,0 +1,128 @@
+"""
+coding=utf-8
+@File   : manifest
+@Author : LiHan
+@Time   : 10/17/26:1:20 PM
+"""
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+MANIFEST_FILE_NAME = "manifest.db"
+
+STATUS_PARTIAL = "partial"  # 已下载部分时间窗口，可从fetched_until继续
+STATUS_DONE = "done"  # 整个交易日已下载完成
+STATUS_EMPTY = "empty"  # 整个交易日已查询完成，但没有数据
+
+
+@dataclass
+class ManifestEntry:
+    """
+    单个(symbol, dataset, interval, day)的下载记录
+    """
+    symbol: str
+    dataset: str
+    interval: str
+    day: str
+    status: str
+    rows: int = 0
+    first_timestamp: Optional[int] = None  # 第一条数据的时间戳，毫秒
+    last_timestamp: Optional[int] = None  # 最后一条数据的时间戳，毫秒
+    fetched_until: Optional[int] = None  # 已完整查询到的时间，毫秒(闭区间)
+    missing: int = 0  # 检测到的缺失K线数量
+    updated_at: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_DONE, STATUS_EMPTY)
+
+
+class DownloadManifest:
+    """
+    基于sqlite的下载清单，记录每个交易日文件的完成状态，用于断点续传，线程安全
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifest (
+                symbol TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                day TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows INTEGER NOT NULL DEFAULT 0,
+                first_timestamp INTEGER,
+                last_timestamp INTEGER,
+                fetched_until INTEGER,
+                missing INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (symbol, dataset, interval, day)
+            )
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, store_dir: str) -> "DownloadManifest":
+        return cls(os.path.join(store_dir, MANIFEST_FILE_NAME))
+
+    def get(self, symbol: str, dataset: str, interval: str, day: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT symbol, dataset, interval, day, status, rows, first_timestamp, last_timestamp, "
+                "fetched_until, missing, updated_at FROM manifest "
+                "WHERE symbol = ? AND dataset = ? AND interval = ? AND day = ?",
+                (symbol, dataset, interval, day)
+            ).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(*row)
+
+    def finished_days(self, symbol: str, dataset: str, interval: str) -> dict[str, str]:
+        """
+        查询已完成的交易日，用于批量跳过
+        :return: 交易日 -> 状态(STATUS_DONE或STATUS_EMPTY)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, status FROM manifest "
+                "WHERE symbol = ? AND dataset = ? AND interval = ? AND status IN (?, ?)",
+                (symbol, dataset, interval, STATUS_DONE, STATUS_EMPTY)
+            ).fetchall()
+        return dict(rows)
+
+    def put(self, entry: ManifestEntry):
+        entry.updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.symbol, entry.dataset, entry.interval, entry.day, entry.status, entry.rows,
+                 entry.first_timestamp, entry.last_timestamp, entry.fetched_until, entry.missing,
+                 entry.updated_at)
+            )
+            self._conn.commit()
+
+    def remove(self, symbol: str, dataset: str, interval: str, day: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM manifest WHERE symbol = ? AND dataset = ? AND interval = ? AND day = ?",
+                (symbol, dataset, interval, day)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,360 @@
+"""
+coding=utf-8
+@File   : metrics
+@Author : LiHan
+@Time   : 10/22/26:9:30 AM
+"""
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Sequence
+
+from external.utils.log import logger
+
+METRIC_COUNTER = "counter"
+METRIC_GAUGE = "gauge"
+METRIC_HISTOGRAM = "summary"  # 直方图按分位数导出为Prometheus的summary
+
+UNIT_NANOSECONDS = 1e-9
+UNIT_MICROSECONDS = 1e-6
+
+# 直方图的桶: 小于2^SUB_BUCKET_BITS的值每个值一个桶，之后每个2的幂区间分为2^(SUB_BUCKET_BITS-1)个桶，相对误差小于1.6%
+HISTOGRAM_SUB_BUCKET_BITS = 7
+HISTOGRAM_SUB_BUCKET_COUNT = 1 << HISTOGRAM_SUB_BUCKET_BITS
+HISTOGRAM_MAX_VALUE = (1 << 40) - 1  # 超过的值按上限记录
+HISTOGRAM_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_DUMP_INTERVAL = 10  # 指标文件的写入间隔，秒
+
+
+class Counter:
+    """
+    只增不减的计数
+    热路径上不加锁，多个线程同时更新同一个计数时极少数情况下会丢失一次更新，对统计结果的影响可以忽略
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+
+class Gauge:
+    """
+    可增可减的瞬时值，也可以设置为在导出时调用的函数，如队列长度
+    """
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Histogram:
+    """
+    HDR风格的对数线性直方图，记录非负整数(如纳秒、微秒)，记录一次只有几次整数运算和一次列表更新
+    桶数组按需增长，只覆盖实际出现过的数值范围
+    """
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts: list[int] = []
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value: int):
+        if value < 0:
+            # 本地时钟与交易所时钟的偏差可能导致负延迟
+            value = 0
+        elif value > HISTOGRAM_MAX_VALUE:
+            value = HISTOGRAM_MAX_VALUE
+        if value < HISTOGRAM_SUB_BUCKET_COUNT:
+            index = value
+        else:
+            shift = value.bit_length() - HISTOGRAM_SUB_BUCKET_BITS
+            index = (shift << (HISTOGRAM_SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantiles(self, quantiles: Sequence[float] = HISTOGRAM_QUANTILES) -> list[int]:
+        """
+        计算分位数，返回所在桶的上界(不超过最大值)
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        values = [0] * len(quantiles)
+        if not total:
+            return values
+
+        targets = sorted((max(math.ceil(q * total), 1), position) for position, q in enumerate(quantiles))
+        current = 0
+        cumulative = 0
+        for bucket, count in enumerate(counts):
+            cumulative += count
+            while current < len(targets) and cumulative >= targets[current][0]:
+                values[targets[current][1]] = min(_bucket_upper_bound(bucket), self.max)
+                current += 1
+            if current == len(targets):
+                break
+        return values
+
+    def reset(self):
+        self.counts = []
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < HISTOGRAM_SUB_BUCKET_COUNT:
+        return index
+    half_bits = HISTOGRAM_SUB_BUCKET_BITS - 1
+    shift = (index >> half_bits) - 1
+    return ((index - (shift << half_bits) + 1) << shift) - 1
+
+
+class MetricFamily:
+    """
+    同名指标的所有标签组合，labels返回的子指标应由调用方缓存，热路径上直接更新子指标
+    """
+
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: Sequence[str] = (),
+                 unit: float = 1):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.unit = unit  # 直方图导出时把记录的整数乘以unit，如纳秒为1e-9，导出为秒
+        self.children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指标{self.name}的标签为{self.labelnames}, 传入了{values}")
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            with self._lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.children[key] = _METRIC_CLASSES[self.type]()
+        return child
+
+    def remove(self, *values: str):
+        self.children.pop(tuple(str(value) for value in values), None)
+
+    def render(self, lines: list[str]):
+        lines.append(f"# HELP {self.name} {_escape_help(self.documentation)}")
+        lines.append(f"# TYPE {self.name} {self.type}")
+        children = list(self.children.items())
+        if self.type != METRIC_HISTOGRAM:
+            for key, child in children:
+                lines.append(f"{self.name}{self._format_labels(key)} {_format_value(child.get())}")
+            return
+
+        for key, child in children:
+            for quantile, value in zip(HISTOGRAM_QUANTILES, child.quantiles()):
+                labels = self._format_labels(key, ("quantile", str(quantile)))
+                lines.append(f"{self.name}{labels} {_format_value(value * self.unit)}")
+            labels = self._format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum * self.unit)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        lines.append(f"# HELP {self.name}_max {_escape_help(self.documentation)}, 最大值")
+        lines.append(f"# TYPE {self.name}_max {METRIC_GAUGE}")
+        for key, child in children:
+            lines.append(f"{self.name}_max{self._format_labels(key)} {_format_value(child.max * self.unit)}")
+
+    def _format_labels(self, key: tuple[str, ...], extra: Optional[tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+_METRIC_CLASSES = {
+    METRIC_COUNTER: Counter,
+    METRIC_GAUGE: Gauge,
+    METRIC_HISTOGRAM: Histogram,
+}
+
+
+class MetricsRegistry:
+    """
+    指标注册表，同名指标重复注册时返回已有的指标
+    """
+
+    def __init__(self):
+        self.families: dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(name, documentation, METRIC_COUNTER, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(name, documentation, METRIC_GAUGE, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  unit: float = UNIT_MICROSECONDS) -> MetricFamily:
+        """
+        :param unit: 记录值的单位，导出时换算为秒
+        """
+        return self._register(name, documentation, METRIC_HISTOGRAM, labelnames, unit)
+
+    def render(self) -> str:
+        """
+        Prometheus文本格式
+        """
+        lines = []
+        for family in list(self.families.values()):
+            family.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+    def _register(self, name: str, documentation: str, metric_type: str, labelnames: Sequence[str],
+                  unit: float = 1) -> MetricFamily:
+        with self._lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = MetricFamily(name, documentation, metric_type, labelnames, unit)
+            elif family.type != metric_type or family.labelnames != tuple(labelnames):
+                raise ValueError(f"指标{name}已注册为{family.type}{family.labelnames}")
+            return family
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              unit: float = UNIT_MICROSECONDS) -> MetricFamily:
+    return REGISTRY.histogram(name, documentation, labelnames, unit)
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动Prometheus抓取接口，任意路径都返回全部指标
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics_http_server").start()
+    logger.info(f"metrics http server started, port: {server.server_address[1]}")
+    return server
+
+
+class MetricsFileDumper:
+    """
+    定期把全部指标以Prometheus文本格式写入文件，可以配合node_exporter的textfile collector使用
+    """
+
+    def __init__(self, path: str, interval: float = DEFAULT_DUMP_INTERVAL, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="metrics_file_dumper")
+        self.thread.start()
+
+    def stop(self):
+        """
+        停止并写入最后一次
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def dump(self):
+        # 先写临时文件再重命名，读取方不会读到写了一半的文件
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._dump_safely()
+        self._dump_safely()
+
+    def _dump_safely(self):
+        try:
+            self.dump()
+        except Exception:
+            logger.exception(f"写入指标文件{self.path}失败")
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
@@ -2,12 +2,56 @@
 coding=utf-8
 @File   : shm
 @Author : LiHan
-@Time   : 3/14/25:11:28 AM
+@Time   : 3/14/25:11:28 AM
 """
 
-from multiprocessing import shared_memory
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Union
+
 import numpy as np
 
+DEPTH_LEVELS = 10
+
+MD_FIELDS = [
+    ('last_price', 'f8'),
+    ('volume_24h', 'f8'),
+    ('high_price', 'f8'),
+    ('low_price', 'f8'),
+    ('bid_prices', 'f8', DEPTH_LEVELS),
+    ('bid_volumes', 'f8', DEPTH_LEVELS),
+    ('ask_prices', 'f8', DEPTH_LEVELS),
+    ('ask_volumes', 'f8', DEPTH_LEVELS),
+    ('update_time', 'i8')
+]
+MD_DTYPE = np.dtype(MD_FIELDS)
+
+CACHE_LINE_SIZE = 64
+SYMBOL_SIZE = 32
+READ_SPIN_COUNT = 100  # 读取冲突时先自旋重试的次数
+READ_BACKOFF = 0.00005  # 自旋后仍冲突时每次重试前休眠的秒数
+READ_TIMEOUT = 0.01  # 读取冲突时最多等待的秒数，超时返回None
+
+# 行情共享内存的布局: 头部 | symbol表 | 记录数组，每部分按cache line对齐
+MD_STORE_MAGIC = 0x4E514D445348_0001  # "NQMDSH" + 版本号
+HEADER_DTYPE = np.dtype([
+    ('magic', 'u8'),
+    ('capacity', 'u4'),
+    ('count', 'u4'),
+])
+
+
+def _align(size: int, alignment: int = CACHE_LINE_SIZE) -> int:
+    return (size + alignment - 1) // alignment * alignment
+
+
+# 每条记录以seq开头，并补齐到cache line整数倍，避免不同symbol的写入互相干扰
+MD_RECORD_DTYPE = np.dtype({
+    'names': ['seq'] + [field[0] for field in MD_FIELDS],
+    'formats': ['u8'] + [(field[1], field[2]) if len(field) == 3 else field[1] for field in MD_FIELDS],
+    'itemsize': _align(8 + MD_DTYPE.itemsize),
+})
+
 
 def init_md_shm(symbol: str) -> tuple[shared_memory.SharedMemory, np.ndarray]:
     """
@@ -16,24 +60,205 @@ def init_md_shm(symbol: str) -> tuple[shared_memory.SharedMemory, np.ndarray]:
     :return: 共享内存块和结构化数组
     """
     # 计算内存尺寸（网页5的精确计算）
-    dtype = np.dtype([
-        ('last_price', 'f8'),
-        ('volume_24h', 'f8'),
-        ('high_price', 'f8'),
-        ('low_price', 'f8'),
-        ('bid_prices', 'f8', 10),
-        ('bid_volumes', 'f8', 10),
-        ('ask_prices', 'f8', 10),
-        ('ask_volumes', 'f8', 10),
-        ('update_time', 'i8')
-    ])
-
     shm = shared_memory.SharedMemory(
         name=f"binance_{symbol}_merged",
         create=True,
-        size=dtype.itemsize
+        size=MD_DTYPE.itemsize
     )
 
     # 映射为结构化数组（网页6的高效访问）
-    arr = np.ndarray(shape=(), dtype=dtype, buffer=shm.buf)
+    arr = np.ndarray(shape=(), dtype=MD_DTYPE, buffer=shm.buf)
     return shm, arr
+
+
+class MdShmStore:
+    """
+    多symbol行情共享内存，一个共享内存段按symbol槽位存放所有记录
+    每条记录带一个seqlock版本号: 写入前加1(奇数表示正在写)，写入后再加1，
+    读取方在版本号为偶数且读取前后一致时才认为读到了完整记录，读写双方都不需要加锁
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.name = shm.name
+
+        self.header = np.ndarray(shape=(), dtype=HEADER_DTYPE, buffer=shm.buf)
+        if int(self.header['magic']) != MD_STORE_MAGIC:
+            raise ValueError(f"共享内存{self.name}不是行情存储")
+        self.capacity = int(self.header['capacity'])
+
+        symbol_offset = _align(HEADER_DTYPE.itemsize)
+        record_offset = symbol_offset + _align(SYMBOL_SIZE * self.capacity)
+        self.symbols = np.ndarray(shape=(self.capacity,), dtype=f'S{SYMBOL_SIZE}', buffer=shm.buf,
+                                  offset=symbol_offset)
+        self.records = np.ndarray(shape=(self.capacity,), dtype=MD_RECORD_DTYPE, buffer=shm.buf,
+                                  offset=record_offset)
+        # 预先取出各字段的视图，写入时不再按字段名查找
+        self.seq = self.records['seq']
+        self.fields = {name: self.records[name] for name in MD_RECORD_DTYPE.names}
+
+        self.slots: dict[str, int] = {}
+        self._refresh_slots()
+
+    @staticmethod
+    def cal_size(capacity: int) -> int:
+        return (_align(HEADER_DTYPE.itemsize) + _align(SYMBOL_SIZE * capacity)
+                + MD_RECORD_DTYPE.itemsize * capacity)
+
+    def get_slot(self, symbol: str) -> int:
+        """
+        获取symbol的槽位，symbol不存在时返回-1
+        """
+        slot = self.slots.get(symbol)
+        if slot is None:
+            # 写入方可能新增了symbol
+            self._refresh_slots()
+            slot = self.slots.get(symbol, -1)
+        return slot
+
+    def _refresh_slots(self):
+        count = int(self.header['count'])
+        self.slots = {self.symbols[i].decode(): i for i in range(count)}
+
+    def close(self):
+        # 先释放numpy视图，否则SharedMemory.close会因为存在导出的buffer而失败
+        self.header = self.symbols = self.records = self.seq = self.fields = None
+        self.shm.close()
+
+
+class MdShmWriter(MdShmStore):
+    """
+    行情共享内存的写入方，每个共享内存段只能有一个写入进程
+    """
+
+    @classmethod
+    def create(cls, name: str, symbols: list[str], capacity: Optional[int] = None) -> "MdShmWriter":
+        """
+        创建共享内存段
+        :param name: 共享内存名称
+        :param symbols: 初始symbol列表
+        :param capacity: 最大symbol数，默认为symbol数量
+        """
+        capacity = capacity or len(symbols)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.cal_size(capacity))
+        header = np.ndarray(shape=(), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['magic'] = MD_STORE_MAGIC
+        header['capacity'] = capacity
+        header['count'] = 0
+        del header
+
+        writer = cls(shm)
+        for symbol in symbols:
+            writer.add_symbol(symbol)
+        return writer
+
+    def add_symbol(self, symbol: str) -> int:
+        """
+        新增symbol并返回槽位，已存在时直接返回
+        """
+        slot = self.slots.get(symbol)
+        if slot is not None:
+            return slot
+
+        count = int(self.header['count'])
+        if count >= self.capacity:
+            raise ValueError(f"共享内存{self.name}的symbol数量已达上限{self.capacity}")
+        if len(symbol.encode()) > SYMBOL_SIZE:
+            raise ValueError(f"symbol长度超过{SYMBOL_SIZE}: {symbol}")
+
+        self.records[count] = np.zeros((), dtype=MD_RECORD_DTYPE)
+        self.symbols[count] = symbol.encode()
+        # 先写入symbol再更新数量，读取方看到新数量时symbol一定已经写好
+        self.header['count'] = count + 1
+        self.slots[symbol] = count
+        return count
+
+    # 写入前后各把seq加1，写入过程中seq为奇数；为减少函数调用开销直接内联在各写入方法中
+    def write_ticker(self, slot: int, last_price: float, volume_24h: float, high_price: float, low_price: float,
+                     update_time: int):
+        fields = self.fields
+        self.seq[slot] += 1
+        fields['last_price'][slot] = last_price
+        fields['volume_24h'][slot] = volume_24h
+        fields['high_price'][slot] = high_price
+        fields['low_price'][slot] = low_price
+        fields['update_time'][slot] = update_time
+        self.seq[slot] += 1
+
+    def write_depth(self, slot: int, bid_prices, bid_volumes, ask_prices, ask_volumes, update_time: int):
+        """
+        写入盘口，价格和数量为长度不超过DEPTH_LEVELS的数组，不足的档位填0
+        """
+        fields = self.fields
+        self.seq[slot] += 1
+        _fill(fields['bid_prices'][slot], bid_prices)
+        _fill(fields['bid_volumes'][slot], bid_volumes)
+        _fill(fields['ask_prices'][slot], ask_prices)
+        _fill(fields['ask_volumes'][slot], ask_volumes)
+        fields['update_time'][slot] = update_time
+        self.seq[slot] += 1
+
+    def unlink(self):
+        """
+        删除共享内存段，所有读取方关闭后内存才会被释放
+        """
+        shm = self.shm
+        self.close()
+        shm.unlink()
+
+
+class MdShmReader(MdShmStore):
+    """
+    行情共享内存的读取方，只挂载已存在的共享内存段，不会创建或删除
+    """
+
+    @classmethod
+    def attach(cls, name: str) -> "MdShmReader":
+        shm = shared_memory.SharedMemory(name=name, create=False)
+        # 挂载方不负责删除共享内存，避免进程退出时被resource_tracker误删
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    def read(self, symbol_or_slot: Union[str, int], out: Optional[np.ndarray] = None,
+             timeout: float = READ_TIMEOUT) -> Optional[np.ndarray]:
+        """
+        读取一条一致的记录
+        写入冲突时先自旋重试READ_SPIN_COUNT次，之后按READ_BACKOFF休眠重试直到timeout，
+        写入方在写入过程中被挂起或退出时不会一直占用CPU
+        :param symbol_or_slot: symbol或槽位
+        :param out: 预分配的0维结构化数组，传入时避免每次分配内存
+        :param timeout: 写入冲突时最多等待的秒数
+        :return: 记录副本，symbol不存在或超时仍未读到一致的记录时返回None
+        """
+        slot = symbol_or_slot if isinstance(symbol_or_slot, int) else self.get_slot(symbol_or_slot)
+        if slot < 0:
+            return None
+        if out is None:
+            out = np.empty((), dtype=MD_RECORD_DTYPE)
+
+        seq = self.seq
+        record = self.records[slot:slot + 1]
+        deadline = None
+        attempt = 0
+        while True:
+            begin = seq[slot]
+            if not begin & 1:
+                out[...] = record[0]
+                if seq[slot] == begin:
+                    return out
+            attempt += 1
+            if attempt < READ_SPIN_COUNT:
+                continue
+            # 自旋后仍冲突，说明写入方可能被挂起，改为休眠重试
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            elif now >= deadline:
+                return None
+            time.sleep(READ_BACKOFF)
+
+
+def _fill(target: np.ndarray, values):
+    count = min(len(values), len(target))
+    target[:count] = values[:count]
+    target[count:] = 0
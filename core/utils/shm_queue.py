@@ -0,0 +1,170 @@
+"""
+coding=utf-8
+@File   : shm_queue
+@Author : LiHan
+@Time   : 10/22/26:2:10 PM
+"""
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+import numpy as np
+
+from core.utils.shm import CACHE_LINE_SIZE
+
+# 布局: 头部(magic、容量) | 写入方计数(一个cache line) | 读取方计数(一个cache line) | 数据区
+# 写入方计数: 已写入字节数(head)、已写入帧数；读取方计数: 已读取字节数(tail)、已读取帧数
+QUEUE_MAGIC = 0x4E5146514555_0001  # "NQFQEU" + 版本号
+WRITER_OFFSET = CACHE_LINE_SIZE
+READER_OFFSET = CACHE_LINE_SIZE * 2
+DATA_OFFSET = CACHE_LINE_SIZE * 3
+
+# 帧: 帧头(长度u4, 保留u4, 接收时间纳秒i8) + 数据，按FRAME_ALIGNMENT对齐
+FRAME_HEADER = struct.Struct("<IIq")
+FRAME_ALIGNMENT = 16
+WRAP_MARKER = 0xFFFFFFFF  # 数据区末尾放不下一帧时写入该标记，读取方跳回数据区开头
+
+
+def _align(size: int) -> int:
+    return (size + FRAME_ALIGNMENT - 1) // FRAME_ALIGNMENT * FRAME_ALIGNMENT
+
+
+class ShmFrameQueue:
+    """
+    共享内存中的变长帧队列，单写单读(SPSC)，不加锁
+    写入方只更新head，读取方只更新tail，两者在不同的cache line上；
+    帧数据写完后才发布head，读取方拷贝完数据后才发布tail，写入方据此判断剩余空间。
+    队列满时put直接返回False，由调用方决定丢弃或等待
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.name = shm.name
+        self.buf = shm.buf
+
+        header = np.ndarray(shape=(2,), dtype='u8', buffer=shm.buf)
+        if int(header[0]) != QUEUE_MAGIC:
+            raise ValueError(f"共享内存{self.name}不是帧队列")
+        self.capacity = int(header[1])
+        # 计数用memoryview访问，单个元素的读写比numpy标量快一个数量级
+        self.writer = shm.buf[WRITER_OFFSET:WRITER_OFFSET + 16].cast('Q')
+        self.reader = shm.buf[READER_OFFSET:READER_OFFSET + 16].cast('Q')
+        # 单帧最大长度，保证任何时候空队列都能放下
+        self.max_frame_size = self.capacity // 2 - FRAME_HEADER.size
+
+    @classmethod
+    def create(cls, name: str, capacity: int) -> "ShmFrameQueue":
+        """
+        创建队列，由写入方调用
+        :param name: 共享内存名称
+        :param capacity: 数据区字节数，按FRAME_ALIGNMENT向上对齐
+        """
+        capacity = _align(capacity)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=DATA_OFFSET + capacity)
+        header = np.ndarray(shape=(DATA_OFFSET // 8,), dtype='u8', buffer=shm.buf)
+        header[:] = 0
+        header[0] = QUEUE_MAGIC
+        header[1] = capacity
+        del header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "ShmFrameQueue":
+        """
+        挂载已存在的队列，由读取方调用
+        """
+        shm = shared_memory.SharedMemory(name=name, create=False)
+        # 挂载方不负责删除共享内存，避免进程退出时被resource_tracker误删
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def frames(self) -> int:
+        """
+        队列中的帧数
+        """
+        return self.writer[1] - self.reader[1]
+
+    @property
+    def used_bytes(self) -> int:
+        return self.writer[0] - self.reader[0]
+
+    def put(self, data: bytes, receive_time: int) -> bool:
+        """
+        写入一帧，只能由写入方调用
+        :param data: 帧数据
+        :param receive_time: 接收时间，纳秒
+        :return: 队列已满时返回False
+        """
+        length = len(data)
+        if length > self.max_frame_size:
+            raise ValueError(f"帧长度{length}超过队列{self.name}的上限{self.max_frame_size}")
+        size = _align(FRAME_HEADER.size + length)
+        capacity = self.capacity
+        head = self.writer[0]
+        position = head % capacity
+        # position和capacity都按FRAME_ALIGNMENT对齐，末尾剩余空间一定放得下帧头
+        contiguous = capacity - position
+        required = size if size <= contiguous else contiguous + size
+        if head + required - self.reader[0] > capacity:
+            return False
+
+        buf = self.buf
+        if size > contiguous:
+            FRAME_HEADER.pack_into(buf, DATA_OFFSET + position, WRAP_MARKER, 0, 0)
+            head += contiguous
+            position = 0
+        offset = DATA_OFFSET + position
+        FRAME_HEADER.pack_into(buf, offset, length, 0, receive_time)
+        buf[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + length] = data
+        self.writer[1] += 1
+        # 数据写完后再发布
+        self.writer[0] = head + size
+        return True
+
+    def get(self) -> Optional[tuple[int, bytes]]:
+        """
+        读取一帧，只能由读取方调用
+        :return: (接收时间纳秒, 帧数据)，队列为空时返回None
+        """
+        frames = self.get_many(1)
+        return frames[0] if frames else None
+
+    def get_many(self, max_count: int) -> list[tuple[int, bytes]]:
+        """
+        批量读取，读取完成后一次性发布tail
+        :return: [(接收时间纳秒, 帧数据)]
+        """
+        tail = self.reader[0]
+        head = self.writer[0]
+        if tail == head:
+            return []
+
+        buf = self.buf
+        capacity = self.capacity
+        frames = []
+        while tail < head and len(frames) < max_count:
+            position = tail % capacity
+            length, _, receive_time = FRAME_HEADER.unpack_from(buf, DATA_OFFSET + position)
+            if length == WRAP_MARKER:
+                tail += capacity - position
+                continue
+            start = DATA_OFFSET + position + FRAME_HEADER.size
+            frames.append((receive_time, bytes(buf[start:start + length])))
+            tail += _align(FRAME_HEADER.size + length)
+
+        self.reader[1] += len(frames)
+        self.reader[0] = tail
+        return frames
+
+    def close(self):
+        # 共享内存关闭前需要释放所有引用它的memoryview
+        self.writer.release()
+        self.reader.release()
+        self.writer = self.reader = self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        shm = self.shm
+        self.close()
+        shm.unlink()
@@ -0,0 +1,179 @@
+"""
+coding=utf-8
+@File   : shm_ring
+@Author : LiHan
+@Time   : 10/19/26:10:05 AM
+"""
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+import numpy as np
+
+from core.utils.shm import CACHE_LINE_SIZE, DEPTH_LEVELS
+
+RING_MAGIC = 0x4E51524E47_0001  # "NQRNG" + 版本号
+RING_HEADER_DTYPE = np.dtype([
+    ('magic', 'u8'),
+    ('capacity', 'u8'),
+    ('itemsize', 'u8'),
+    ('head', 'u8'),  # 已写入的记录总数，只增不减
+])
+
+SYMBOL_DTYPE = 'S16'
+
+TICK_RING_DTYPE = np.dtype([
+    ('symbol', SYMBOL_DTYPE),
+    ('exchange_time', 'i8'),
+    ('local_time', 'f8'),
+    ('last_price', 'f8'),
+    ('volume', 'f8'),
+    ('turnover', 'f8'),
+    ('open_price', 'f8'),
+    ('high_price', 'f8'),
+    ('low_price', 'f8'),
+])
+
+DEPTH_RING_DTYPE = np.dtype([
+    ('symbol', SYMBOL_DTYPE),
+    ('exchange_time', 'i8'),
+    ('local_time', 'f8'),
+    ('bid_prices', 'f8', DEPTH_LEVELS),
+    ('bid_volumes', 'f8', DEPTH_LEVELS),
+    ('ask_prices', 'f8', DEPTH_LEVELS),
+    ('ask_volumes', 'f8', DEPTH_LEVELS),
+])
+
+KLINE_RING_DTYPE = np.dtype([
+    ('symbol', SYMBOL_DTYPE),
+    ('open_time', 'i8'),
+    ('exchange_time', 'i8'),
+    ('local_time', 'f8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+    ('turnover', 'f8'),
+])
+
+
+class ShmRingBuffer:
+    """
+    共享内存中的定长环形缓冲区，单写多读(SPMC)
+    写入方把记录写到 head % capacity 后再递增head，读取方各自维护游标，
+    read返回游标之后所有记录的numpy视图(不拷贝)。写入方可能正在写下一个槽位，
+    所以读取方最多能读到最近的capacity - 1条记录，更早的记录计为丢失
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, dtype: np.dtype):
+        self.shm = shm
+        self.name = shm.name
+        self.dtype = np.dtype(dtype)
+
+        self.header = np.ndarray(shape=(), dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        if int(self.header['magic']) != RING_MAGIC:
+            raise ValueError(f"共享内存{self.name}不是环形缓冲区")
+        if int(self.header['itemsize']) != self.dtype.itemsize:
+            raise ValueError(f"共享内存{self.name}的记录大小与dtype不一致")
+
+        self.capacity = int(self.header['capacity'])
+        self.records = np.ndarray(shape=(self.capacity,), dtype=self.dtype, buffer=shm.buf,
+                                  offset=CACHE_LINE_SIZE)
+        self.head_view = self.header['head']
+
+    @classmethod
+    def create(cls, name: str, dtype: np.dtype, capacity: int) -> "ShmRingBuffer":
+        """
+        创建环形缓冲区，只能由写入方调用
+        :param name: 共享内存名称
+        :param dtype: 记录的结构化dtype
+        :param capacity: 记录数量
+        """
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=CACHE_LINE_SIZE + dtype.itemsize * capacity)
+        header = np.ndarray(shape=(), dtype=RING_HEADER_DTYPE, buffer=shm.buf)
+        header['magic'] = RING_MAGIC
+        header['capacity'] = capacity
+        header['itemsize'] = dtype.itemsize
+        header['head'] = 0
+        del header
+        return cls(shm, dtype)
+
+    @classmethod
+    def attach(cls, name: str, dtype: np.dtype) -> "ShmRingBuffer":
+        """
+        挂载已存在的环形缓冲区，用于读取方
+        """
+        shm = shared_memory.SharedMemory(name=name, create=False)
+        # 挂载方不负责删除共享内存，避免进程退出时被resource_tracker误删
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, dtype)
+
+    @property
+    def head(self) -> int:
+        return int(self.head_view)
+
+    def append(self, record: tuple):
+        """
+        写入一条记录，字段顺序与dtype一致
+        """
+        head = int(self.head_view)
+        self.records[head % self.capacity] = record
+        # 记录写完后再发布，读取方看到新的head时记录一定已经写好
+        self.header['head'] = head + 1
+
+    def read(self, cursor: int, max_count: Optional[int] = None) -> tuple[list[np.ndarray], int, int]:
+        """
+        读取游标之后的所有记录
+        :param cursor: 读取方的游标，首次读取可以传入head只读取新数据
+        :param max_count: 最多读取的记录数
+        :return: (记录视图列表(环形回绕时最多两段), 新游标, 丢失的记录数)
+        """
+        head = int(self.head_view)
+        lost = 0
+        readable = self.capacity - 1
+        if head - cursor > readable:
+            lost = head - cursor - readable
+            cursor = head - readable
+        end = head if max_count is None else min(head, cursor + max_count)
+        if end <= cursor:
+            return [], cursor, lost
+
+        start_index = cursor % self.capacity
+        end_index = end % self.capacity
+        if start_index < end_index or end_index == 0:
+            views = [self.records[start_index:end_index or self.capacity]]
+        else:
+            views = [self.records[start_index:], self.records[:end_index]]
+        return views, end, lost
+
+    def is_valid(self, cursor: int) -> bool:
+        """
+        判断游标之后的记录是否还未被覆盖，读取方处理完read返回的视图后调用，
+        返回False时说明处理过程中数据已被写入方覆盖
+        """
+        return int(self.head_view) - cursor < self.capacity
+
+    def read_copy(self, cursor: int, max_count: Optional[int] = None) -> tuple[np.ndarray, int, int]:
+        """
+        读取游标之后的记录并拷贝为连续数组，拷贝后校验没有被覆盖
+        :return: (记录数组, 新游标, 丢失的记录数)
+        """
+        total_lost = 0
+        while True:
+            views, end, lost = self.read(cursor, max_count)
+            total_lost += lost
+            records = np.concatenate(views) if views else np.empty(0, dtype=self.dtype)
+            begin = end - len(records)
+            if self.is_valid(begin):
+                return records, end, total_lost
+            cursor = begin
+
+    def close(self):
+        self.header = self.records = self.head_view = None
+        self.shm.close()
+
+    def unlink(self):
+        shm = self.shm
+        self.close()
+        shm.unlink()
@@ -0,0 +1,373 @@
+"""
+coding=utf-8
+@File   : storage
+@Author : LiHan
+@Time   : 10/17/26:3:10 PM
+"""
+import glob
+import os
+import shutil
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from external.common.object import Exchange, Interval
+
+DATASET_KLINES = "klines"
+DATASET_AGG_TRADERS = "agg_traders"
+DATASET_HISTORICAL_TRADES = "historical_trades"
+
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+FORMAT_ARROW = "arrow"
+
+KLINES_SCHEMA = pa.schema([
+    ("ExchangeTime", pa.int64()),
+    ("Open", pa.float64()),
+    ("High", pa.float64()),
+    ("Low", pa.float64()),
+    ("Close", pa.float64()),
+    ("Volume", pa.float64()),
+    ("Turnover", pa.float64()),
+    ("NumberOfTrades", pa.int64()),
+    ("TakerBuyBaseAssetVolume", pa.float64()),
+    ("TakerBuyQuoteAssetVolume", pa.float64()),
+    ("LocalTime", pa.int64()),
+    ("Symbol", pa.string()),
+    ("Exchange", pa.string()),
+    ("Interval", pa.string()),
+    ("OpenInterest", pa.float64()),
+    ("TradingDay", pa.string()),
+])
+
+AGG_TRADES_SCHEMA = pa.schema([
+    ("AggTradeId", pa.int64()),
+    ("Price", pa.float64()),
+    ("Quantity", pa.float64()),
+    ("FirstTradeId", pa.int64()),
+    ("LastTradeId", pa.int64()),
+    ("TradeTimestamp", pa.int64()),
+    ("IsBuyerMaker", pa.bool_()),
+    ("IsBestPriceMatch", pa.bool_()),
+    ("Turnover", pa.float64()),
+    ("LocalTime", pa.int64()),
+    ("Symbol", pa.string()),
+    ("Exchange", pa.string()),
+    ("TradingDay", pa.string()),
+])
+
+HISTORICAL_TRADES_SCHEMA = pa.schema([
+    ("Id", pa.int64()),
+    ("Price", pa.float64()),
+    ("Quantity", pa.float64()),
+    ("QuoteQuantity", pa.float64()),
+    ("Time", pa.int64()),
+    ("IsBuyerMaker", pa.bool_()),
+    ("IsBestMatch", pa.bool_()),
+    ("LocalTime", pa.int64()),
+    ("Symbol", pa.string()),
+    ("Exchange", pa.string()),
+    ("TradingDay", pa.string()),
+])
+
+# websocket推送的ticker，由ClickhouseSink写入
+TICKS_SCHEMA = pa.schema([
+    ("Symbol", pa.string()),
+    ("Exchange", pa.string()),
+    ("ExchangeTime", pa.int64()),
+    ("LocalTime", pa.int64()),
+    ("LastPrice", pa.float64()),
+    ("Volume", pa.float64()),
+    ("Turnover", pa.float64()),
+    ("Open", pa.float64()),
+    ("High", pa.float64()),
+    ("Low", pa.float64()),
+    ("TradingDay", pa.string()),
+])
+
+DAY_MILLISECONDS = 24 * 60 * 60 * 1000
+
+# 数据集 -> (schema, 时间列)
+DATASET_SCHEMAS = {
+    DATASET_KLINES: (KLINES_SCHEMA, "ExchangeTime"),
+    DATASET_AGG_TRADERS: (AGG_TRADES_SCHEMA, "TradeTimestamp"),
+    DATASET_HISTORICAL_TRADES: (HISTORICAL_TRADES_SCHEMA, "Time"),
+}
+
+
+def get_dataset_name(dataset: str, interval: Optional[Union[Interval, str]] = None) -> str:
+    """
+    数据集名称，K线按周期区分，如klines_1m，周期可以是Interval或合成的周期字符串(如4h)
+    """
+    if interval is None:
+        return dataset
+    return f"{dataset}_{interval.value if isinstance(interval, Interval) else interval}"
+
+
+def get_trading_day(timestamp: int) -> str:
+    """
+    毫秒时间戳所在的UTC交易日，如2025-03-18
+    """
+    return _format_trading_day(timestamp // DAY_MILLISECONDS)
+
+
+@lru_cache(maxsize=16)
+def _format_trading_day(day: int) -> str:
+    # 行情逐条调用，按天缓存格式化结果
+    return datetime.fromtimestamp(day * DAY_MILLISECONDS / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _split_dataset_name(dataset: str) -> tuple[str, Optional[str]]:
+    if dataset.startswith(DATASET_KLINES + "_"):
+        return DATASET_KLINES, dataset[len(DATASET_KLINES) + 1:]
+    return dataset, None
+
+
+class DataStorage(ABC):
+    """
+    按 exchange/symbol/dataset/day 分区的单日数据存储
+    一个交易日可以分多次追加写入(断点续传的每个窗口)，读取时合并为一个DataFrame
+    """
+
+    format: str = ""
+
+    def __init__(self, root: str, exchange: Exchange = Exchange.BINANCE):
+        self.root = root
+        self.exchange = exchange
+
+    @abstractmethod
+    def get_partition_path(self, symbol: str, dataset: str, day: str) -> str:
+        pass
+
+    @abstractmethod
+    def append(self, df: pd.DataFrame, symbol: str, dataset: str, day: str):
+        """
+        追加写入一个交易日的部分数据
+        """
+        pass
+
+    @abstractmethod
+    def read_day(self, symbol: str, dataset: str, day: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        pass
+
+    @abstractmethod
+    def read(self, symbols: Union[str, list[str]], dataset: str, start_timestamp: Optional[int] = None,
+             end_timestamp: Optional[int] = None, columns: Optional[list[str]] = None,
+             start_day: Optional[str] = None, end_day: Optional[str] = None) -> pd.DataFrame:
+        """
+        读取多个symbol、多个交易日的数据
+        :param symbols: 交易Symbol或Symbol列表
+        :param dataset: 数据集名称，如klines_1m、agg_traders
+        :param start_timestamp: 开始时间戳(毫秒，闭区间)
+        :param end_timestamp: 结束时间戳(毫秒，闭区间)
+        :param columns: 需要的列，None表示全部
+        :param start_day: 开始交易日，用于按分区裁剪
+        :param end_day: 结束交易日，用于按分区裁剪
+        """
+        pass
+
+    def exists(self, symbol: str, dataset: str, day: str) -> bool:
+        return os.path.exists(self.get_partition_path(symbol, dataset, day))
+
+    def remove(self, symbol: str, dataset: str, day: str):
+        path = self.get_partition_path(symbol, dataset, day)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df: pd.DataFrame, symbol: str, dataset: str, day: str):
+        """
+        覆盖写入一个交易日的全部数据
+        """
+        self.remove(symbol, dataset, day)
+        self.append(df, symbol, dataset, day)
+
+    @staticmethod
+    def get_schema(dataset: str) -> tuple[pa.Schema, str]:
+        base, _ = _split_dataset_name(dataset)
+        return DATASET_SCHEMAS[base]
+
+
+class CsvStorage(DataStorage):
+    """
+    兼容原有的CSV目录结构: {root}/{exchange}/spot/{symbol}/{interval|dataset}/{day}_{dataset}.csv
+    """
+
+    format = FORMAT_CSV
+
+    def _get_dir(self, symbol: str, dataset: str) -> str:
+        base, interval = _split_dataset_name(dataset)
+        return os.path.join(self.root, self.exchange.value, "spot", symbol, interval or base)
+
+    def get_partition_path(self, symbol: str, dataset: str, day: str) -> str:
+        base, _ = _split_dataset_name(dataset)
+        return os.path.join(self._get_dir(symbol, dataset), f"{day}_{base}.csv")
+
+    def append(self, df: pd.DataFrame, symbol: str, dataset: str, day: str):
+        path = self.get_partition_path(symbol, dataset, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+
+    def read_day(self, symbol: str, dataset: str, day: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        path = self.get_partition_path(symbol, dataset, day)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        return pd.read_csv(path, usecols=columns)
+
+    def read(self, symbols: Union[str, list[str]], dataset: str, start_timestamp: Optional[int] = None,
+             end_timestamp: Optional[int] = None, columns: Optional[list[str]] = None,
+             start_day: Optional[str] = None, end_day: Optional[str] = None) -> pd.DataFrame:
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        _, time_column = self.get_schema(dataset)
+        base, _ = _split_dataset_name(dataset)
+
+        frames = []
+        for symbol in symbols:
+            for path in sorted(glob.glob(os.path.join(self._get_dir(symbol, dataset), f"*_{base}.csv"))):
+                day = os.path.basename(path)[:10]
+                if (start_day and day < start_day) or (end_day and day > end_day):
+                    continue
+                df = pd.read_csv(path)
+                if start_timestamp is not None:
+                    df = df[df[time_column] >= start_timestamp]
+                if end_timestamp is not None:
+                    df = df[df[time_column] <= end_timestamp]
+                frames.append(df[columns] if columns else df)
+
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+
+class ParquetStorage(DataStorage):
+    """
+    Parquet列式存储，按hive风格分区: {root}/exchange={exchange}/symbol={symbol}/dataset={dataset}/day={day}/part-{n}
+    写入时按数据集的schema转换类型，读取时将symbol、交易日和时间范围下推到分区裁剪和row group统计过滤
+    """
+
+    format = FORMAT_PARQUET
+    suffix = ".parquet"
+
+    # 较小的row group让时间范围过滤可以跳过更多数据
+    row_group_size = 128 * 1024
+
+    def __init__(self, root: str, exchange: Exchange = Exchange.BINANCE, compression: str = "zstd"):
+        super(ParquetStorage, self).__init__(root, exchange)
+        self.compression = compression
+
+    def _get_dataset_dir(self, symbol: str, dataset: str) -> str:
+        return os.path.join(self.root, f"exchange={self.exchange.value}", f"symbol={symbol}", f"dataset={dataset}")
+
+    def get_partition_path(self, symbol: str, dataset: str, day: str) -> str:
+        return os.path.join(self._get_dataset_dir(symbol, dataset), f"day={day}")
+
+    def append(self, df: pd.DataFrame, symbol: str, dataset: str, day: str):
+        schema, _ = self.get_schema(dataset)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.select([name for name in schema.names if name in table.column_names])
+        table = table.cast(pa.schema([schema.field(name) for name in table.column_names]))
+
+        partition_path = self.get_partition_path(symbol, dataset, day)
+        os.makedirs(partition_path, exist_ok=True)
+        part = len(glob.glob(os.path.join(partition_path, f"part-*{self.suffix}")))
+        name = f"part-{part:05d}{self.suffix}"
+        path = os.path.join(partition_path, name)
+
+        # 先写临时文件再重命名，避免中断时留下不完整的文件，"."开头的文件在读取时会被忽略
+        tmp_path = os.path.join(partition_path, f".{name}.tmp")
+        self._write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _write_table(self, table: pa.Table, path: str):
+        pq.write_table(table, path, compression=self.compression, row_group_size=self.row_group_size)
+
+    def _dataset_format(self):
+        return ds.ParquetFileFormat()
+
+    def read_day(self, symbol: str, dataset: str, day: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        partition_path = self.get_partition_path(symbol, dataset, day)
+        paths = sorted(glob.glob(os.path.join(partition_path, f"part-*{self.suffix}")))
+        if not paths:
+            return pd.DataFrame()
+        return ds.dataset(paths, format=self._dataset_format()).to_table(columns=columns).to_pandas()
+
+    def read(self, symbols: Union[str, list[str]], dataset: str, start_timestamp: Optional[int] = None,
+             end_timestamp: Optional[int] = None, columns: Optional[list[str]] = None,
+             start_day: Optional[str] = None, end_day: Optional[str] = None) -> pd.DataFrame:
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        _, time_column = self.get_schema(dataset)
+
+        # symbol和数据集直接定位到目录，交易日通过分区字段裁剪
+        partitioning = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+        children = []
+        for symbol in symbols:
+            dataset_dir = self._get_dataset_dir(symbol, dataset)
+            if os.path.isdir(dataset_dir):
+                children.append(ds.dataset(dataset_dir, format=self._dataset_format(), partitioning=partitioning))
+        if not children:
+            return pd.DataFrame()
+
+        expression = None
+        conditions = []
+        if start_day:
+            conditions.append(ds.field("day") >= start_day)
+        if end_day:
+            conditions.append(ds.field("day") <= end_day)
+        if start_timestamp is not None:
+            conditions.append(ds.field(time_column) >= start_timestamp)
+        if end_timestamp is not None:
+            conditions.append(ds.field(time_column) <= end_timestamp)
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        if columns is None:
+            columns = [name for name in children[0].schema.names if name != "day"]
+        table = ds.dataset(children).to_table(columns=columns, filter=expression)
+        return table.to_pandas()
+
+
+class ArrowIpcStorage(ParquetStorage):
+    """
+    Arrow IPC(Feather v2)格式，读取可内存映射，适合频繁重复读取的数据
+    """
+
+    format = FORMAT_ARROW
+    suffix = ".arrow"
+
+    def __init__(self, root: str, exchange: Exchange = Exchange.BINANCE, compression: str = "lz4"):
+        super(ArrowIpcStorage, self).__init__(root, exchange, compression)
+
+    def _write_table(self, table: pa.Table, path: str):
+        feather.write_feather(table, path, compression=self.compression)
+
+    def _dataset_format(self):
+        return ds.IpcFileFormat()
+
+
+STORAGE_CLASSES = {
+    FORMAT_CSV: CsvStorage,
+    FORMAT_PARQUET: ParquetStorage,
+    FORMAT_ARROW: ArrowIpcStorage,
+}
+
+
+def create_storage(root: str, fmt: str = FORMAT_PARQUET, exchange: Exchange = Exchange.BINANCE) -> DataStorage:
+    """
+    根据格式创建存储
+    :param root: 存储根目录
+    :param fmt: 存储格式，csv、parquet或arrow，默认parquet
+    :param exchange: 交易所
+    """
+    if fmt not in STORAGE_CLASSES:
+        raise ValueError(f"不支持的存储格式: {fmt}")
+    return STORAGE_CLASSES[fmt](root, exchange)
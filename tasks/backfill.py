@@ -0,0 +1,233 @@
+"""
+coding=utf-8
+@File   : backfill
+@Author : LiHan
+@Time   : 10/17/26:10:12 AM
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
+
+from core.binance.spot.rest import BinanceSpotDataRestAPi
+from core.utils.manifest import DownloadManifest
+from core.utils.metrics import MetricsFileDumper, counter, gauge, start_http_server
+from core.utils.storage import DATASET_AGG_TRADERS, DATASET_KLINES, FORMAT_PARQUET, create_storage
+from external.common.config import global_config
+from external.common.object import Interval
+from external.utils.date import cal_date_interval
+from external.utils.log import logger
+from tasks.binance_spot import (
+    KEY_DATA_FORMAT,
+    KEY_DATA_STORE,
+    fetch_day_agg_traders,
+    fetch_day_klines,
+    get_finished_days,
+)
+
+# 默认并发数，请求速率由rest api内部的权重限流器控制
+DEFAULT_MAX_WORKERS = 8
+# 进度日志的最小间隔，秒
+DEFAULT_REPORT_INTERVAL = 10
+
+KEY_METRICS_PORT = "metrics_port"  # 配置后启动Prometheus抓取接口
+KEY_METRICS_DUMP_PATH = "metrics_dump_path"  # 配置后定期把指标写入该文件
+
+BACKFILL_JOBS = counter("md_backfill_jobs_total", "完成的回补任务数", ["status"])
+BACKFILL_ROWS = counter("md_backfill_rows_total", "回补写入的行数").labels()
+BACKFILL_PENDING_JOBS = gauge("md_backfill_pending_jobs", "未完成的回补任务数").labels()
+BACKFILL_ROWS_PER_SECOND = gauge("md_backfill_rows_per_second", "本次回补的平均吞吐，行/秒").labels()
+
+
+@dataclass(frozen=True)
+class BackfillJob:
+    """
+    回补任务，对应一个(symbol, dataset, interval, day)的单日文件
+    """
+    symbol: str
+    dataset: str
+    day: str
+    interval: Optional[Interval] = None
+
+    def __str__(self):
+        if self.interval:
+            return f"{self.symbol}-{self.dataset}-{self.interval.value}-{self.day}"
+        return f"{self.symbol}-{self.dataset}-{self.day}"
+
+
+class BackfillProgress:
+    """
+    线程安全的回补进度统计，汇总任务数、行数与吞吐
+    """
+
+    def __init__(self, total: int, report_interval: float = DEFAULT_REPORT_INTERVAL):
+        self.total = total
+        self.report_interval = report_interval
+
+        self.finished = 0
+        self.failed = 0
+        self.empty = 0
+        self.rows = 0
+
+        self.start_time = time.time()
+        self.last_report_time = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, rows: int = 0, failed: bool = False):
+        with self._lock:
+            self.finished += 1
+            if failed:
+                self.failed += 1
+                BACKFILL_JOBS.labels("failed").inc()
+            elif rows == 0:
+                self.empty += 1
+                BACKFILL_JOBS.labels("empty").inc()
+            else:
+                BACKFILL_JOBS.labels("finished").inc()
+            self.rows += rows
+            BACKFILL_ROWS.inc(rows)
+            BACKFILL_PENDING_JOBS.set(self.total - self.finished)
+
+            now = time.time()
+            BACKFILL_ROWS_PER_SECOND.set(self.rows / max(now - self.start_time, 1e-6))
+            if now - self.last_report_time >= self.report_interval or self.finished == self.total:
+                self.last_report_time = now
+                self._report(now)
+
+    def _report(self, now: float):
+        elapsed = max(now - self.start_time, 1e-6)
+        jobs_per_second = self.finished / elapsed
+        eta = (self.total - self.finished) / jobs_per_second if jobs_per_second > 0 else 0
+        logger.info(
+            f"回补进度: {self.finished}/{self.total}, 失败: {self.failed}, 空数据: {self.empty}, "
+            f"行数: {self.rows}, 耗时: {elapsed:.1f}秒, "
+            f"吞吐: {jobs_per_second:.2f}任务/秒 {self.rows / elapsed:.0f}行/秒, 预计剩余: {eta:.0f}秒"
+        )
+
+
+class BackfillScheduler:
+    """
+    多symbol、多交易日的并发回补调度器
+    将(symbol, interval, day)任务分发到有界线程池，所有线程共享同一个rest api连接，
+    每个任务的输出文件与fetch_all_klines/fetch_agg_traders逐日生成的文件完全一致，
+    已在下载清单中完成的交易日在添加任务时直接跳过
+    """
+
+    def __init__(self, store_dir: str, max_workers: int = DEFAULT_MAX_WORKERS,
+                 proxy_host: str = "", proxy_port: int = 0,
+                 report_interval: float = DEFAULT_REPORT_INTERVAL, fmt: str = FORMAT_PARQUET):
+        self.store_dir = store_dir
+        self.storage = create_storage(store_dir, fmt)
+        self.max_workers = max_workers
+        self.proxy_host = proxy_host
+        self.proxy_port = proxy_port
+        self.report_interval = report_interval
+
+        self.jobs: list[BackfillJob] = []
+        self.skipped = 0
+        self.rest_api: Optional[BinanceSpotDataRestAPi] = None
+        self.manifest = DownloadManifest.open(store_dir)
+
+    def add_klines(self, symbols: list[str], intervals: list[Interval],
+                   start_trading_day: str, end_trading_day: str):
+        """
+        添加K线回补任务
+        :param symbols: 交易Symbol列表
+        :param intervals: k线周期列表
+        :param start_trading_day: 开始交易日
+        :param end_trading_day: 结束交易日
+        """
+        days = cal_date_interval(start_trading_day, end_trading_day)
+        for symbol in symbols:
+            for interval in intervals:
+                finished = get_finished_days(self.storage, self.manifest, symbol, DATASET_KLINES, interval)
+                for day in days:
+                    if day in finished:
+                        self.skipped += 1
+                        continue
+                    self.jobs.append(BackfillJob(symbol, DATASET_KLINES, day, interval))
+
+    def add_agg_traders(self, symbols: list[str], start_trading_day: str, end_trading_day: str):
+        """
+        添加聚合交易回补任务
+        :param symbols: 交易Symbol列表
+        :param start_trading_day: 开始交易日
+        :param end_trading_day: 结束交易日
+        """
+        days = cal_date_interval(start_trading_day, end_trading_day)
+        for symbol in symbols:
+            finished = get_finished_days(self.storage, self.manifest, symbol, DATASET_AGG_TRADERS)
+            for day in days:
+                if day in finished:
+                    self.skipped += 1
+                    continue
+                self.jobs.append(BackfillJob(symbol, DATASET_AGG_TRADERS, day))
+
+    def run(self) -> list[BackfillJob]:
+        """
+        执行所有任务
+        :return: 失败的任务列表
+        """
+        if not self.jobs:
+            logger.info(f"没有需要回补的任务, 已完成跳过: {self.skipped}")
+            return []
+
+        if self.rest_api is None:
+            self.rest_api = BinanceSpotDataRestAPi()
+            self.rest_api.connect(self.proxy_host, self.proxy_port)
+
+        progress = BackfillProgress(len(self.jobs), self.report_interval)
+        failed_jobs: list[BackfillJob] = []
+
+        logger.info(f"开始回补, 任务数: {len(self.jobs)}, 已完成跳过: {self.skipped}, 并发数: {self.max_workers}")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backfill") as executor:
+            futures = {executor.submit(self._run_job, job): job for job in self.jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    rows = future.result()
+                    progress.update(rows)
+                except Exception as e:
+                    logger.error(f"回补任务{job}失败: {e}")
+                    failed_jobs.append(job)
+                    progress.update(failed=True)
+
+        self.jobs.clear()
+        self.skipped = 0
+        return failed_jobs
+
+    def _run_job(self, job: BackfillJob) -> int:
+        if job.dataset == DATASET_KLINES:
+            return fetch_day_klines(self.rest_api, job.day, job.symbol, job.interval, self.storage, self.manifest)
+        elif job.dataset == DATASET_AGG_TRADERS:
+            return fetch_day_agg_traders(self.rest_api, job.day, job.symbol, self.storage, self.manifest)
+        else:
+            raise ValueError(f"不支持的数据集: {job.dataset}")
+
+
+if __name__ == '__main__':
+    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.yaml")
+    global_config.load_config(config_path)
+
+    store_path = global_config.get(KEY_DATA_STORE)
+    if not store_path:
+        logger.error("数据存储路径未配置")
+        exit(1)
+
+    metrics_port = global_config.get(KEY_METRICS_PORT)
+    if metrics_port:
+        start_http_server(int(metrics_port))
+    metrics_dumper = None
+    if global_config.get(KEY_METRICS_DUMP_PATH):
+        metrics_dumper = MetricsFileDumper(global_config.get(KEY_METRICS_DUMP_PATH))
+        metrics_dumper.start()
+
+    scheduler = BackfillScheduler(store_path, fmt=global_config.get(KEY_DATA_FORMAT) or FORMAT_PARQUET)
+    scheduler.add_klines(["BTCUSDT", "ETHUSDT"], [Interval.MINUTE], "2025-03-01", "2025-03-18")
+    failed = scheduler.run()
+    if failed:
+        logger.error(f"失败任务: {[str(job) for job in failed]}")
+    if metrics_dumper is not None:
+        metrics_dumper.stop()
@@ -1,83 +1,429 @@
 import os
+import time
 from datetime import datetime, timezone
+from typing import Callable, Optional, Union
+
+import pandas as pd
 
 from core.binance.spot.rest import BinanceSpotDataRestAPi
+from core.utils.bar_aggregator import aggregate_klines
+from core.utils.interval import interval_to_milliseconds
+from core.utils.manifest import DownloadManifest, ManifestEntry, STATUS_DONE, STATUS_EMPTY, STATUS_PARTIAL
+from core.utils.storage import (
+    DATASET_AGG_TRADERS,
+    DATASET_HISTORICAL_TRADES,
+    DATASET_KLINES,
+    FORMAT_PARQUET,
+    DataStorage,
+    create_storage,
+    get_dataset_name,
+)
+from external.common.constant import API_LIMIT_ONE_TIME
 from external.common.config import global_config
 from external.common.object import Interval, Exchange
 from external.utils.date import cal_date_interval
 from external.utils.log import logger
 
 KEY_DATA_STORE = "data_store_path"
+KEY_DATA_FORMAT = "data_store_format"
+
+DAY_MILLISECONDS = 24 * 60 * 60 * 1000
+
+# 断点的时间窗口: 每完成一个窗口就追加写入存储并更新下载清单
+KLINE_CHECKPOINT_PAGES = 10
+AGG_TRADES_CHECKPOINT_MILLISECONDS = 60 * 60 * 1000
+HISTORICAL_TRADES_CHECKPOINT_MILLISECONDS = 60 * 60 * 1000
+
+
+def cal_day_timestamp(day: str) -> tuple[int, int]:
+    """
+    计算交易日(UTC)的起止毫秒时间戳
+    :param day: 交易日，格式为%Y-%m-%d
+    :return: (开始时间戳, 结束时间戳)，均为闭区间
+    """
+    start_timestamp = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+    end_timestamp = start_timestamp + DAY_MILLISECONDS - 1
+    return start_timestamp, end_timestamp
+
+
+def find_kline_gaps(open_times, start_timestamp: int, end_timestamp: int, interval_ms: int) -> list[tuple[int, int]]:
+    """
+    查找缺失的K线，并合并为连续的时间窗口
+    :param open_times: 已有K线的开盘时间
+    :param start_timestamp: 开始时间
+    :param end_timestamp: 结束时间(闭区间)
+    :param interval_ms: K线周期，毫秒
+    :return: 缺失的时间窗口列表[(开始, 结束)]，均为闭区间
+    """
+    existing = set(int(t) for t in open_times)
+    gaps = []
+    gap_start = None
+    for open_time in range(start_timestamp, end_timestamp + 1, interval_ms):
+        if open_time not in existing:
+            if gap_start is None:
+                gap_start = open_time
+        elif gap_start is not None:
+            gaps.append((gap_start, open_time - 1))
+            gap_start = None
+    if gap_start is not None:
+        gaps.append((gap_start, end_timestamp))
+    return gaps
+
+
+def is_day_finished(storage: DataStorage, symbol: str, dataset_name: str, day: str, status: str) -> bool:
+    """
+    清单记录已完成，且数据文件仍存在(或确认没有数据)时才跳过，数据文件被删除或移动后会重新下载
+    """
+    return status == STATUS_EMPTY or (status == STATUS_DONE and storage.exists(symbol, dataset_name, day))
+
+
+def get_finished_days(storage: DataStorage, manifest: DownloadManifest, symbol: str, dataset: str,
+                      interval: Optional[Interval] = None) -> set[str]:
+    """
+    批量查询可以跳过的交易日，判断条件与fetch_day_*一致
+    """
+    dataset_name = get_dataset_name(dataset, interval)
+    statuses = manifest.finished_days(symbol, dataset, interval.value if interval else "")
+    return {day for day, status in statuses.items() if is_day_finished(storage, symbol, dataset_name, day, status)}
+
+
+def _trim_to_checkpoint(storage: DataStorage, entry: ManifestEntry, dataset_name: str, time_column: str):
+    """
+    上次在写入窗口之后、保存断点之前中断时，存储中会有断点之后的数据，续传前删除这部分数据，
+    保证每个窗口只写入一次，并按保留的数据重新计算行数和首尾时间戳
+    """
+    symbol, day = entry.symbol, entry.day
+    times = storage.read_day(symbol, dataset_name, day, columns=[time_column])
+    if not times.empty and int(times[time_column].max()) > entry.fetched_until:
+        df = storage.read_day(symbol, dataset_name, day)
+        df = df[df[time_column] <= entry.fetched_until]
+        logger.warning(f"{symbol} {day} {dataset_name}删除断点之后的{len(times) - len(df)}行")
+        storage.remove(symbol, dataset_name, day)
+        if not df.empty:
+            storage.append(df, symbol, dataset_name, day)
+        times = df[[time_column]]
+
+    entry.rows = len(times)
+    entry.first_timestamp = int(times[time_column].min()) if entry.rows else None
+    entry.last_timestamp = int(times[time_column].max()) if entry.rows else None
+
+
+def _fetch_day(rest_api: BinanceSpotDataRestAPi, storage: DataStorage, manifest: Optional[DownloadManifest],
+               day: str, symbol: str, dataset: str, interval: Optional[Interval],
+               query: Callable[[int, int], pd.DataFrame], time_column: str, window_ms: int,
+               align_ms: int) -> ManifestEntry:
+    """
+    按时间窗口下载单个交易日的数据，每个窗口完成后追加写入存储并记录断点
+    :param query: 查询函数，参数为窗口的开始、结束时间戳(闭区间)
+    :param time_column: 数据中的时间列，用于记录首尾时间戳
+    :param window_ms: 断点窗口大小，毫秒
+    :param align_ms: 未结束的交易日只下载到align_ms对齐的时间，避免写入未完成的K线
+    :return: 下载完成后的清单记录
+    """
+    start_timestamp, end_timestamp = cal_day_timestamp(day)
+    interval_value = interval.value if interval else ""
+    dataset_name = get_dataset_name(dataset, interval)
+
+    entry = manifest.get(symbol, dataset, interval_value, day) if manifest else None
+    if entry and entry.status == STATUS_PARTIAL and entry.fetched_until and storage.exists(symbol, dataset_name, day):
+        current = entry.fetched_until + 1
+        logger.info(f"{symbol} {day} {dataset_name}从断点{current}继续下载")
+        _trim_to_checkpoint(storage, entry, dataset_name, time_column)
+    else:
+        entry = ManifestEntry(symbol, dataset, interval_value, day, STATUS_PARTIAL)
+        current = start_timestamp
+        storage.remove(symbol, dataset_name, day)
+
+    # 当前交易日未结束时，只下载到服务器当前时间
+    server_now = int(time.time() * 1000) - rest_api.time_offset
+    fetch_end = min(end_timestamp, server_now - server_now % align_ms - 1)
+
+    while current <= fetch_end:
+        window_end = min(current + window_ms - 1, fetch_end)
+        df = query(current, window_end)
+        if not df.empty:
+            df["TradingDay"] = day
+            storage.append(df, symbol, dataset_name, day)
+            entry.rows += len(df)
+            if entry.first_timestamp is None:
+                entry.first_timestamp = int(df[time_column].iloc[0])
+            entry.last_timestamp = int(df[time_column].iloc[-1])
+
+        entry.fetched_until = window_end
+        if manifest:
+            manifest.put(entry)
+        current = window_end + 1
+
+    if fetch_end >= end_timestamp:
+        entry.status = STATUS_DONE if entry.rows else STATUS_EMPTY
+        if manifest:
+            manifest.put(entry)
+    return entry
+
+
+def fetch_day_klines(rest_api: BinanceSpotDataRestAPi, day: str, symbol: str, interval: Interval,
+                     storage: DataStorage, manifest: Optional[DownloadManifest] = None,
+                     refetch_gaps: bool = False) -> int:
+    """
+    获取单个交易日的K线数据并保存，已完成的交易日直接跳过
+    :param rest_api: 已连接的rest api，可在多个线程间共享
+    :param day: 交易日
+    :param symbol: 交易Symbol，如BTCUSDT
+    :param interval: k线周期
+    :param storage: 数据存储
+    :param manifest: 下载清单，为None时不记录断点
+    :param refetch_gaps: 是否重新下载已完成交易日中缺失的K线
+    :return: 数据行数，0表示没有获取到数据
+    """
+    dataset_name = get_dataset_name(DATASET_KLINES, interval)
+    entry = manifest.get(symbol, DATASET_KLINES, interval.value, day) if manifest else None
+    if entry and is_day_finished(storage, symbol, dataset_name, day, entry.status):
+        if refetch_gaps and entry.missing:
+            return _refetch_kline_gaps(rest_api, storage, manifest, entry, interval)
+        return entry.rows
+
+    logger.info(f"获取{symbol} {day}的K线数据")
+    interval_ms = interval_to_milliseconds(interval)
+    entry = _fetch_day(
+        rest_api, storage, manifest, day, symbol, DATASET_KLINES, interval,
+        lambda start, end: rest_api.query_kline(symbol, interval, start, end),
+        time_column="ExchangeTime",
+        window_ms=interval_ms * API_LIMIT_ONE_TIME * KLINE_CHECKPOINT_PAGES,
+        align_ms=interval_ms
+    )
+
+    if not entry.rows:
+        logger.warning(f"{symbol} {day}没有获取到K线数据")
+        return 0
+
+    if entry.finished:
+        start_timestamp, end_timestamp = cal_day_timestamp(day)
+        open_times = storage.read_day(symbol, dataset_name, day, columns=["ExchangeTime"])["ExchangeTime"]
+        entry.missing = sum(
+            (end - start + 1) // interval_ms
+            for start, end in find_kline_gaps(open_times, start_timestamp, end_timestamp, interval_ms)
+        )
+        if manifest:
+            manifest.put(entry)
+        if entry.missing:
+            logger.warning(f"{symbol} {day}缺失{entry.missing}根K线")
+
+    logger.info(f"{symbol} {day}的K线数据大小: {entry.rows}")
+    return entry.rows
+
+
+def _refetch_kline_gaps(rest_api: BinanceSpotDataRestAPi, storage: DataStorage, manifest: DownloadManifest,
+                        entry: ManifestEntry, interval: Interval) -> int:
+    """
+    只下载缺失的K线窗口，并与已有数据合并
+    """
+    start_timestamp, end_timestamp = cal_day_timestamp(entry.day)
+    interval_ms = interval_to_milliseconds(interval)
+    dataset_name = get_dataset_name(DATASET_KLINES, interval)
+
+    klines = storage.read_day(entry.symbol, dataset_name, entry.day)
+    gaps = find_kline_gaps(klines["ExchangeTime"], start_timestamp, end_timestamp, interval_ms)
+    logger.info(f"{entry.symbol} {entry.day}重新下载{len(gaps)}个缺失窗口")
+
+    patches = []
+    for start, end in gaps:
+        df = rest_api.query_kline(entry.symbol, interval, start, end)
+        if not df.empty:
+            df["TradingDay"] = entry.day
+            patches.append(df)
+
+    if patches:
+        klines = pd.concat([klines] + patches, ignore_index=True)
+        klines.drop_duplicates(subset=["ExchangeTime"], keep="first", inplace=True)
+        klines.sort_values("ExchangeTime", inplace=True)
+        storage.write(klines, entry.symbol, dataset_name, entry.day)
+
+    entry.rows = len(klines)
+    entry.first_timestamp = int(klines["ExchangeTime"].iloc[0])
+    entry.last_timestamp = int(klines["ExchangeTime"].iloc[-1])
+    entry.missing = sum(
+        (end - start + 1) // interval_ms
+        for start, end in find_kline_gaps(klines["ExchangeTime"], start_timestamp, end_timestamp, interval_ms)
+    )
+    manifest.put(entry)
+    return entry.rows
+
+
+def fetch_day_agg_traders(rest_api: BinanceSpotDataRestAPi, day: str, symbol: str, storage: DataStorage,
+                          manifest: Optional[DownloadManifest] = None) -> int:
+    """
+    获取单个交易日的聚合交易数据并保存，已完成的交易日直接跳过，未完成的交易日从断点继续
+    :param rest_api: 已连接的rest api，可在多个线程间共享
+    :param day: 交易日
+    :param symbol: 交易Symbol，如BTCUSDT
+    :param storage: 数据存储
+    :param manifest: 下载清单，为None时不记录断点
+    :return: 数据行数，0表示没有获取到数据
+    """
+    entry = manifest.get(symbol, DATASET_AGG_TRADERS, "", day) if manifest else None
+    if entry and is_day_finished(storage, symbol, DATASET_AGG_TRADERS, day, entry.status):
+        return entry.rows
+
+    logger.info(f"获取{symbol} {day}的数据")
+    entry = _fetch_day(
+        rest_api, storage, manifest, day, symbol, DATASET_AGG_TRADERS, None,
+        lambda start, end: rest_api.query_agg_trades_sharded(symbol, start, end),
+        time_column="TradeTimestamp",
+        window_ms=AGG_TRADES_CHECKPOINT_MILLISECONDS,
+        align_ms=1
+    )
+
+    if not entry.rows:
+        logger.warning(f"{symbol} {day}没有获取到聚合交易数据")
+        return 0
+    logger.info(f"{symbol} {day}的数据大小: {entry.rows}")
+    return entry.rows
+
+
+def fetch_day_historical_trades(rest_api: BinanceSpotDataRestAPi, day: str, symbol: str, storage: DataStorage,
+                                manifest: Optional[DownloadManifest] = None) -> int:
+    """
+    获取单个交易日的逐笔历史交易数据并保存，已完成的交易日直接跳过，未完成的交易日从断点继续
+    :param rest_api: 已连接的rest api，可在多个线程间共享
+    :param day: 交易日
+    :param symbol: 交易Symbol，如BTCUSDT
+    :param storage: 数据存储
+    :param manifest: 下载清单，为None时不记录断点
+    :return: 数据行数，0表示没有获取到数据
+    """
+    entry = manifest.get(symbol, DATASET_HISTORICAL_TRADES, "", day) if manifest else None
+    if entry and is_day_finished(storage, symbol, DATASET_HISTORICAL_TRADES, day, entry.status):
+        return entry.rows
+
+    logger.info(f"获取{symbol} {day}的逐笔交易数据")
+    entry = _fetch_day(
+        rest_api, storage, manifest, day, symbol, DATASET_HISTORICAL_TRADES, None,
+        lambda start, end: rest_api.query_historical_trades(symbol, start, end),
+        time_column="Time",
+        window_ms=HISTORICAL_TRADES_CHECKPOINT_MILLISECONDS,
+        align_ms=1
+    )
+
+    if not entry.rows:
+        logger.warning(f"{symbol} {day}没有获取到逐笔交易数据")
+        return 0
+    logger.info(f"{symbol} {day}的逐笔交易数据大小: {entry.rows}")
+    return entry.rows
 
 
 def fetch_all_klines(start_trading_day: str, end_trading_day: str,
-                     symbol: str, interval: Interval, store_dir: str):
+                     symbol: str, interval: Interval, store_dir: str, fmt: str = FORMAT_PARQUET):
     """
-    获取指定时间范围内的所有K线数据
+    获取指定时间范围内的所有K线数据，已完成的交易日会被跳过
     :param start_trading_day: 开始交易日
     :param end_trading_day: 结束交易日
     :param symbol: 交易Symbol，如BTCUSDT
     :param interval: k线周期
     :param store_dir: 存储目录
+    :param fmt: 存储格式，csv、parquet或arrow
     :return: None
     """
-    data_dir = os.path.join(store_dir, Exchange.BINANCE.value, "spot", symbol, interval.value)
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+    storage = create_storage(store_dir, fmt)
+    manifest = DownloadManifest.open(store_dir)
+    finished = get_finished_days(storage, manifest, symbol, DATASET_KLINES, interval)
+    days = [day for day in cal_date_interval(start_trading_day, end_trading_day) if day not in finished]
+    if not days:
+        logger.info(f"{symbol} {interval.value} K线数据已全部下载完成")
+        return
 
     rest_api = BinanceSpotDataRestAPi()
     rest_api.connect("", 0)
 
-    days = cal_date_interval(start_trading_day, end_trading_day)
     for day in days:
-        logger.info(f"获取{day}的K线数据")
-        start_timestamp = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
-        end_timestamp = start_timestamp + 24 * 60 * 60 * 1000 - 1
-        klines = rest_api.query_kline(symbol, interval, start_timestamp, end_timestamp)
+        fetch_day_klines(rest_api, day, symbol, interval, storage, manifest)
 
-        if klines.empty:
-            logger.warning(f"{day}没有获取到K线数据")
-            break
-        klines["TradingDay"] = day
-        # 保存到CSV文件
-        file_path = os.path.join(data_dir, f"{day}_klines.csv")
-        logger.info(f"{day}的K线数据大小: {klines.shape}")
-        klines.to_csv(file_path, index=False)
+
+def build_klines_from_minute(start_trading_day: str, end_trading_day: str, symbol: str,
+                             intervals: list[Union[Interval, str]], store_dir: str, fmt: str = FORMAT_PARQUET):
+    """
+    由已下载的1分钟K线合成更大周期的K线并写入存储，不需要再单独下载各周期
+    :param start_trading_day: 开始交易日
+    :param end_trading_day: 结束交易日
+    :param symbol: 交易Symbol，如BTCUSDT
+    :param intervals: 目标周期，如["5m", "15m", "1h", "4h", "1d"]，不能超过1天
+    :param store_dir: 存储目录
+    :param fmt: 存储格式，csv、parquet或arrow
+    """
+    for interval in intervals:
+        interval_ms = interval_to_milliseconds(interval)
+        if DAY_MILLISECONDS % interval_ms:
+            raise ValueError(f"按交易日合成的周期需要整除1天: {interval}")
+
+    storage = create_storage(store_dir, fmt)
+    source = get_dataset_name(DATASET_KLINES, Interval.MINUTE)
+    for day in cal_date_interval(start_trading_day, end_trading_day):
+        df = storage.read_day(symbol, source, day)
+        if df.empty:
+            logger.warning(f"{symbol} {day} 没有1分钟K线, 请先下载")
+            continue
+
+        start_timestamp, end_timestamp = cal_day_timestamp(day)
+        gaps = len(find_kline_gaps(df["ExchangeTime"], start_timestamp, end_timestamp,
+                                      interval_to_milliseconds(Interval.MINUTE)))
+        if gaps:
+            logger.warning(f"{symbol} {day} 的1分钟K线有{gaps}段缺失, 合成的K线可能不完整")
+
+        for interval in intervals:
+            bars = aggregate_klines(df, interval)
+            storage.write(bars, symbol, get_dataset_name(DATASET_KLINES, interval), day)
+        logger.info(f"{symbol} {day} 已由{len(df)}根1分钟K线合成{len(intervals)}个周期")
 
 
 def fetch_agg_traders(start_trading_day: str, end_trading_day: str,
-                      symbol: str, store_dir: str):
+                      symbol: str, store_dir: str, fmt: str = FORMAT_PARQUET):
     """
-    获取指定时间范围内的所有K线数据
+    获取指定时间范围内的所有聚合交易数据，已完成的交易日会被跳过
     :param start_trading_day: 开始交易日
     :param end_trading_day: 结束交易日
     :param symbol: 交易Symbol，如BTCUSDT
-    :param interval: k线周期
     :param store_dir: 存储目录
+    :param fmt: 存储格式，csv、parquet或arrow
     :return: None
     """
-    data_dir = os.path.join(store_dir, Exchange.BINANCE.value, "spot", symbol, "agg_traders")
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+    storage = create_storage(store_dir, fmt)
+    manifest = DownloadManifest.open(store_dir)
+    finished = get_finished_days(storage, manifest, symbol, DATASET_AGG_TRADERS)
+    days = [day for day in cal_date_interval(start_trading_day, end_trading_day) if day not in finished]
+    if not days:
+        logger.info(f"{symbol}聚合交易数据已全部下载完成")
+        return
 
     rest_api = BinanceSpotDataRestAPi()
     rest_api.connect("", 0)
 
-    days = cal_date_interval(start_trading_day, end_trading_day)
     for day in days:
-        logger.info(f"获取{day}的数据")
-        start_timestamp = int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
-        end_timestamp = start_timestamp + 24 * 60 * 60 * 1000 - 1
-        klines = rest_api.query_agg_trades(symbol, start_timestamp, end_timestamp)
+        fetch_day_agg_traders(rest_api, day, symbol, storage, manifest)
+
+
+def fetch_historical_trades(start_trading_day: str, end_trading_day: str,
+                            symbol: str, store_dir: str, fmt: str = FORMAT_PARQUET):
+    """
+    获取指定时间范围内的所有逐笔历史交易数据，已完成的交易日会被跳过
+    :param start_trading_day: 开始交易日
+    :param end_trading_day: 结束交易日
+    :param symbol: 交易Symbol，如BTCUSDT
+    :param store_dir: 存储目录
+    :param fmt: 存储格式，csv、parquet或arrow
+    :return: None
+    """
+    storage = create_storage(store_dir, fmt)
+    manifest = DownloadManifest.open(store_dir)
+    finished = get_finished_days(storage, manifest, symbol, DATASET_HISTORICAL_TRADES)
+    days = [day for day in cal_date_interval(start_trading_day, end_trading_day) if day not in finished]
+    if not days:
+        logger.info(f"{symbol}逐笔交易数据已全部下载完成")
+        return
+
+    rest_api = BinanceSpotDataRestAPi()
+    rest_api.connect("", 0)
 
-        if klines.empty:
-            logger.warning(f"{day}没有获取到K线数据")
-            break
-        klines["TradingDay"] = day
-        # 保存到CSV文件
-        file_path = os.path.join(data_dir, f"{day}_agg_traders.csv")
-        logger.info(f"{day}的数据大小: {klines.shape}")
-        klines.to_csv(file_path, index=False)
+    for day in days:
+        fetch_day_historical_trades(rest_api, day, symbol, storage, manifest)
 
 
 def fetch_trading_day_ticker(trading_day: str, symbol: str, store_dir: str, ticker_type: str = "FULL"):
@@ -124,10 +470,12 @@ if __name__ == '__main__':
     start_date = "2025-03-18"
     end_date = "2025-03-18"
 
+    store_format = global_config.get(KEY_DATA_FORMAT) or FORMAT_PARQUET
+
     intervals = [Interval.MINUTE]
     for interval in intervals:
-        fetch_all_klines(start_date, end_date, symbol, interval, store_path)
+        fetch_all_klines(start_date, end_date, symbol, interval, store_path, store_format)
 
-    # fetch_agg_traders(start_date, end_date, symbol)
-    # fetch_historical_trades(start_date, end_date, symbol)
+    # fetch_agg_traders(start_date, end_date, symbol, store_path, store_format)
+    # fetch_historical_trades(start_date, end_date, symbol, store_path, store_format)
     # fetch_trading_day_ticker(start_date, symbol)
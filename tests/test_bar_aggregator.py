@@ -0,0 +1,133 @@
+"""
+coding=utf-8
+@File   : test_bar_aggregator
+@Author : LiHan
+@Time   : 10/25/26:7:40 PM
+"""
+import pandas as pd
+import pytest
+
+from core.utils.bar_aggregator import (
+    BAR_TYPE_DOLLAR, BAR_TYPE_VOLUME, MINUTE_MILLISECONDS, BarAggregator, aggregate_klines, aggregate_threshold_bars,
+)
+
+SYMBOL = "BTCUSDT"
+MONDAY = 1704067200000  # 2024-01-01 00:00:00 UTC，周一
+
+
+def make_klines(symbol: str, start: int, volumes: list[float]) -> pd.DataFrame:
+    rows = []
+    for index, volume in enumerate(volumes):
+        price = 100.0 + index
+        rows.append({"Symbol": symbol, "ExchangeTime": start + index * MINUTE_MILLISECONDS, "Open": price,
+                     "High": price + 1, "Low": price - 1, "Close": price + 0.5, "Volume": volume,
+                     "Turnover": volume * price})
+    return pd.DataFrame(rows)
+
+
+def feed(aggregator: BarAggregator, df: pd.DataFrame):
+    for row in df.itertuples(index=False):
+        aggregator.update(row.Symbol, row.ExchangeTime, row.Open, row.High, row.Low, row.Close, row.Volume,
+                          row.Turnover)
+
+
+def test_time_bar_emitted_on_last_minute():
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=["5m"])
+    feed(aggregator, make_klines(SYMBOL, MONDAY, [1.0] * 5))
+    assert len(bars) == 1
+    bar = bars[0]
+    assert (bar.open_time, bar.close_time) == (MONDAY, MONDAY + 5 * MINUTE_MILLISECONDS - 1)
+    assert (bar.open, bar.high, bar.low, bar.close) == (100.0, 105.0, 99.0, 104.5)
+    assert (bar.volume, bar.count) == (5.0, 5)
+    assert not aggregator.bars
+
+
+def test_time_bar_emitted_when_last_minute_missing():
+    """
+    周期最后一分钟缺失时，在下一个周期的第一根K线到达时推送
+    """
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=["5m"])
+    df = make_klines(SYMBOL, MONDAY, [1.0] * 7)
+    feed(aggregator, df.drop(index=4))
+    assert [(bar.open_time, bar.count) for bar in bars] == [(MONDAY, 4)]
+    assert bars[0].close_time == MONDAY + 4 * MINUTE_MILLISECONDS - 1
+
+    aggregator.flush()
+    assert [(bar.open_time, bar.count) for bar in bars[1:]] == [(MONDAY + 5 * MINUTE_MILLISECONDS, 2)]
+    assert not aggregator.bars
+
+
+def test_flush_by_symbol():
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=["15m"], volume_threshold=100)
+    feed(aggregator, make_klines(SYMBOL, MONDAY, [1.0] * 3))
+    feed(aggregator, make_klines("ETHUSDT", MONDAY, [1.0] * 3))
+    aggregator.flush(SYMBOL)
+    assert sorted((bar.symbol, bar.interval) for bar in bars) == [(SYMBOL, "15m"), (SYMBOL, BAR_TYPE_VOLUME)]
+    assert set(aggregator.bars) == {("ETHUSDT", "15m"), ("ETHUSDT", BAR_TYPE_VOLUME)}
+
+
+def test_invalid_interval():
+    with pytest.raises(ValueError):
+        BarAggregator(print, intervals=["1m"])
+    with pytest.raises(ValueError):
+        BarAggregator(print, intervals=["30s"])
+
+
+def test_week_bar_starts_on_monday():
+    """
+    周K线与Binance一致从周一开始，而不是从1970-01-01(周四)按7天对齐
+    """
+    wednesday = MONDAY + 2 * 24 * 60 * MINUTE_MILLISECONDS
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=["1w"])
+    feed(aggregator, make_klines(SYMBOL, wednesday, [1.0] * 3))
+    aggregator.flush()
+    assert bars[0].open_time == MONDAY
+
+    df = pd.concat([make_klines(SYMBOL, MONDAY - MINUTE_MILLISECONDS, [1.0]), make_klines(SYMBOL, wednesday, [1.0])])
+    res = aggregate_klines(df, "1w")
+    assert res["ExchangeTime"].tolist() == [MONDAY - 7 * 24 * 60 * MINUTE_MILLISECONDS, MONDAY]
+
+
+def test_aggregate_klines_matches_streaming():
+    df = make_klines(SYMBOL, MONDAY, [float(index % 4) for index in range(60)])
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=["15m"])
+    feed(aggregator, df)
+
+    res = aggregate_klines(df, "15m")
+    assert res["ExchangeTime"].tolist() == [bar.open_time for bar in bars]
+    assert res["Volume"].tolist() == [bar.volume for bar in bars]
+    assert res["High"].tolist() == [bar.high for bar in bars]
+    assert res["Close"].tolist() == [bar.close for bar in bars]
+
+
+@pytest.mark.parametrize("bar_type", [BAR_TYPE_VOLUME, BAR_TYPE_DOLLAR])
+def test_aggregate_threshold_bars_matches_streaming(bar_type):
+    """
+    累计量达到阈值的那一分钟属于当前K线，批量结果与流式合成一致，多个Symbol分别累计
+    """
+    volumes = [1.0, 2.0, 3.0, 0.5, 0.5, 5.0, 1.0]
+    threshold = 3.0 if bar_type == BAR_TYPE_VOLUME else 300.0
+    df = pd.concat([make_klines(SYMBOL, MONDAY, volumes), make_klines("ETHUSDT", MONDAY, volumes[::-1])],
+                   ignore_index=True)
+
+    bars = []
+    aggregator = BarAggregator(bars.append, intervals=[], **{f"{bar_type}_threshold": threshold})
+    feed(aggregator, df)
+    aggregator.flush()
+
+    res = aggregate_threshold_bars(df, threshold, bar_type)
+    expected = sorted((bar.symbol, bar.open_time, bar.volume, bar.close) for bar in bars)
+    assert list(res[["Symbol", "ExchangeTime", "Volume", "Close"]].itertuples(index=False, name=None)) == expected
+
+
+def test_aggregate_threshold_bars_volume_split():
+    df = make_klines(SYMBOL, MONDAY, [1.0, 2.0, 3.0, 0.5, 0.5, 5.0, 1.0])
+    res = aggregate_threshold_bars(df, 3.0)
+    assert res["Volume"].tolist() == [3.0, 3.0, 6.0, 1.0]
+    assert res["ExchangeTime"].tolist() == [MONDAY + index * MINUTE_MILLISECONDS for index in (0, 2, 3, 6)]
+    assert res["High"].tolist() == [102.0, 103.0, 106.0, 107.0]
@@ -0,0 +1,116 @@
+"""
+coding=utf-8
+@File   : test_binance_spot
+@Author : LiHan
+@Time   : 10/23/26:10:00 AM
+"""
+import pandas as pd
+import pytest
+
+from core.utils.manifest import STATUS_DONE, STATUS_PARTIAL, DownloadManifest, ManifestEntry
+from core.utils.storage import DATASET_AGG_TRADERS, FORMAT_CSV, FORMAT_PARQUET, create_storage
+from tasks.binance_spot import (
+    AGG_TRADES_CHECKPOINT_MILLISECONDS,
+    cal_day_timestamp,
+    fetch_day_agg_traders,
+    get_finished_days,
+)
+
+SYMBOL = "BTCUSDT"
+DAY = "2024-01-01"
+WINDOWS = 24  # 聚合交易按小时分窗口
+
+
+class FakeRestApi:
+    """
+    每个窗口返回一条位于窗口开始时间的聚合交易
+    """
+
+    def __init__(self):
+        self.time_offset = 0
+        self.queries: list[tuple[int, int]] = []
+
+    def query_agg_trades_sharded(self, symbol: str, start: int, end: int) -> pd.DataFrame:
+        self.queries.append((start, end))
+        return make_trades(start)
+
+
+def make_trades(timestamp: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "AggTradeId": [timestamp // 1000],
+        "Price": [100.0],
+        "Quantity": [1.0],
+        "FirstTradeId": [timestamp // 1000],
+        "LastTradeId": [timestamp // 1000],
+        "TradeTimestamp": [timestamp],
+        "IsBuyerMaker": [True],
+        "IsBestPriceMatch": [True],
+        "Turnover": [100.0],
+        "LocalTime": [timestamp],
+        "Symbol": [SYMBOL],
+        "Exchange": ["BINANCE"],
+    })
+
+
+@pytest.fixture(params=[FORMAT_PARQUET, FORMAT_CSV])
+def storage(request, tmp_path):
+    return create_storage(str(tmp_path / "data"), request.param)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = DownloadManifest(str(tmp_path / "manifest.db"))
+    yield manifest
+    manifest.close()
+
+
+def test_fetch_day_finishes(storage, manifest):
+    api = FakeRestApi()
+    assert fetch_day_agg_traders(api, DAY, SYMBOL, storage, manifest) == WINDOWS
+
+    entry = manifest.get(SYMBOL, DATASET_AGG_TRADERS, "", DAY)
+    start_timestamp, end_timestamp = cal_day_timestamp(DAY)
+    assert entry.status == STATUS_DONE
+    assert entry.rows == WINDOWS
+    assert entry.fetched_until == end_timestamp
+    assert entry.first_timestamp == start_timestamp
+    assert len(storage.read_day(SYMBOL, DATASET_AGG_TRADERS, DAY)) == WINDOWS
+
+    # 已完成的交易日不再请求
+    api.queries.clear()
+    assert fetch_day_agg_traders(api, DAY, SYMBOL, storage, manifest) == WINDOWS
+    assert not api.queries
+    assert get_finished_days(storage, manifest, SYMBOL, DATASET_AGG_TRADERS) == {DAY}
+
+
+def test_resume_after_crash_before_checkpoint(storage, manifest):
+    """
+    前两个窗口已写入并记录断点，第三个窗口写入后、保存断点前中断
+    """
+    start_timestamp, _ = cal_day_timestamp(DAY)
+    for window in range(3):
+        df = make_trades(start_timestamp + window * AGG_TRADES_CHECKPOINT_MILLISECONDS)
+        df["TradingDay"] = DAY
+        storage.append(df, SYMBOL, DATASET_AGG_TRADERS, DAY)
+    manifest.put(ManifestEntry(SYMBOL, DATASET_AGG_TRADERS, "", DAY, STATUS_PARTIAL, rows=3,
+                               fetched_until=start_timestamp + 2 * AGG_TRADES_CHECKPOINT_MILLISECONDS - 1))
+
+    api = FakeRestApi()
+    assert fetch_day_agg_traders(api, DAY, SYMBOL, storage, manifest) == WINDOWS
+    # 从第三个窗口继续
+    assert api.queries[0][0] == start_timestamp + 2 * AGG_TRADES_CHECKPOINT_MILLISECONDS
+
+    df = storage.read_day(SYMBOL, DATASET_AGG_TRADERS, DAY)
+    assert len(df) == WINDOWS
+    assert df["AggTradeId"].is_unique
+    assert manifest.get(SYMBOL, DATASET_AGG_TRADERS, "", DAY).rows == WINDOWS
+
+
+def test_refetch_when_data_file_removed(storage, manifest):
+    fetch_day_agg_traders(FakeRestApi(), DAY, SYMBOL, storage, manifest)
+    storage.remove(SYMBOL, DATASET_AGG_TRADERS, DAY)
+    assert get_finished_days(storage, manifest, SYMBOL, DATASET_AGG_TRADERS) == set()
+
+    api = FakeRestApi()
+    assert fetch_day_agg_traders(api, DAY, SYMBOL, storage, manifest) == WINDOWS
+    assert len(api.queries) == WINDOWS
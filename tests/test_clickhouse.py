@@ -0,0 +1,237 @@
+"""
+coding=utf-8
+@File   : test_clickhouse
+@Author : LiHan
+@Time   : 10/25/26:9:30 PM
+"""
+import datetime
+import itertools
+import math
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from clickhouse_connect.driver.exceptions import OperationalError
+
+import core.utils.clickhouse as clickhouse
+from core.utils.clickhouse import ClickhouseClient, ClickhouseClientPool
+
+
+class StubClient:
+    """
+    不连接ClickHouse的客户端，记录ping、close和最后一次插入的数据
+    """
+    ids = itertools.count()
+
+    def __init__(self, healthy: bool = True):
+        self.id = next(self.ids)
+        self.healthy = healthy
+        self.pings = 0
+        self.closed = False
+
+    def ping(self) -> bool:
+        self.pings += 1
+        if self.healthy is None:
+            raise OSError("connection reset")
+        return self.healthy
+
+    def close(self):
+        self.closed = True
+
+    def insert_arrow(self, table_name: str, table: pa.Table, settings: dict = None):
+        self.inserted = table
+
+
+def test_pool_reuses_last_checked_in():
+    """
+    空闲连接后进先出，最近使用的连接最先被复用
+    """
+    pool = ClickhouseClientPool(StubClient, max_size=4)
+    first, second = pool.checkout(), pool.checkout()
+    pool.checkin(first)
+    pool.checkin(second)
+    assert pool.checkout() is second
+    assert pool.checkout() is first
+    assert pool.size == 2
+    assert not first.pings and not second.pings
+
+
+def test_pool_waits_when_full():
+    pool = ClickhouseClientPool(StubClient, max_size=1)
+    client = pool.checkout()
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.01)
+    pool.checkin(client)
+    assert pool.checkout(timeout=0.01) is client
+
+
+def test_pool_discards_on_operational_error():
+    """
+    网络错误后的连接直接丢弃，其他异常的连接放回连接池
+    """
+    pool = ClickhouseClientPool(StubClient, max_size=2)
+    with pytest.raises(OperationalError):
+        with pool.connection() as broken:
+            raise OperationalError("connection refused")
+    assert broken.closed
+    assert pool.size == 0
+
+    with pytest.raises(ValueError):
+        with pool.connection() as client:
+            raise ValueError("bad query")
+    assert not client.closed
+    with pool.connection() as reused:
+        assert reused is client
+    assert pool.size == 1
+
+
+@pytest.mark.parametrize("healthy", [False, None])
+def test_pool_health_check_replaces_dead_connection(healthy):
+    """
+    空闲超过health_check_interval的连接取出时先ping，失败或抛出异常时丢弃并重新创建
+    """
+    pool = ClickhouseClientPool(StubClient, max_size=2, health_check_interval=0)
+    client = pool.checkout()
+    client.healthy = healthy
+    pool.checkin(client)
+
+    replacement = pool.checkout()
+    assert replacement is not client
+    assert client.pings == 1 and client.closed
+    assert pool.size == 1
+
+    pool.checkin(replacement)
+    assert pool.checkout() is replacement
+    assert replacement.pings == 1
+
+
+def test_pool_skips_health_check_for_recent_connection():
+    pool = ClickhouseClientPool(StubClient, health_check_interval=60)
+    client = pool.checkout()
+    client.healthy = False
+    pool.checkin(client)
+    assert pool.checkout() is client
+    assert not client.pings
+
+
+def test_pool_close():
+    pool = ClickhouseClientPool(StubClient)
+    clients = [pool.checkout() for _ in range(3)]
+    for client in clients:
+        pool.checkin(client)
+    pool.close()
+    assert all(client.closed for client in clients)
+    assert pool.size == 0
+
+
+def data_address(column: pa.ChunkedArray) -> int:
+    return column.chunk(0).buffers()[1].address
+
+
+@pytest.mark.parametrize("string_type", [pa.string(), pa.large_string()])
+def test_special_values_trading_day_to_date(string_type):
+    table = pa.table({
+        "TradingDay": pa.array(["2024-01-01", "2024-02-29"], type=string_type),
+        "Price": pa.array([1.5, 2.5]),
+    })
+    res = ClickhouseClient._handle_special_values_arrow(table)
+    assert res.schema.field("TradingDay").type == pa.date32()
+    assert res["TradingDay"].to_pylist() == [datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)]
+    # 不需要修改的列不复制
+    assert data_address(res["Price"]) == data_address(table["Price"])
+
+
+def test_special_values_inf_to_nan():
+    table = pa.table({
+        "Price": pa.array([1.0, math.inf, -math.inf, None], type=pa.float64()),
+        "Volume": pa.array([1.0, 2.0, 3.0, 4.0], type=pa.float32()),
+        "Id": pa.array([1, 2, 3, 4]),
+    })
+    res = ClickhouseClient._handle_special_values_arrow(table)
+    assert res.schema == table.schema
+    price = res["Price"].to_pylist()
+    assert price[0] == 1.0 and math.isnan(price[1]) and math.isnan(price[2]) and price[3] is None
+    assert data_address(res["Volume"]) == data_address(table["Volume"])
+    assert data_address(res["Id"]) == data_address(table["Id"])
+
+
+def test_insert_arrow_handles_special_values():
+    """
+    pandas输入转换为Arrow后再处理特殊值
+    """
+    client = ClickhouseClient("localhost", "default", "")
+    client.pool = ClickhouseClientPool(StubClient)
+    df = pd.DataFrame({"TradingDay": ["2024-01-01"] * 3, "Price": [1.0, math.inf, 3.0]})
+    assert client.insert_arrow("trades", df) == 3
+
+    with client.pool.connection() as stub:
+        table = stub.inserted
+    assert table.schema.field("TradingDay").type == pa.date32()
+    assert math.isnan(table["Price"][1].as_py())
+
+
+class RecordingWorkerClient:
+    """
+    并行插入子进程中使用的客户端，每次插入在log_dir/{去重token}中追加一行首个Id，
+    批次序号在fail_times中时前N次插入失败
+    """
+
+    def __init__(self, log_dir: str, fail_times: dict[int, int]):
+        self.log_dir = log_dir
+        self.fail_times = fail_times
+
+    def insert_arrow(self, table_name: str, table: pa.Table, settings: dict = None):
+        token = settings["insert_deduplication_token"]
+        path = os.path.join(self.log_dir, token)
+        with open(path, "a") as f:
+            f.write(f"{table['Id'][0].as_py()}\n")
+        with open(path) as f:
+            attempts = len(f.readlines())
+        if attempts <= self.fail_times.get(int(token.rsplit("-", 1)[1]), 0):
+            raise OperationalError("connection reset")
+
+
+def _init_recording_worker(connection_params: dict, ipc_path: str):
+    """
+    替换并行插入子进程的initializer，connection_params中传入测试配置
+    """
+    clickhouse._worker_client = RecordingWorkerClient(connection_params["log_dir"],
+                                                      connection_params["fail_times"])
+    clickhouse._worker_table = pa.ipc.open_file(pa.memory_map(ipc_path, "r")).read_all()
+
+
+def insert_parallel(monkeypatch, tmp_path, fail_times: dict[int, int]):
+    """
+    250行按每批100行分3个批次并行插入，每个批次最多尝试2次
+    """
+    monkeypatch.setattr(clickhouse, "_init_insert_worker", _init_recording_worker)
+    client = ClickhouseClient("localhost", "default", "")
+    client.get_connection_params = lambda: {"log_dir": str(tmp_path), "fail_times": fail_times}
+    df = pd.DataFrame({"Id": range(250), "Price": [1.0] * 250})
+    return client.insert_dataframe_parallel("trades", df, batch_size=100, max_workers=2, max_retry=2,
+                                            insert_id="job")
+
+
+def read_attempts(tmp_path) -> dict[str, list[int]]:
+    """
+    :return: {去重token: [每次插入的首个Id]}
+    """
+    return {path.name: [int(line) for line in path.read_text().split()] for path in tmp_path.iterdir()}
+
+
+def test_insert_parallel_retries_with_same_token(monkeypatch, tmp_path):
+    """
+    每个批次的去重token为{insert_id}-{批次序号}，失败重试时使用同一个token
+    """
+    assert insert_parallel(monkeypatch, tmp_path, {1: 1}) == 250
+    assert read_attempts(tmp_path) == {"job-0": [0], "job-1": [100, 100], "job-2": [200]}
+
+
+def test_insert_parallel_failed_batch_raises(monkeypatch, tmp_path):
+    """
+    批次重试max_retry次仍失败时，其他批次照常插入，最后抛出RuntimeError
+    """
+    with pytest.raises(RuntimeError, match=r"1个批次失败: \[2\].*insert_id=job"):
+        insert_parallel(monkeypatch, tmp_path, {2: 2})
+    assert read_attempts(tmp_path) == {"job-0": [0], "job-1": [100], "job-2": [200, 200]}
@@ -0,0 +1,166 @@
+"""
+coding=utf-8
+@File   : test_clickhouse_sink
+@Author : LiHan
+@Time   : 10/25/26:2:40 PM
+"""
+import pyarrow as pa
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from core.utils.clickhouse_sink import ClickhouseSink
+
+TABLE = "ticks"
+SCHEMA = pa.schema([("Id", pa.int64()), ("Price", pa.float64())])
+
+
+class FlakyClickhouseClient:
+    """
+    前fail_times次插入抛出error，之后恢复；记录每次成功插入的表和去重token
+    """
+
+    def __init__(self, fail_times: int = 0, error: Exception = None):
+        self.fail_times = fail_times
+        self.error = error or OperationalError("connection refused")
+        self.attempts = 0
+        self.inserts: list[tuple[str, pa.Table, str]] = []
+
+    def insert_arrow(self, table_name: str, table: pa.Table, settings: dict = None):
+        self.attempts += 1
+        if self.attempts <= self.fail_times:
+            raise self.error
+        self.inserts.append((table_name, table, (settings or {}).get("insert_deduplication_token")))
+
+    def rows(self) -> list[int]:
+        return [row for _, table, _ in self.inserts for row in table["Id"].to_pylist()]
+
+
+def make_sink(client, tmp_path, **kwargs) -> ClickhouseSink:
+    sink = ClickhouseSink(client, str(tmp_path / "spill"), retry_interval=0, **kwargs)
+    sink.register(TABLE, SCHEMA)
+    return sink
+
+
+def append_rows(sink: ClickhouseSink, ids: range):
+    for row_id in ids:
+        sink.append(TABLE, (row_id, 1.0))
+    sink.flush(force=True)
+
+
+def spill_files(tmp_path) -> list:
+    return sorted(tmp_path.joinpath("spill", TABLE).glob("*.arrow"))
+
+
+def test_spill_then_replay_in_order(tmp_path):
+    """
+    插入失败后批次溢写到本地，之后的批次也直接溢写，恢复后按顺序回放并使用文件名作为去重token
+    """
+    client = FlakyClickhouseClient(fail_times=1)
+    sink = make_sink(client, tmp_path)
+    append_rows(sink, range(0, 3))
+    assert not sink.healthy
+    append_rows(sink, range(3, 5))
+    assert client.attempts == 1
+    files = spill_files(tmp_path)
+    assert len(files) == 2
+
+    sink._replay()
+    assert sink.healthy
+    assert client.rows() == [0, 1, 2, 3, 4]
+    assert [token for _, _, token in client.inserts] == [path.stem for path in files]
+    assert not spill_files(tmp_path)
+
+    append_rows(sink, range(5, 6))
+    assert client.rows()[-1] == 5
+    assert not spill_files(tmp_path)
+
+
+def test_direct_insert_token_reused_by_spill(tmp_path):
+    """
+    直接插入失败时溢写文件以同一个去重token命名，超时但实际写入成功的批次回放时会被去重
+    """
+    tokens = []
+
+    class TimeoutClient(FlakyClickhouseClient):
+        def insert_arrow(self, table_name, table, settings=None):
+            tokens.append(settings["insert_deduplication_token"])
+            super().insert_arrow(table_name, table, settings)
+
+    client = TimeoutClient(fail_times=1, error=TimeoutError("read timed out"))
+    sink = make_sink(client, tmp_path)
+    append_rows(sink, range(0, 2))
+    files = spill_files(tmp_path)
+    assert [path.stem for path in files] == tokens
+
+    sink._replay()
+    assert tokens == [tokens[0], tokens[0]]
+
+
+def test_replay_on_start(tmp_path):
+    """
+    启动时先回放上次遗留的溢写文件
+    """
+    append_rows(make_sink(FlakyClickhouseClient(fail_times=1), tmp_path), range(0, 3))
+    assert len(spill_files(tmp_path)) == 1
+
+    client = FlakyClickhouseClient()
+    sink = make_sink(client, tmp_path)
+    sink.start()
+    sink.stop()
+    assert client.rows() == [0, 1, 2]
+    assert not spill_files(tmp_path)
+
+
+def test_connection_error_retries_without_quarantine(tmp_path):
+    """
+    连接错误不计入回放失败次数，文件一直保留到ClickHouse恢复
+    """
+    append_rows(make_sink(FlakyClickhouseClient(fail_times=1), tmp_path), range(0, 2))
+    client = FlakyClickhouseClient(fail_times=5)
+    sink = make_sink(client, tmp_path, max_replay_attempts=2)
+    for _ in range(5):
+        sink._replay()
+        assert not sink.healthy
+    assert len(spill_files(tmp_path)) == 1
+
+    sink._replay()
+    assert sink.healthy
+    assert client.rows() == [0, 1]
+
+
+def test_rejected_file_quarantined(tmp_path):
+    """
+    非连接错误回放失败max_replay_attempts次后文件改为.bad后缀，后续文件继续回放
+    """
+    append_rows(make_sink(FlakyClickhouseClient(fail_times=2), tmp_path), range(0, 2))
+    sink = make_sink(FlakyClickhouseClient(fail_times=1), tmp_path)
+    append_rows(sink, range(2, 4))
+    bad, good = spill_files(tmp_path)
+
+    client = FlakyClickhouseClient(fail_times=2, error=ValueError("Type mismatch"))
+    sink = make_sink(client, tmp_path, max_replay_attempts=2)
+    sink._replay()
+    assert not sink.healthy
+    assert spill_files(tmp_path) == [bad, good]
+
+    sink._replay()
+    assert sink.healthy
+    assert client.rows() == [2, 3]
+    assert not spill_files(tmp_path)
+    assert bad.with_name(f"{bad.name}.bad").exists()
+    assert not sink.replay_failures
+
+
+def test_unreadable_file_quarantined(tmp_path):
+    """
+    无法读取的溢写文件直接隔离
+    """
+    directory = tmp_path.joinpath("spill", TABLE)
+    directory.mkdir(parents=True)
+    directory.joinpath("0_broken.arrow").write_bytes(b"not arrow")
+
+    client = FlakyClickhouseClient()
+    sink = make_sink(client, tmp_path)
+    sink._replay()
+    assert sink.healthy
+    assert not client.inserts
+    assert directory.joinpath("0_broken.arrow.bad").exists()
@@ -0,0 +1,149 @@
+"""
+coding=utf-8
+@File   : test_clickhouse_sync
+@Author : LiHan
+@Time   : 10/25/26:4:10 PM
+"""
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from core.utils.clickhouse_sync import ClickhouseSyncEngine
+
+TABLE = "ticks"
+TRADING_DAY = "2026-10-21"
+STAGING = f"{TABLE}__sync_staging_20261021"
+OTHER_DAYS = "other_days"  # 目标表同一个按月分区中其他交易日的数据
+
+
+class FakeCluster:
+    """
+    源表、暂存表和目标表按Symbol(其他交易日整体作为一项)记录(行数, 校验和)，按SQL模拟同步引擎用到的语句
+    """
+
+    def __init__(self, source: dict, staging: dict = None, target: dict = None):
+        self.tables = {"source": dict(source), STAGING: dict(staging or {}), TABLE: dict(target or {})}
+        self.commands: list[str] = []
+
+    def client(self, host: str):
+        cluster = self
+        return SimpleNamespace(host=host, username="default", passwd="",
+                               command=cluster.command, query=cluster.query, query_value=cluster.query_value)
+
+    def _table(self, name: str) -> dict:
+        return self.tables["source" if name.startswith("remote(") else name]
+
+    def _keys(self, table: dict, condition: str) -> list[str]:
+        if "NOT (" in condition:
+            return [OTHER_DAYS] if OTHER_DAYS in table else []
+        match = re.search(r"Symbol IN \((.*)\)", condition)
+        symbols = re.findall(r"'(\w+)'", match.group(1)) if match else [key for key in table if key != OTHER_DAYS]
+        return [symbol for symbol in symbols if symbol in table]
+
+    def command(self, sql: str):
+        self.commands.append(sql)
+        if match := re.match(r"INSERT INTO (\S+) SELECT \* FROM (.+?) WHERE (.*)", sql):
+            destination, source = self._table(match.group(1)), self._table(match.group(2))
+            for key in self._keys(source, match.group(3)):
+                destination[key] = source[key]
+        elif match := re.match(r"ALTER TABLE (\S+) DELETE WHERE (.*) SETTINGS", sql):
+            table = self._table(match.group(1))
+            for key in self._keys(table, match.group(2)):
+                del table[key]
+        elif match := re.match(r"ALTER TABLE (\S+) REPLACE PARTITION ID '\w+' FROM (\S+)", sql):
+            self.tables[match.group(1)] = dict(self.tables[match.group(2)])
+        elif sql.startswith("DROP TABLE"):
+            self.tables[STAGING] = {}
+
+    def query(self, sql: str):
+        if sql.startswith("SELECT DISTINCT _partition_id"):
+            rows = [("202610",)]
+        elif match := re.match(r"SELECT Symbol, count\(\) FROM (.+?) WHERE", sql):
+            rows = sorted((symbol, value[0]) for symbol, value in self._table(match.group(1)).items())
+        elif match := re.match(r"SELECT count\(\), sum\(cityHash64\(\*\)\) FROM (.+?) WHERE (.*)", sql):
+            table = self._table(match.group(1))
+            values = [table[key] for key in self._keys(table, match.group(2))]
+            rows = [(sum(value[0] for value in values), sum(value[1] for value in values))]
+        else:
+            raise AssertionError(f"unexpected query: {sql}")
+        return SimpleNamespace(result_rows=rows)
+
+    def query_value(self, sql: str):
+        match = re.match(r"SELECT count\(\) FROM (.+?) WHERE (.*)", sql)
+        table = self._table(match.group(1))
+        return sum(table[key][0] for key in self._keys(table, match.group(2)))
+
+
+def make_engine(cluster: FakeCluster) -> ClickhouseSyncEngine:
+    return ClickhouseSyncEngine(cluster.client("remote-host"), cluster.client("local-host"), TABLE, chunk_rows=1)
+
+
+def statements(cluster: FakeCluster) -> list[str]:
+    return [" ".join(sql.split()[:3]) for sql in cluster.commands]
+
+
+def test_sync_day_keeps_other_days_in_partition():
+    """
+    按月分区时先把目标表同分区其他交易日复制到暂存表，再替换分区
+    """
+    cluster = FakeCluster(source={"BTCUSDT": (3, 30), "ETHUSDT": (2, 20)},
+                          target={"BTCUSDT": (1, 5), OTHER_DAYS: (7, 70)})
+    assert make_engine(cluster).sync_day(TRADING_DAY) == 5
+
+    assert statements(cluster) == [
+        "CREATE TABLE IF",
+        f"INSERT INTO {STAGING}",
+        f"INSERT INTO {STAGING}",
+        f"INSERT INTO {STAGING}",
+        f"ALTER TABLE {TABLE}",
+        f"DROP TABLE IF",
+    ]
+    assert f"FROM {TABLE} WHERE _partition_id IN ('202610') AND NOT (" in cluster.commands[3]
+    assert "REPLACE PARTITION ID '202610'" in cluster.commands[4]
+    assert cluster.tables[TABLE] == {"BTCUSDT": (3, 30), "ETHUSDT": (2, 20), OTHER_DAYS: (7, 70)}
+
+
+def test_sync_day_resume_skips_verified_chunks():
+    """
+    重新执行时跳过暂存表中已一致的分块，不完整的分块先删除再同步
+    """
+    cluster = FakeCluster(source={"BTCUSDT": (3, 30), "ETHUSDT": (2, 20)},
+                          staging={"BTCUSDT": (3, 30), "ETHUSDT": (1, 4)})
+    make_engine(cluster).sync_day(TRADING_DAY)
+
+    chunk_commands = [sql for sql in cluster.commands if "Symbol IN" in sql]
+    assert len(chunk_commands) == 2
+    assert chunk_commands[0].startswith(f"ALTER TABLE {STAGING} DELETE WHERE") and "'ETHUSDT'" in chunk_commands[0]
+    assert chunk_commands[1].startswith(f"INSERT INTO {STAGING}") and "'ETHUSDT'" in chunk_commands[1]
+    assert cluster.tables[TABLE] == {"BTCUSDT": (3, 30), "ETHUSDT": (2, 20)}
+
+
+def test_sync_day_chunk_mismatch_keeps_target():
+    """
+    分块校验失败时抛出异常，不替换目标表
+    """
+    cluster = FakeCluster(source={"BTCUSDT": (3, 30)}, target={"BTCUSDT": (1, 5)})
+    original_command = cluster.command
+
+    def lossy_command(sql: str):
+        original_command(sql)
+        if sql.startswith(f"INSERT INTO {STAGING}"):
+            cluster.tables[STAGING]["BTCUSDT"] = (2, 20)
+
+    cluster.command = lossy_command
+    with pytest.raises(RuntimeError, match="校验失败"):
+        make_engine(cluster).sync_day(TRADING_DAY)
+    assert not any("REPLACE PARTITION" in sql for sql in cluster.commands)
+    assert cluster.tables[TABLE] == {"BTCUSDT": (1, 5)}
+
+
+def test_sync_day_empty_source_clears_target_day():
+    """
+    源表当天没有数据时删除目标表当天的数据，不影响其他交易日
+    """
+    cluster = FakeCluster(source={}, target={"BTCUSDT": (1, 5), OTHER_DAYS: (7, 70)})
+    assert make_engine(cluster).sync_day(TRADING_DAY) == 0
+    assert statements(cluster) == [f"ALTER TABLE {TABLE}"]
+    assert "mutations_sync = 2" in cluster.commands[0]
+    assert cluster.tables[TABLE] == {OTHER_DAYS: (7, 70)}
@@ -0,0 +1,134 @@
+"""
+coding=utf-8
+@File   : test_decode
+@Author : LiHan
+@Time   : 10/25/26:10:20 PM
+"""
+import numpy as np
+import pandas as pd
+
+from core.binance.spot.decode import ColumnBuffer, decode_agg_trades, decode_historical_trades, decode_klines
+
+LOCAL_TIME = 1700000000123
+
+KLINES = [
+    [1700000000000, "37000.01000000", "37010.00000000", "36990.50000000", "37005.12000000", "12.34567000",
+     1700000059999, "456789.12345678", 321, "6.00000001", "222000.00000009", "0"],
+    [1700000060000, "37005.12000000", "37005.12000000", "36000.00000000", "36001.00000000", "0.00001000",
+     1700000119999, "0.36001000", 1, "0.00000000", "0.00000000", "0"],
+]
+AGG_TRADES = [
+    {"a": 26129, "p": "0.01633102", "q": "4.70443515", "f": 27781, "l": 27781, "T": 1498793709153, "m": True,
+     "M": True},
+    {"a": 26130, "p": "0.01633103", "q": "0.00000001", "f": 27782, "l": 27790, "T": 1498793709154, "m": False,
+     "M": True},
+]
+HISTORICAL_TRADES = [
+    {"id": 28457, "price": "4.00000100", "qty": "12.00000000", "quoteQty": "48.000012", "time": 1499865549590,
+     "isBuyerMaker": True, "isBestMatch": True},
+    {"id": 28458, "price": "4.00000200", "qty": "0.10000000", "quoteQty": "0.40000020", "time": 1499865549591,
+     "isBuyerMaker": False, "isBestMatch": False},
+]
+
+
+def legacy_klines(data: list) -> pd.DataFrame:
+    """
+    改为按列解析之前的pandas实现，价格列保持为字符串
+    """
+    columns = ['OpenTime', 'Open', 'High', 'Low', 'Close', 'Volume', 'CloseTime',
+               'QuoteAssetVolume', 'NumberOfTrades', 'TakerBuyBaseAssetVolume',
+               'TakerBuyQuoteAssetVolume', 'Ignore']
+    df = pd.DataFrame(data, columns=columns)
+    df["LocalTime"] = LOCAL_TIME
+    df.rename({"OpenTime": "ExchangeTime", "QuoteAssetVolume": "Turnover"}, axis=1, inplace=True)
+    df.drop(columns=["Ignore"], inplace=True)
+    return df
+
+
+def legacy_agg_trades(data: list[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(data)
+    df.rename(columns={"a": "AggTradeId", "p": "Price", "q": "Quantity", "f": "FirstTradeId", "l": "LastTradeId",
+                       "T": "TradeTimestamp", "m": "IsBuyerMaker", "M": "IsBestPriceMatch"}, inplace=True)
+    df["Price"] = df["Price"].astype(float)
+    df["Quantity"] = df["Quantity"].astype(float)
+    df["Turnover"] = df["Price"] * df["Quantity"]
+    df["LocalTime"] = LOCAL_TIME
+    return df
+
+
+def legacy_historical_trades(data: list[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(data)
+    df.rename(columns={"id": "Id", "price": "Price", "qty": "Quantity", "quoteQty": "QuoteQuantity", "time": "Time",
+                       "isBuyerMaker": "IsBuyerMaker", "isBestMatch": "IsBestMatch"}, inplace=True)
+    df["Price"] = df["Price"].astype(float)
+    df["Quantity"] = df["Quantity"].astype(float)
+    df["QuoteQuantity"] = df["QuoteQuantity"].astype(float)
+    df["LocalTime"] = LOCAL_TIME
+    return df
+
+
+def test_decode_klines_matches_legacy():
+    """
+    与之前的pandas结果一致，价格和数量由字符串变为float64
+    """
+    res = pd.DataFrame(decode_klines(KLINES, LOCAL_TIME))
+    expected = legacy_klines(KLINES)
+    expected = expected.astype({name: np.float64 for name in expected.columns
+                                if not pd.api.types.is_numeric_dtype(expected[name])})
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_decode_agg_trades_matches_legacy():
+    res = pd.DataFrame(decode_agg_trades(AGG_TRADES, LOCAL_TIME))
+    pd.testing.assert_frame_equal(res, legacy_agg_trades(AGG_TRADES))
+
+
+def test_decode_historical_trades_matches_legacy():
+    res = pd.DataFrame(decode_historical_trades(HISTORICAL_TRADES, LOCAL_TIME))
+    pd.testing.assert_frame_equal(res, legacy_historical_trades(HISTORICAL_TRADES))
+
+
+def test_decode_empty_page():
+    assert decode_klines([], LOCAL_TIME) == {}
+    assert decode_agg_trades([], LOCAL_TIME) == {}
+    assert decode_historical_trades([], LOCAL_TIME) == {}
+
+
+def test_column_buffer_grows_and_keeps_dtypes():
+    buffer = ColumnBuffer(capacity=2)
+    assert buffer.last("AggTradeId") is None
+    assert buffer.to_dataframe().empty
+
+    pages = [decode_agg_trades(AGG_TRADES, LOCAL_TIME) for _ in range(3)]
+    for page in pages:
+        buffer.append(page)
+    assert len(buffer) == 6
+    assert buffer.capacity == 8
+    assert buffer.last("AggTradeId") == 26130
+
+    df = buffer.to_dataframe()
+    expected = pd.concat([pd.DataFrame(page) for page in pages], ignore_index=True)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_column_buffer_first_page_larger_than_capacity():
+    buffer = ColumnBuffer(capacity=1)
+    buffer.append(decode_historical_trades(HISTORICAL_TRADES, LOCAL_TIME))
+    assert (len(buffer), buffer.capacity) == (2, 2)
+
+
+def test_column_buffer_mask():
+    """
+    只追加mask为True的行，全部为False或空页时不改变缓冲区
+    """
+    buffer = ColumnBuffer()
+    page = decode_agg_trades(AGG_TRADES, LOCAL_TIME)
+    buffer.append(page, np.array([False, True]))
+    assert buffer.to_dataframe()["AggTradeId"].tolist() == [26130]
+
+    buffer.append(page, page["AggTradeId"] > buffer.last("AggTradeId"))
+    buffer.append({})
+    assert len(buffer) == 1
+
+    buffer.append(page, page["AggTradeId"] >= 26129)
+    assert buffer.to_dataframe()["AggTradeId"].tolist() == [26130, 26129, 26130]
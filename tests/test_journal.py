@@ -0,0 +1,53 @@
+"""
+coding=utf-8
+@File   : test_journal
+@Author : LiHan
+@Time   : 10/23/26:4:40 PM
+"""
+import threading
+import time
+
+from core.utils.journal import JOURNAL_DROPPED, JournalRecorder, list_journals, read_journal
+
+
+def test_record_only_while_running(tmp_path):
+    """
+    start之前和stop之后的消息不进入队列，只计入丢弃数
+    """
+    recorder = JournalRecorder(tmp_path)
+    dropped = JOURNAL_DROPPED.value
+    recorder.record("before")
+    recorder.start()
+    recorder.record("first", 1)
+    recorder.record(b"second", 2)
+    recorder.stop()
+    recorder.record("after")
+
+    assert recorder.queue.empty()
+    assert recorder.dropped == 2
+    assert JOURNAL_DROPPED.value - dropped == 2
+    assert recorder.records == 2
+
+    paths = list_journals(tmp_path)
+    assert len(paths) == 1
+    assert list(read_journal(paths[0])) == [(1, b"first"), (2, b"second")]
+
+
+def test_record_concurrent_with_stop(tmp_path):
+    """
+    与stop并发的消息要么写入日志，要么计入丢弃数，不会留在队列中
+    """
+    recorder = JournalRecorder(tmp_path)
+    recorder.start()
+    total = 20000
+    writer = threading.Thread(target=lambda: [recorder.record(b"m", index) for index in range(total)])
+    writer.start()
+    while not recorder.queue.qsize() and writer.is_alive():
+        time.sleep(0)
+    recorder.stop()
+    writer.join()
+
+    assert recorder.queue.empty()
+    written = sum(len(list(read_journal(path))) for path in list_journals(tmp_path))
+    assert written == recorder.records
+    assert written + recorder.dropped == total
@@ -0,0 +1,115 @@
+"""
+coding=utf-8
+@File   : test_limiter
+@Author : LiHan
+@Time   : 10/25/26:5:20 PM
+"""
+import threading
+
+import pytest
+
+from core.binance.spot import limiter as limiter_module
+from core.binance.spot.limiter import (
+    BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS, HEADER_RETRY_AFTER, HEADER_USED_WEIGHT_1M, RequestWeightLimiter,
+    get_request_weight,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(limiter_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.mark.parametrize("path, params, weight", [
+    ("/api/v3/klines", None, 2),
+    ("/api/v3/historicalTrades", {"limit": 1000}, 25),
+    ("/api/v3/unknown", None, 1),
+    ("/api/v3/depth", None, 5),
+    ("/api/v3/depth", {"limit": 100}, 5),
+    ("/api/v3/depth", {"limit": 101}, 25),
+    ("/api/v3/depth", {"limit": 1000}, 50),
+    ("/api/v3/depth", {"limit": 5000}, 250),
+    ("/api/v3/ticker/tradingDay", {"symbol": "BTCUSDT"}, 4),
+    ("/api/v3/ticker/tradingDay", {"symbols": ["BTCUSDT", "ETHUSDT"]}, 8),
+    ("/api/v3/ticker/tradingDay", {"symbols": '["BTCUSDT","ETHUSDT","BNBUSDT"]'}, 12),
+    ("/api/v3/ticker/tradingDay", {"symbols": [str(i) for i in range(100)]}, 200),
+])
+def test_get_request_weight(path, params, weight):
+    assert get_request_weight(path, params) == weight
+
+
+def test_reserve_queues_by_deficit(clock):
+    """
+    令牌不足时按欠额和补充速率计算等待时间，时间推移后令牌恢复
+    """
+    limiter = RequestWeightLimiter(weight_limit=60, interval_seconds=60, safety_ratio=1)
+    assert limiter.reserve(60) == 0
+    assert limiter.reserve(3) == pytest.approx(3)
+    assert limiter.reserve(2) == pytest.approx(5)
+    clock.now += 65
+    assert limiter.reserve(60) == 0
+
+
+def test_update_used_weight_only_lowers_tokens(clock):
+    """
+    服务器统计的已用权重比本地多时以服务器为准，比本地少时保持本地令牌
+    """
+    limiter = RequestWeightLimiter(weight_limit=100, interval_seconds=60, safety_ratio=1)
+    limiter.update_used_weight(40)
+    assert limiter.tokens == 60
+    limiter.update_used_weight(10)
+    assert limiter.tokens == 60
+    assert limiter.used_ratio == pytest.approx(0.4)
+
+    limiter.on_response(200, {HEADER_USED_WEIGHT_1M: "100"})
+    assert limiter.tokens == 0
+    assert limiter.reserve(1) == pytest.approx(0.6)
+
+
+def test_retry_after_overrides_backoff(clock):
+    """
+    429/418带Retry-After时按其暂停，期间所有请求等待到暂停结束
+    """
+    limiter = RequestWeightLimiter(weight_limit=100, interval_seconds=60, safety_ratio=1)
+    assert limiter.on_response(429, {HEADER_RETRY_AFTER: "7"}) == 7
+    assert limiter.reserve(1) == pytest.approx(7)
+    clock.now += 7
+    assert limiter.reserve(1) == 0
+
+
+def test_exponential_backoff_and_reset(clock):
+    """
+    没有Retry-After时指数退避直到上限，正常响应后重置
+    """
+    limiter = RequestWeightLimiter()
+    seconds = [limiter.on_response(429, {}) for _ in range(8)]
+    assert seconds == [min(BACKOFF_BASE_SECONDS * 2 ** i, BACKOFF_MAX_SECONDS) for i in range(8)]
+    assert seconds[-1] == BACKOFF_MAX_SECONDS
+    assert limiter.blocked_until == clock.now + BACKOFF_MAX_SECONDS
+
+    assert limiter.on_response(200, {}) == 0
+    assert limiter.on_response(418, {}) == BACKOFF_BASE_SECONDS
+
+
+def test_concurrent_backoff_counts_every_response(clock):
+    """
+    多个线程同时收到429时每个响应都计入退避次数
+    """
+    limiter = RequestWeightLimiter()
+    threads = [threading.Thread(target=limiter.on_response, args=(429, {})) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.backoff_count == 4
+    assert limiter.blocked_until == clock.now + BACKOFF_BASE_SECONDS * 2 ** 3
@@ -0,0 +1,115 @@
+"""
+coding=utf-8
+@File   : test_order_book
+@Author : LiHan
+@Time   : 10/25/26:8:50 PM
+"""
+from core.binance.spot.order_book import MAX_BUFFERED_EVENTS, OrderBook
+
+SYMBOL = "btcusdt"
+
+
+def make_event(first_id: int, last_id: int, bids: list = None, asks: list = None) -> dict:
+    return {"U": first_id, "u": last_id, "b": bids or [], "a": asks or []}
+
+
+def make_snapshot(last_update_id: int) -> dict:
+    return {
+        "lastUpdateId": last_update_id,
+        "bids": [["100", "1"], ["99", "2"], ["98", "3"]],
+        "asks": [["101", "1"], ["102", "2"], ["103", "3"]],
+    }
+
+
+def synced_book(last_update_id: int = 10) -> OrderBook:
+    book = OrderBook(SYMBOL)
+    assert book.apply_snapshot(make_snapshot(last_update_id))
+    return book
+
+
+def test_first_event_straddles_snapshot():
+    """
+    丢弃u <= lastUpdateId的增量，第一条应用的增量满足U <= lastUpdateId + 1 <= u
+    """
+    book = OrderBook(SYMBOL)
+    assert book.on_update(make_event(1, 5, bids=[["100", "9"]]))
+    assert book.on_update(make_event(6, 10, bids=[["97", "4"]]))
+    assert book.on_update(make_event(11, 15, asks=[["101", "0"]]))
+    assert not book.synced
+
+    assert book.apply_snapshot(make_snapshot(7))
+    assert book.synced
+    assert book.last_update_id == 15
+    assert not book.buffer
+    # 1-5的增量早于快照，不应覆盖快照中100的数量
+    assert book.top(4)[0].tolist() == [[100, 1], [99, 2], [98, 3], [97, 4]]
+    assert book.best_ask == (102.0, 2.0)
+
+
+def test_snapshot_older_than_buffer():
+    """
+    快照早于缓存的第一条增量时返回False，保留缓存等待新的快照
+    """
+    book = OrderBook(SYMBOL)
+    book.on_update(make_event(20, 25))
+    book.on_update(make_event(26, 30))
+    assert not book.apply_snapshot(make_snapshot(10))
+    assert not book.synced
+    assert len(book.buffer) == 2
+    assert not book.bids
+
+    assert book.apply_snapshot(make_snapshot(22))
+    assert book.last_update_id == 30
+
+
+def test_gap_in_buffered_events_resets():
+    book = OrderBook(SYMBOL)
+    book.on_update(make_event(8, 12))
+    book.on_update(make_event(14, 16))
+    assert not book.apply_snapshot(make_snapshot(10))
+    assert not book.synced
+    assert not book.buffer
+    assert not book.bids
+
+
+def test_update_gap_resets():
+    """
+    同步后U不等于上一条u + 1时清空盘口，回到未同步状态
+    """
+    book = synced_book()
+    assert book.on_update(make_event(5, 10, bids=[["100", "9"]]))
+    assert book.best_bid == (100.0, 1.0)
+    assert book.on_update(make_event(11, 12, bids=[["100", "0"]]))
+    assert book.best_bid == (99.0, 2.0)
+
+    assert not book.on_update(make_event(14, 15))
+    assert not book.synced
+    assert book.best_bid is None
+    assert book.last_update_id == 0
+
+    # 之后的增量重新进入缓存，等待新的快照
+    assert book.on_update(make_event(16, 17))
+    assert len(book.buffer) == 1
+
+
+def test_buffer_overflow_drops_events():
+    book = OrderBook(SYMBOL)
+    for index in range(MAX_BUFFERED_EVENTS):
+        assert book.on_update(make_event(index + 1, index + 1))
+    assert not book.on_update(make_event(MAX_BUFFERED_EVENTS + 1, MAX_BUFFERED_EVENTS + 1))
+    assert not book.buffer
+
+
+def test_depth_within():
+    """
+    买盘按价格从高到低，取中间价下方ratio范围内的档位
+    """
+    book = synced_book()
+    # 中间价100.5，±1.5%为[98.9925, 102.0075]
+    assert book.depth_within(0.015) == (3.0, 3.0)
+    assert book.depth_within(0.001) == (0.0, 0.0)
+    assert book.depth_within(0.03) == (6.0, 6.0)
+
+    bids, asks = book.cumulative_depth(2)
+    assert bids.tolist() == [[100, 1], [99, 3]]
+    assert asks.tolist() == [[101, 1], [102, 3]]
@@ -0,0 +1,119 @@
+"""
+coding=utf-8
+@File   : test_rest
+@Author : LiHan
+@Time   : 10/25/26:6:30 PM
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from core.binance.spot.rest import BinanceSpotDataRestAPi
+
+SYMBOL = "BTCUSDT"
+BASE_TIME = 1700000000000
+
+
+class FakeExchange:
+    """
+    内存中的聚合交易，按Binance的分页规则响应aggTrades，每10毫秒一笔
+    """
+
+    def __init__(self, count: int):
+        self.aggs = [{"a": a, "p": "1", "q": "1", "f": 2 * a, "l": 2 * a + 1, "T": BASE_TIME + 10 * a,
+                      "m": True, "M": True} for a in range(count)]
+        self.short_pages: set[int] = set()  # 第一次请求时只返回一半数据的fromId
+        self.missing_ids: set[int] = set()  # 始终不返回的AggTradeId
+        self.latest_empty = False
+        self.from_ids: list[int] = []
+
+    def request(self, method: str, path: str, params: dict = None, **kwargs):
+        limit = params["limit"]
+        if "fromId" in params:
+            from_id = params["fromId"]
+            self.from_ids.append(from_id)
+            rows = [agg for agg in self.aggs[from_id:from_id + limit] if agg["a"] not in self.missing_ids]
+            if from_id in self.short_pages:
+                self.short_pages.discard(from_id)
+                rows = rows[:len(rows) // 2]
+        elif "startTime" in params:
+            rows = [agg for agg in self.aggs if agg["T"] >= params["startTime"]][:limit]
+        else:
+            rows = [] if self.latest_empty else self.aggs[-limit:]
+        return SimpleNamespace(content=json.dumps(rows).encode())
+
+
+def make_api(exchange: FakeExchange) -> BinanceSpotDataRestAPi:
+    api = BinanceSpotDataRestAPi()
+    api.request = exchange.request
+    return api
+
+
+def query_page(api: BinanceSpotDataRestAPi):
+    return lambda from_id, limit: api._query_agg_trades_columns(SYMBOL, limit=limit, from_id=from_id)
+
+
+def test_agg_trades_sharded_by_time():
+    exchange = FakeExchange(2500)
+    df = make_api(exchange).query_agg_trades_sharded(SYMBOL, BASE_TIME + 5, BASE_TIME + 20000)
+    assert df["AggTradeId"].tolist() == list(range(1, 2001))
+    assert (df["Symbol"] == SYMBOL).all()
+
+
+def test_find_agg_trade_id_range_empty():
+    """
+    时间范围内没有交易，或查询最新交易返回空时返回None
+    """
+    exchange = FakeExchange(100)
+    api = make_api(exchange)
+    assert api._find_agg_trade_id_range(SYMBOL, BASE_TIME + 1, BASE_TIME + 9) is None
+    assert api._find_agg_trade_id_range(SYMBOL, BASE_TIME + 10 ** 6, BASE_TIME + 10 ** 7) is None
+    assert api._find_agg_trade_id_range(SYMBOL, BASE_TIME, BASE_TIME + 10 ** 6) == (0, 99)
+
+    exchange.latest_empty = True
+    assert api._find_agg_trade_id_range(SYMBOL, BASE_TIME, BASE_TIME + 10 ** 6) is None
+
+
+def test_query_id_range_parallel_refetches_missing():
+    """
+    分片返回不完整时只重新请求缺失的ID范围
+    """
+    exchange = FakeExchange(3000)
+    exchange.short_pages.add(1000)
+    api = make_api(exchange)
+    columns = api._query_id_range_parallel(query_page(api), 0, 2999, key="AggTradeId", max_workers=4)
+    assert columns["AggTradeId"].tolist() == list(range(3000))
+    assert sorted(exchange.from_ids) == [0, 1000, 1500, 2000]
+
+
+def test_query_id_range_parallel_partial_range():
+    exchange = FakeExchange(3000)
+    api = make_api(exchange)
+    columns = api._query_id_range_parallel(query_page(api), 999, 2001, key="AggTradeId", max_workers=4)
+    assert columns["AggTradeId"].tolist() == list(range(999, 2002))
+    assert sorted(exchange.from_ids) == [999, 1999]
+
+
+def test_query_id_range_parallel_gap_raises():
+    """
+    重新请求后ID仍不连续时抛出异常
+    """
+    exchange = FakeExchange(3000)
+    exchange.missing_ids.add(1500)
+    api = make_api(exchange)
+    with pytest.raises(ValueError, match="AggTradeId不连续"):
+        api._query_id_range_parallel(query_page(api), 0, 2999, key="AggTradeId", max_workers=4)
+    assert sorted(exchange.from_ids) == [0, 1000, 1500, 2000]
+
+
+def test_find_trade_id_range_empty_latest():
+    """
+    结束时间之后没有聚合交易且查询最新聚合交易返回空时返回None
+    """
+    exchange = FakeExchange(100)
+    api = make_api(exchange)
+    assert api._find_trade_id_range(SYMBOL, BASE_TIME + 15, BASE_TIME + 10 ** 6) == (4, 199)
+
+    exchange.latest_empty = True
+    assert api._find_trade_id_range(SYMBOL, BASE_TIME + 15, BASE_TIME + 10 ** 6) is None
@@ -0,0 +1,117 @@
+"""
+coding=utf-8
+@File   : test_rest_async
+@Author : LiHan
+@Time   : 10/24/26:11:00 AM
+"""
+import asyncio
+
+import pytest
+
+from core.binance.spot.rest_async import BinanceSpotDataAsyncRestApi
+from external.common.constant import API_LIMIT_ONE_TIME
+
+SYMBOL = "BTCUSDT"
+BASE_TIME = 1700000000000
+
+
+class FakeExchange:
+    """
+    内存中的成交数据，按Binance的分页规则响应aggTrades和historicalTrades
+    每笔聚合交易包含2笔成交，同一笔聚合交易内的成交时间相同
+    """
+
+    def __init__(self, agg_times: list[int]):
+        self.aggs = [{"a": a, "p": "1", "q": "1", "f": 2 * a, "l": 2 * a + 1, "T": t, "m": True, "M": True}
+                     for a, t in enumerate(agg_times)]
+        self.trades = [{"id": i, "price": "1", "qty": "1", "quoteQty": "1", "time": agg["T"],
+                        "isBuyerMaker": True, "isBestMatch": True}
+                       for agg in self.aggs for i in (agg["f"], agg["l"])]
+        self.short_pages: set[int] = set()  # 第一次请求时只返回一半数据的fromId
+        self.missing_ids: set[int] = set()  # 始终不返回的交易ID
+        self.fail_from_id = None
+        self.page_delay = 0.0
+        self.completed_pages: list[int] = []
+
+    async def request(self, method: str, path: str, params: dict = None):
+        await asyncio.sleep(0)
+        limit = params["limit"]
+        if path == "/api/v3/aggTrades":
+            if "fromId" in params:
+                rows = [agg for agg in self.aggs if agg["a"] >= params["fromId"]]
+            elif "startTime" in params:
+                end = params.get("endTime", float("inf"))
+                rows = [agg for agg in self.aggs if params["startTime"] <= agg["T"] <= end]
+            else:
+                return self.aggs[-limit:]
+            return rows[:limit]
+
+        if "fromId" not in params:
+            return self.trades[-limit:]
+        from_id = params["fromId"]
+        if from_id == self.fail_from_id:
+            raise ConnectionError("boom")
+        if params["limit"] > 1 and self.page_delay:
+            await asyncio.sleep(self.page_delay)
+            self.completed_pages.append(from_id)
+        rows = [trade for trade in self.trades[from_id:from_id + limit] if trade["id"] not in self.missing_ids]
+        if from_id in self.short_pages:
+            self.short_pages.discard(from_id)
+            rows = rows[:len(rows) // 2]
+        return rows
+
+
+def make_api(exchange: FakeExchange) -> BinanceSpotDataAsyncRestApi:
+    api = BinanceSpotDataAsyncRestApi()
+    api.request = exchange.request
+    return api
+
+
+@pytest.fixture
+def exchange():
+    # 2500笔聚合交易(5000笔成交)，每10毫秒一笔
+    return FakeExchange([BASE_TIME + 10 * a for a in range(2500)])
+
+
+def test_historical_trades_by_time(exchange):
+    df = asyncio.run(make_api(exchange).query_historical_trades(SYMBOL, BASE_TIME + 5, BASE_TIME + 20000))
+    # 第一笔聚合交易在BASE_TIME + 10，最后一笔在BASE_TIME + 20000
+    assert df["Id"].tolist() == list(range(2, 4002))
+    assert df["Time"].between(BASE_TIME + 5, BASE_TIME + 20000).all()
+
+
+def test_historical_trades_empty_range(exchange):
+    api = make_api(exchange)
+    assert asyncio.run(api.query_historical_trades(SYMBOL, BASE_TIME + 1, BASE_TIME + 9)).empty
+    assert asyncio.run(api.query_historical_trades(SYMBOL, BASE_TIME + 10 ** 8, BASE_TIME + 10 ** 9)).empty
+
+
+def test_historical_trades_refetch_short_page(exchange):
+    exchange.short_pages.add(1000)
+    df = asyncio.run(make_api(exchange).query_historical_trades(SYMBOL, BASE_TIME, BASE_TIME + 24990))
+    assert df["Id"].tolist() == list(range(5000))
+
+
+def test_historical_trades_gap_raises(exchange):
+    exchange.missing_ids.add(1500)
+    with pytest.raises(ValueError, match="不连续"):
+        asyncio.run(make_api(exchange).query_historical_trades(SYMBOL, BASE_TIME, BASE_TIME + 24990))
+
+
+def test_failed_page_cancels_siblings(exchange):
+    exchange.fail_from_id = 2000
+    exchange.page_delay = 0.2
+    with pytest.raises(ConnectionError):
+        asyncio.run(make_api(exchange).query_historical_trades(SYMBOL, BASE_TIME, BASE_TIME + 24990))
+    # 其余分页在失败后被取消，没有等到完成
+    assert not exchange.completed_pages
+
+
+def test_agg_trades_full_page_in_one_millisecond():
+    """
+    同一毫秒内的聚合交易超过一页时按AggTradeId继续分页，不丢数据
+    """
+    count = API_LIMIT_ONE_TIME * 2 + 500
+    exchange = FakeExchange([BASE_TIME] * count + [BASE_TIME + 1, BASE_TIME + 5])
+    df = asyncio.run(make_api(exchange).query_agg_trades(SYMBOL, BASE_TIME, BASE_TIME + 1))
+    assert df["AggTradeId"].tolist() == list(range(count + 1))
@@ -0,0 +1,56 @@
+"""
+coding=utf-8
+@File   : test_shm
+@Author : LiHan
+@Time   : 10/23/26:2:30 PM
+"""
+import os
+import time
+from multiprocessing import resource_tracker
+
+import pytest
+
+from core.utils.shm import READ_TIMEOUT, MdShmReader, MdShmWriter
+
+SYMBOL = "BTCUSDT"
+
+
+@pytest.fixture
+def store():
+    writer = MdShmWriter.create(f"test_md_{os.getpid()}", [SYMBOL])
+    reader = MdShmReader.attach(writer.name)
+    yield writer, reader
+    reader.close()
+    # 同一进程中attach时的unregister会去掉创建时的登记，删除前重新登记
+    resource_tracker.register(writer.shm._name, "shared_memory")
+    writer.unlink()
+
+
+def test_read(store):
+    writer, reader = store
+    slot = writer.slots[SYMBOL]
+    writer.write_ticker(slot, 100.0, 10.0, 101.0, 99.0, 1)
+    writer.write_depth(slot, [99.9, 99.8], [1.0, 2.0], [100.1], [3.0], 2)
+
+    record = reader.read(SYMBOL)
+    assert record["seq"] == 4
+    assert record["last_price"] == 100.0
+    assert list(record["bid_prices"][:3]) == [99.9, 99.8, 0.0]
+    assert record["update_time"] == 2
+    assert reader.read("ETHUSDT") is None
+
+
+def test_read_returns_none_when_writer_stalls(store):
+    """
+    写入方在写入过程中退出时，读取方在超时后返回None而不是抛出异常
+    """
+    writer, reader = store
+    slot = writer.slots[SYMBOL]
+    writer.seq[slot] += 1
+
+    start = time.monotonic()
+    assert reader.read(slot, timeout=READ_TIMEOUT) is None
+    assert time.monotonic() - start >= READ_TIMEOUT
+
+    writer.seq[slot] += 1
+    assert reader.read(slot) is not None
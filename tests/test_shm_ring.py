@@ -0,0 +1,118 @@
+"""
+coding=utf-8
+@File   : test_shm_ring
+@Author : LiHan
+@Time   : 10/24/26:2:00 PM
+"""
+import os
+
+import numpy as np
+import pytest
+
+from core.utils.shm_ring import ShmRingBuffer
+
+CAPACITY = 8
+RECORD_DTYPE = np.dtype([("value", "i8")])
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRingBuffer.create(f"test_ring_{os.getpid()}", RECORD_DTYPE, CAPACITY)
+    yield ring
+    ring.unlink()
+
+
+def append(ring: ShmRingBuffer, start: int, count: int):
+    for value in range(start, start + count):
+        ring.append((value,))
+
+
+def values(views: list[np.ndarray]) -> list[int]:
+    return [int(value) for view in views for value in view["value"]]
+
+
+def test_read_from_cursor(ring):
+    append(ring, 0, 5)
+    views, cursor, lost = ring.read(0)
+    assert len(views) == 1
+    assert values(views) == [0, 1, 2, 3, 4]
+    assert (cursor, lost) == (5, 0)
+
+    views, cursor, lost = ring.read(cursor)
+    assert (views, cursor, lost) == ([], 5, 0)
+
+    views, cursor, _ = ring.read(2, max_count=2)
+    assert values(views) == [2, 3]
+    assert cursor == 4
+
+
+def test_read_wrap_around(ring):
+    append(ring, 0, 6)
+    _, cursor, _ = ring.read(0)
+    append(ring, 6, 5)
+
+    views, cursor, lost = ring.read(cursor)
+    # 第6到第10条跨过数组末尾，分两段返回
+    assert len(views) == 2
+    assert values(views) == [6, 7, 8, 9, 10]
+    assert (cursor, lost) == (11, 0)
+    # 视图直接引用共享内存，不拷贝
+    assert all(np.shares_memory(view, ring.records) for view in views)
+
+
+def test_read_lost_when_reader_falls_behind(ring):
+    append(ring, 0, 20)
+    views, cursor, lost = ring.read(0)
+    # 写入方可能正在写下一个槽位，最多读到最近的capacity - 1条
+    assert values(views) == list(range(20 - CAPACITY + 1, 20))
+    assert (cursor, lost) == (20, 20 - CAPACITY + 1)
+
+
+def test_is_valid_after_overwrite(ring):
+    append(ring, 0, 4)
+    views, cursor, _ = ring.read(0)
+    begin = cursor - len(values(views))
+    assert ring.is_valid(begin)
+
+    # 处理视图的过程中写入方追上并覆盖了第0条
+    append(ring, 4, CAPACITY)
+    assert not ring.is_valid(begin)
+    assert ring.is_valid(ring.head - CAPACITY + 1)
+
+
+def test_read_copy(ring):
+    append(ring, 0, 6)
+    _, cursor, _ = ring.read(0)
+    append(ring, 6, 5)
+
+    records, cursor, lost = ring.read_copy(cursor - 2)
+    assert records.flags["C_CONTIGUOUS"] and not np.shares_memory(records, ring.records)
+    assert records["value"].tolist() == [4, 5, 6, 7, 8, 9, 10]
+    assert (cursor, lost) == (11, 0)
+
+    append(ring, 11, 20)
+    records, cursor, lost = ring.read_copy(cursor)
+    assert records["value"].tolist() == list(range(31 - CAPACITY + 1, 31))
+    assert (cursor, lost) == (31, 20 - CAPACITY + 1)
+
+
+def test_read_copy_retries_after_overwrite(ring, monkeypatch):
+    """
+    拷贝过程中被覆盖时，read_copy从仍有效的位置重新读取
+    """
+    append(ring, 0, 4)
+    read = ring.read
+    calls = []
+
+    def read_then_overwrite(cursor, max_count=None):
+        result = read(cursor, max_count)
+        if not calls:
+            append(ring, 4, CAPACITY)
+        calls.append(cursor)
+        return result
+
+    monkeypatch.setattr(ring, "read", read_then_overwrite)
+    records, cursor, lost = ring.read_copy(0)
+    assert len(calls) == 2
+    assert records["value"].tolist() == list(range(12 - CAPACITY + 1, 12))
+    assert (cursor, lost) == (12, 12 - CAPACITY + 1)
@@ -0,0 +1,181 @@
+"""
+coding=utf-8
+@File   : test_storage
+@Author : LiHan
+@Time   : 10/25/26:11:00 PM
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from core.utils.storage import (
+    DATASET_AGG_TRADERS, DATASET_KLINES, DAY_MILLISECONDS, FORMAT_ARROW, FORMAT_CSV, FORMAT_PARQUET, ParquetStorage,
+    create_storage, get_dataset_name, get_trading_day,
+)
+
+SYMBOLS = ["BTCUSDT", "ETHUSDT"]
+DAYS = ["2024-01-01", "2024-01-02", "2024-01-03"]
+FIRST_DAY_TIMESTAMP = 1704067200000  # 2024-01-01 00:00:00 UTC
+
+
+def make_trades(symbol: str, day: str, count: int = 4, start_id: int = 0) -> pd.DataFrame:
+    day_start = FIRST_DAY_TIMESTAMP + DAYS.index(day) * DAY_MILLISECONDS
+    ids = list(range(start_id, start_id + count))
+    timestamps = [day_start + index * 3600 * 1000 for index in ids]
+    return pd.DataFrame({
+        "AggTradeId": ids,
+        "Price": [100.0 + index for index in ids],
+        "Quantity": [0.5] * count,
+        "FirstTradeId": ids,
+        "LastTradeId": ids,
+        "TradeTimestamp": timestamps,
+        "IsBuyerMaker": [index % 2 == 0 for index in ids],
+        "IsBestPriceMatch": [True] * count,
+        "Turnover": [(100.0 + index) * 0.5 for index in ids],
+        "LocalTime": timestamps,
+        "Symbol": [symbol] * count,
+        "Exchange": ["BINANCE"] * count,
+        "TradingDay": [day] * count,
+    })
+
+
+@pytest.fixture(params=[FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW])
+def storage(request, tmp_path):
+    return create_storage(str(tmp_path / "data"), request.param)
+
+
+@pytest.fixture(params=[FORMAT_PARQUET, FORMAT_ARROW])
+def columnar_storage(request, tmp_path):
+    return create_storage(str(tmp_path / "data"), request.param)
+
+
+def fill(storage):
+    for symbol in SYMBOLS:
+        for day in DAYS:
+            storage.write(make_trades(symbol, day), symbol, DATASET_AGG_TRADERS, day)
+
+
+def test_round_trip_appends(storage):
+    """
+    同一交易日分多次追加，读取时按写入顺序合并
+    """
+    first, second = make_trades(SYMBOLS[0], DAYS[0]), make_trades(SYMBOLS[0], DAYS[0], start_id=4)
+    storage.append(first, SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    storage.append(second, SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert storage.exists(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert not storage.exists(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[1])
+
+    res = storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    pd.testing.assert_frame_equal(res, pd.concat([first, second], ignore_index=True), check_dtype=False)
+    assert storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[1]).empty
+
+    res = storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0], columns=["AggTradeId", "Price"])
+    assert res.columns.tolist() == ["AggTradeId", "Price"]
+
+
+def test_write_overwrites_day(storage):
+    storage.write(make_trades(SYMBOLS[0], DAYS[0], count=4), SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    storage.write(make_trades(SYMBOLS[0], DAYS[0], count=2), SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])["AggTradeId"].tolist() == [0, 1]
+
+    storage.remove(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert not storage.exists(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+
+
+def test_read_filters_symbols_days_and_time(storage):
+    fill(storage)
+    res = storage.read(SYMBOLS, DATASET_AGG_TRADERS, start_day=DAYS[1], end_day=DAYS[2])
+    assert len(res) == 2 * 2 * 4
+    assert set(res["TradingDay"]) == set(DAYS[1:])
+
+    start = FIRST_DAY_TIMESTAMP + DAY_MILLISECONDS + 3600 * 1000
+    end = FIRST_DAY_TIMESTAMP + 2 * DAY_MILLISECONDS + 3600 * 1000
+    res = storage.read(SYMBOLS[1], DATASET_AGG_TRADERS, start_timestamp=start, end_timestamp=end,
+                       columns=["TradeTimestamp", "Symbol"])
+    assert res.columns.tolist() == ["TradeTimestamp", "Symbol"]
+    assert sorted(res["TradeTimestamp"].tolist()) == [start, start + 3600 * 1000, start + 7200 * 1000,
+                                                      end - 3600 * 1000, end]
+    assert set(res["Symbol"]) == {SYMBOLS[1]}
+
+    assert storage.read("XRPUSDT", DATASET_AGG_TRADERS).empty
+
+
+def test_columnar_schema_cast(columnar_storage):
+    """
+    写入时按数据集的schema转换类型，多余的列被丢弃
+    """
+    df = make_trades(SYMBOLS[0], DAYS[0])
+    df["AggTradeId"] = df["AggTradeId"].astype("int32")
+    df["Unknown"] = 1
+    columnar_storage.append(df, SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    res = columnar_storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert "Unknown" not in res.columns
+    assert res["AggTradeId"].dtype == "int64"
+
+
+def test_hive_partition_layout_and_pruning(columnar_storage):
+    """
+    按hive风格分区，交易日条件只读取范围内的分区，范围外损坏的文件不影响读取
+    """
+    fill(columnar_storage)
+    path = columnar_storage.get_partition_path(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[2])
+    assert path.endswith(os.path.join("exchange=BINANCE", f"symbol={SYMBOLS[0]}",
+                                      f"dataset={DATASET_AGG_TRADERS}", f"day={DAYS[2]}"))
+    with open(os.path.join(path, f"part-00001{columnar_storage.suffix}"), "wb") as f:
+        f.write(b"not a valid file")
+
+    res = columnar_storage.read(SYMBOLS, DATASET_AGG_TRADERS, start_day=DAYS[0], end_day=DAYS[1])
+    assert sorted(set(res["TradingDay"])) == DAYS[:2]
+    assert "day" not in res.columns
+    with pytest.raises(Exception):
+        columnar_storage.read(SYMBOLS, DATASET_AGG_TRADERS, start_day=DAYS[2])
+
+
+def test_failed_write_leaves_no_part(columnar_storage, monkeypatch):
+    """
+    先写"."开头的临时文件再重命名，写入中断时不会留下不完整的数据文件，读取时忽略临时文件
+    """
+    columnar_storage.append(make_trades(SYMBOLS[0], DAYS[0]), SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    write_table = columnar_storage._write_table
+
+    def interrupted_write(table, path):
+        write_table(table.slice(0, 1), path)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(columnar_storage, "_write_table", interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        columnar_storage.append(make_trades(SYMBOLS[0], DAYS[0], start_id=4), SYMBOLS[0], DATASET_AGG_TRADERS,
+                                DAYS[0])
+
+    partition_path = columnar_storage.get_partition_path(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert sorted(os.listdir(partition_path)) == [f".part-00001{columnar_storage.suffix}.tmp",
+                                                  f"part-00000{columnar_storage.suffix}"]
+    assert columnar_storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])["AggTradeId"].tolist() == [0, 1, 2, 3]
+    assert len(columnar_storage.read(SYMBOLS[0], DATASET_AGG_TRADERS)) == 4
+
+    monkeypatch.setattr(columnar_storage, "_write_table", write_table)
+    columnar_storage.append(make_trades(SYMBOLS[0], DAYS[0], start_id=4), SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])
+    assert len(columnar_storage.read_day(SYMBOLS[0], DATASET_AGG_TRADERS, DAYS[0])) == 8
+
+
+def test_csv_layout(tmp_path):
+    """
+    CSV保持原有的目录结构，K线按周期分目录
+    """
+    storage = create_storage(str(tmp_path), FORMAT_CSV)
+    dataset = get_dataset_name(DATASET_KLINES, "1m")
+    assert storage.get_partition_path(SYMBOLS[0], dataset, DAYS[0]) == os.path.join(
+        str(tmp_path), "BINANCE", "spot", SYMBOLS[0], "1m", f"{DAYS[0]}_{DATASET_KLINES}.csv")
+
+
+def test_create_storage():
+    assert isinstance(create_storage("/tmp", FORMAT_PARQUET), ParquetStorage)
+    with pytest.raises(ValueError):
+        create_storage("/tmp", "orc")
+
+
+def test_get_trading_day():
+    assert get_trading_day(FIRST_DAY_TIMESTAMP) == DAYS[0]
+    assert get_trading_day(FIRST_DAY_TIMESTAMP + DAY_MILLISECONDS - 1) == DAYS[0]
+    assert get_trading_day(FIRST_DAY_TIMESTAMP + DAY_MILLISECONDS) == DAYS[1]
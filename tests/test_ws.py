@@ -0,0 +1,98 @@
+"""
+coding=utf-8
+@File   : test_ws
+@Author : LiHan
+@Time   : 10/25/26:11:40 PM
+"""
+import json
+
+import pytest
+
+from core.binance.spot.ws import (
+    ASK_VOLUME, BID_PRICE, BID_VOLUME, CHANNELS, BinanceSpotDataWebsocketApi,
+)
+from external.common.object import Exchange, SubscribeRequest
+
+SYMBOL = "btcusdt"
+EVENT_TIME = 1700000000000
+
+
+def make_message(channel: str, data: dict) -> str:
+    return json.dumps({"stream": f"{SYMBOL}@{channel}", "data": data})
+
+
+def make_kline(closed: bool) -> dict:
+    return {"e": "kline", "E": EVENT_TIME, "s": SYMBOL.upper(), "k": {
+        "t": EVENT_TIME - 60000, "T": EVENT_TIME - 1, "s": SYMBOL.upper(), "i": "1m", "o": "100.0", "c": "101.0",
+        "h": "102.0", "l": "99.0", "v": "10.0", "n": 5, "x": closed, "q": "1005.0", "V": "4.0", "Q": "402.0",
+    }}
+
+
+@pytest.fixture
+def api() -> BinanceSpotDataWebsocketApi:
+    api = BinanceSpotDataWebsocketApi()
+    api.subscribe(SubscribeRequest(symbol=SYMBOL, exchange=Exchange.BINANCE))
+    return api
+
+
+def test_subscribe_builds_handler_table(api):
+    assert sorted(api.handlers) == sorted(f"{SYMBOL}@{channel}" for channel in CHANNELS)
+    assert api.streams == [f"{SYMBOL}@{channel}" for channel in CHANNELS]
+    handler, state, _, latency = api.handlers[f"{SYMBOL}@depth10"]
+    assert handler == api._on_depth
+    assert state is api.states[SYMBOL]
+    # depth10推送不带事件时间，不统计延迟
+    assert latency is None
+
+
+def test_ticker(api):
+    api.process_message(make_message("ticker", {
+        "e": "24hrTicker", "E": EVENT_TIME, "s": SYMBOL.upper(), "o": "100.0", "h": "110.0", "l": "90.0",
+        "c": "105.5", "v": "1234.5", "q": "130000.0",
+    }))
+    tick = api.ticks[SYMBOL]
+    assert (tick.last_price, tick.open_price, tick.high_price, tick.low_price) == (105.5, 100.0, 110.0, 90.0)
+    assert (tick.volume, tick.turnover, tick.exchange_time) == (1234.5, 130000.0, EVENT_TIME)
+
+
+def test_depth10_updates_array_and_tick_levels(api):
+    """
+    盘口写入预分配的数组，同时保留TickData的bid_price_N等字段，不足的档位为0
+    """
+    bids = [[f"{100 - n}.0", f"{n + 1}.0"] for n in range(10)]
+    asks = [[f"{101 + n}.0", f"{n + 2}.0"] for n in range(3)]
+    api.process_message(make_message("depth10", {"lastUpdateId": 1, "bids": bids, "asks": asks}))
+
+    tick = api.ticks[SYMBOL]
+    depth = tick.extra["depth"]
+    assert depth is api.states[SYMBOL].depth
+    assert depth[BID_PRICE].tolist() == [100.0 - n for n in range(10)]
+    assert depth[ASK_VOLUME].tolist() == [2.0, 3.0, 4.0] + [0.0] * 7
+    assert (tick.bid_price_1, tick.bid_volume_1, tick.bid_price_10, tick.bid_volume_10) == (100.0, 1.0, 91.0, 10.0)
+    assert (tick.ask_price_1, tick.ask_volume_3, tick.ask_price_4, tick.ask_volume_10) == (101.0, 4.0, 0.0, 0.0)
+
+    # 档位减少时旧的档位被清零
+    api.process_message(make_message("depth10", {"lastUpdateId": 2, "bids": bids[:1], "asks": asks}))
+    assert (tick.bid_price_1, tick.bid_price_2) == (100.0, 0.0)
+    assert depth[BID_VOLUME][1] == 0
+
+
+def test_kline_only_closed(api):
+    tick = api.ticks[SYMBOL]
+    api.process_message(make_message("kline_1m", make_kline(closed=False)))
+    assert "kline" not in tick.extra
+
+    api.process_message(make_message("kline_1m", make_kline(closed=True)))
+    kline = tick.extra["kline"]
+    assert kline.symbol == SYMBOL.upper()
+    assert (kline.open, kline.high, kline.low, kline.close) == (100.0, 102.0, 99.0, 101.0)
+    assert (kline.volume, kline.turnover, kline.exchange_time) == (10.0, 1005.0, EVENT_TIME)
+
+
+def test_ack_and_unknown_stream(api):
+    api.pending_acks[7] = [f"{SYMBOL}@ticker"]
+    api.process_message(json.dumps({"result": None, "id": 7}))
+    assert not api.pending_acks
+
+    api.process_message(json.dumps({"stream": "ethusdt@ticker", "data": {}}))
+    assert "ethusdt" not in api.ticks
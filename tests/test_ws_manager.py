@@ -0,0 +1,104 @@
+"""
+coding=utf-8
+@File   : test_ws_manager
+@Author : LiHan
+@Time   : 10/26/26:10:10 AM
+"""
+import threading
+import time
+
+import pytest
+
+from core.binance.spot.ws import CHANNELS, BinanceSpotDataWebsocketApi
+from core.binance.spot.ws_manager import BinanceSpotDataWebsocketManager
+from core.utils.constant import WEBSOCKET_MAX_STREAMS_PER_CONNECTION, WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE
+from external.common.object import Exchange, SubscribeRequest
+
+
+def make_requests(count: int, start: int = 0) -> list[SubscribeRequest]:
+    return [SubscribeRequest(symbol=f"sym{index}usdt", exchange=Exchange.BINANCE)
+            for index in range(start, start + count)]
+
+
+@pytest.fixture
+def connections(monkeypatch) -> list[BinanceSpotDataWebsocketApi]:
+    """
+    不建立真实连接，记录每个分片的BinanceSpotDataWebsocketApi
+    """
+    apis = []
+    monkeypatch.setattr(BinanceSpotDataWebsocketApi, "connect",
+                        lambda self, proxy_host, proxy_port, host=None: apis.append(self))
+    return apis
+
+
+def test_symbols_per_connection():
+    manager = BinanceSpotDataWebsocketManager()
+    assert manager.symbols_per_connection == WEBSOCKET_MAX_STREAMS_PER_CONNECTION // len(CHANNELS) == 341
+
+    manager.subscribe(make_requests(700))
+    assert [len(shard) for shard in manager.shards] == [341, 341, 18]
+    manager.subscribe(make_requests(10, start=695))
+    assert [len(shard) for shard in manager.shards] == [341, 341, 23]
+
+
+def test_shards_after_connect(connections):
+    """
+    连接后新增的symbol先填满最后一个分片，分片已满时新建连接
+    """
+    manager = BinanceSpotDataWebsocketManager(max_streams_per_connection=3 * len(CHANNELS))
+    manager.subscribe(make_requests(4))
+    manager.connect()
+    assert connections == manager.apis
+    assert [sorted(api.ticks) for api in manager.apis] == [["sym0usdt", "sym1usdt", "sym2usdt"], ["sym3usdt"]]
+
+    manager.subscribe(make_requests(3, start=4))
+    assert [len(api.ticks) for api in manager.apis] == [3, 3, 1]
+    assert all(len(api.streams) <= 3 * len(CHANNELS) for api in manager.apis)
+    assert len(manager.ticks) == 7
+
+
+def test_process_mode_rejects_subscribe_after_connect():
+    manager = BinanceSpotDataWebsocketManager(use_process=True)
+    manager.connected = True
+    with pytest.raises(RuntimeError):
+        manager.subscribe(make_requests(1))
+
+
+def test_api_stream_limit():
+    """
+    单个连接订阅的stream数量不能超过1024
+    """
+    api = BinanceSpotDataWebsocketApi()
+    for req in make_requests(WEBSOCKET_MAX_STREAMS_PER_CONNECTION // len(CHANNELS)):
+        api.subscribe(req)
+    assert len(api.streams) == 1023
+    with pytest.raises(ValueError, match="1024"):
+        api.subscribe(make_requests(1, start=10000)[0])
+    assert len(api.streams) == 1023
+    assert "sym10000usdt" not in api.ticks
+
+
+def test_sender_batches_subscriptions():
+    """
+    排队的订阅合并后按每个SUBSCRIBE最多200个stream发送，发送间隔满足每秒消息数量限制
+    """
+    api = BinanceSpotDataWebsocketApi()
+    api.active = True
+    api.websocket_app = object()
+    sent = []
+    api.send = lambda packet: sent.append((time.monotonic(), packet))
+
+    streams = [f"sym{index}usdt@ticker" for index in range(450)]
+    for index in range(0, len(streams), 150):
+        api.subscription_queue.put(streams[index:index + 150])
+    threading.Thread(target=api._run_sender, daemon=True).start()
+
+    deadline = time.monotonic() + 5
+    while len(sent) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    packets = [packet for _, packet in sent]
+    assert [len(packet["params"]) for packet in packets] == [WEBSOCKET_MAX_STREAMS_PER_SUBSCRIBE, 200, 50]
+    assert [stream for packet in packets for stream in packet["params"]] == streams
+    assert all(packet["method"] == "SUBSCRIBE" for packet in packets)
+    assert sorted(api.pending_acks) == [packet["id"] for packet in packets]
+    assert sent[1][0] - sent[0][0] >= 0.2
@@ -0,0 +1,48 @@
+"""
+coding=utf-8
+@File   : test_ws_pipeline
+@Author : LiHan
+@Time   : 10/23/26:4:00 PM
+"""
+import os
+import time
+
+import pytest
+
+from core.binance.spot.simulator import BinanceSimulator
+from core.binance.spot.ws import WS_MESSAGES, BinanceSpotDataWebsocketApi
+from core.binance.spot.ws_pipeline import BACKPRESSURE_BLOCK, WebsocketDecodePipeline
+
+SYMBOL = "btcusdt"
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = WebsocketDecodePipeline(decoders=1, queue_size=64 * 1024, backpressure=BACKPRESSURE_BLOCK,
+                                       block_timeout=1.0, md_store_prefix=f"test_pipeline_{os.getpid()}")
+    pipeline.start([SYMBOL])
+    yield pipeline
+    pipeline.stop()
+
+
+def test_dead_decoder_drops_without_blocking(pipeline):
+    """
+    解码进程退出后队列写满，阻塞模式下消息直接丢弃，不再每条等待block_timeout
+    """
+    api = BinanceSpotDataWebsocketApi()
+    api.set_pipeline(pipeline)
+    process = pipeline.processes[0]
+    process.kill()
+    process.join()
+
+    message = BinanceSimulator().make_stream_message(f"{SYMBOL}@ticker")
+    messages = WS_MESSAGES.value
+    count = pipeline.queue_size // len(message) + 10
+    start = time.perf_counter()
+    for _ in range(count):
+        api.on_message(message)
+    assert time.perf_counter() - start < pipeline.block_timeout
+
+    assert WS_MESSAGES.value - messages == count
+    assert pipeline.dropped[0].value > 0
+    assert pipeline.dropped[0].value + pipeline.queues[0].frames == count
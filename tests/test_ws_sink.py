@@ -0,0 +1,57 @@
+"""
+coding=utf-8
+@File   : test_ws_sink
+@Author : LiHan
+@Time   : 10/23/26:3:10 PM
+"""
+import json
+
+import pyarrow as pa
+
+from core.binance.spot.simulator import BinanceSimulator
+from core.binance.spot.ws import DEFAULT_KLINES_TABLE, DEFAULT_TICKS_TABLE, BinanceSpotDataWebsocketApi
+from core.utils.clickhouse_sink import ClickhouseSink
+from core.utils.storage import KLINES_SCHEMA, TICKS_SCHEMA
+from external.common.object import Exchange, SubscribeRequest
+
+SYMBOL = "btcusdt"
+
+
+class FakeClickhouseClient:
+    def __init__(self):
+        self.tables: dict[str, list[pa.Table]] = {}
+
+    def insert_arrow(self, table_name: str, table: pa.Table, settings: dict = None):
+        self.tables.setdefault(table_name, []).append(table)
+
+
+def test_simulator_messages_to_sink(tmp_path):
+    """
+    模拟服务推送的ticker和完整K线经过websocket解析后按schema写入ClickHouse
+    """
+    client = FakeClickhouseClient()
+    sink = ClickhouseSink(client, str(tmp_path / "spill"))
+    api = BinanceSpotDataWebsocketApi()
+    api.set_sink(sink)
+    api.subscribe(SubscribeRequest(symbol=SYMBOL, exchange=Exchange.BINANCE))
+
+    simulator = BinanceSimulator()
+    api.process_message(simulator.make_stream_message(f"{SYMBOL}@ticker"))
+    closed = 0
+    # 模拟服务按固定随机种子在部分推送中给出完整K线
+    while not closed:
+        message = simulator.make_stream_message(f"{SYMBOL}@kline_1m")
+        closed += json.loads(message)["data"]["k"]["x"]
+        api.process_message(message)
+    sink.flush(force=True)
+
+    ticks = pa.concat_tables(client.tables[DEFAULT_TICKS_TABLE])
+    assert ticks.schema == TICKS_SCHEMA
+    assert ticks.num_rows == 1
+    assert ticks["Symbol"][0].as_py() == SYMBOL.upper()
+
+    klines = pa.concat_tables(client.tables[DEFAULT_KLINES_TABLE])
+    assert klines.schema == KLINES_SCHEMA
+    assert klines.num_rows == closed
+    assert klines["TakerBuyBaseAssetVolume"][0].as_py() > 0
+    assert not list(tmp_path.joinpath("spill").glob("*/*.arrow"))